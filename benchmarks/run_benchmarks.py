@@ -0,0 +1,504 @@
+"""Benchmarks of the per-item orchestration overhead of fan-out tasks.
+
+Synthetic workloads are generated in the work directory and every scenario
+runs in its own process, so that peak RSS is measured per scenario. Results
+are written as JSON, so that runs can be compared over time.
+
+Usage:
+    python benchmarks/run_benchmarks.py -output results.json
+    python benchmarks/run_benchmarks.py -scale 0.01 -scenarios lines files
+    python benchmarks/run_benchmarks.py -baseline results.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import platform
+import resource
+import subprocess
+from datetime import datetime
+from typing import Any, Dict, List
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIRECTORY)
+
+# Workload sizes at scale 1
+LINES_COUNT = 1000000
+FILES_COUNT = 100000
+FILES_PER_DIRECTORY = 1000
+NESTED_FILES_COUNT = 100
+NESTED_LINES_COUNT = 1000
+
+# Scenario name to (workload, fraction of items completed by an earlier run)
+SCENARIOS = {
+    "lines": ("lines", 0),
+    "files": ("files", 0),
+    "nested": ("nested", 0),
+    "lines-resume-50": ("lines", 0.5),
+    "lines-resume-90": ("lines", 0.9),
+    "files-resume-50": ("files", 0.5),
+    "files-resume-90": ("files", 0.9),
+}
+
+NO_OP_TASK_TYPE = "benchmark-no-op"
+
+NO_OP_SCRIPT = "#!/bin/sh\nexit 0\n"
+
+
+def _register_no_op_task() -> None:
+    """Registers task doing nothing, so that only orchestration is measured.
+
+    The task fails when the number in the base name of its value is above
+    fail-above, which is used to complete only a part of the items before a
+    resume.
+    """
+    from pypelines.task import PipelineTask, TaskInputSchema
+    from pypelines.tasks import tasks, _add_task
+
+    class NoOpTask(PipelineTask):
+        """Task doing nothing."""
+
+        task_type: str = NO_OP_TASK_TYPE
+
+        task_input_schema: List[TaskInputSchema] = [
+            TaskInputSchema(name="value", description="Item value"),
+            TaskInputSchema(
+                name="fail-above",
+                description="Fails when the item number is above this value",
+                value_type=int,
+                default_value=0,
+            ),
+        ]
+
+        def __init__(
+            self,
+            name: str,
+            task_input_values: Dict[str, Any],
+            pipeline_parameters: Dict[str, Any],
+            pipeline_options: Any,
+            extra_parameters: Dict[str, Any],
+        ) -> None:
+            super().__init__(
+                name,
+                task_input_values,
+                pipeline_parameters,
+                pipeline_options,
+                extra_parameters,
+            )
+
+        def run(self) -> None:
+            inputs = self.get_parsed_inputs()
+
+            fail_above = inputs["fail-above"]
+            if fail_above > 0:
+                number = int(re.sub(r"\D", "", os.path.basename(inputs["value"])))
+                if number > fail_above:
+                    raise Exception(f"Item {number} is not completed yet")
+
+    if NO_OP_TASK_TYPE not in tasks:
+        _add_task(NoOpTask)
+
+
+def _get_sub_task(parameter_name: str, use_script: bool) -> Dict[str, Any]:
+    """Returns config of the task run for each item."""
+    if use_script:
+        return {
+            "task": "script",
+            "name": f"Item ${{{{parameters.{parameter_name}}}}}",
+            "inputs": {
+                "script": NO_OP_SCRIPT,
+                "arguments": [f"${{{{parameters.{parameter_name}}}}}"],
+            },
+        }
+
+    return {
+        "task": NO_OP_TASK_TYPE,
+        "name": f"Item ${{{{parameters.{parameter_name}}}}}",
+        "inputs": {
+            "value": f"${{{{parameters.{parameter_name}}}}}",
+            "fail-above": "${{parameters.fail-above}}",
+        },
+    }
+
+
+def _get_pipeline_config(
+    workload: str, work_directory: str, options: argparse.Namespace
+) -> Dict[str, Any]:
+    """Returns pipeline config of the workload."""
+    lines_task = {
+        "task": "for-each-line-of-file",
+        "name": "For each line",
+        "inputs": {
+            "threads": options.threads,
+            "file-path": os.path.join(work_directory, "lines.txt"),
+            "output-parameter-name": "line",
+            # Lines are dispatched in order, so the earlier run stops around
+            # the first failed line
+            "fail-fast": "${{parameters.fail-fast}}",
+            "tasks": [_get_sub_task("line", options.script)],
+        },
+    }
+
+    files_task = {
+        "task": "for-each-file",
+        "name": "For each file",
+        "inputs": {
+            "threads": options.threads,
+            "glob-pattern": os.path.join(work_directory, "files", "*", "*.txt"),
+            "include-subdirectories": False,
+            "output-parameter-name": "file",
+            "tasks": [_get_sub_task("file", options.script)],
+        },
+    }
+
+    nested_task = {
+        "task": "for-each-file",
+        "name": "For each file",
+        "inputs": {
+            "threads": options.threads,
+            "glob-pattern": os.path.join(work_directory, "nested", "*.txt"),
+            "include-subdirectories": False,
+            "output-parameter-name": "file",
+            "tasks": [
+                {
+                    "task": "for-each-line-of-file",
+                    "name": "For each line of ${{parameters.file}}",
+                    "inputs": {
+                        "threads": options.threads,
+                        "file-path": "${{parameters.file}}",
+                        "output-parameter-name": "line",
+                        "tasks": [_get_sub_task("line", options.script)],
+                    },
+                }
+            ],
+        },
+    }
+
+    return {
+        "parameters": [
+            {"name": "fail-above", "default": "0"},
+            {"name": "fail-fast", "default": "false"},
+        ],
+        "config": {
+            "name": f"Benchmark {workload}",
+            "use-snapshots": True,
+            "snapshot-backend": options.backend,
+        },
+        "tasks": [
+            {"lines": lines_task, "files": files_task, "nested": nested_task}[
+                workload
+            ]
+        ],
+    }
+
+
+def _write_lines(path: str, count: int, prefix: str = "") -> None:
+    """Writes file with count numbered lines."""
+    with open(path, "w") as f:
+        for number in range(1, count + 1):
+            f.write(f"{prefix}{number}\n")
+
+
+def create_workloads(work_directory: str, scale: float) -> Dict[str, int]:
+    """Creates input files of the workloads, and returns number of items of
+    each workload. Existing files of the same scale are reused."""
+    counts = {
+        "lines": max(1, int(LINES_COUNT * scale)),
+        "files": max(1, int(FILES_COUNT * scale)),
+        "nested": max(1, int(NESTED_FILES_COUNT * scale**0.5))
+        * max(1, int(NESTED_LINES_COUNT * scale**0.5)),
+    }
+
+    marker_path = os.path.join(work_directory, "workloads.json")
+    if os.path.isfile(marker_path):
+        with open(marker_path) as f:
+            if json.load(f) == counts:
+                return counts
+
+    shutil.rmtree(work_directory, ignore_errors=True)
+    os.makedirs(work_directory)
+
+    _write_lines(os.path.join(work_directory, "lines.txt"), counts["lines"])
+
+    for number in range(1, counts["files"] + 1):
+        directory = os.path.join(
+            work_directory, "files", f"d{(number - 1) // FILES_PER_DIRECTORY:04d}"
+        )
+        if (number - 1) % FILES_PER_DIRECTORY == 0:
+            os.makedirs(directory)
+
+        with open(os.path.join(directory, f"f{number:07d}.txt"), "w") as f:
+            f.write(f"{number}\n")
+
+    nested_directory = os.path.join(work_directory, "nested")
+    os.makedirs(nested_directory)
+    nested_files_count = max(1, int(NESTED_FILES_COUNT * scale**0.5))
+    for number in range(1, nested_files_count + 1):
+        _write_lines(
+            os.path.join(nested_directory, f"f{number:05d}.txt"),
+            counts["nested"] // nested_files_count,
+            prefix=f"{number}-",
+        )
+
+    with open(marker_path, "w") as f:
+        json.dump(counts, f)
+
+    return counts
+
+
+def _get_peak_rss_mb() -> float:
+    """Returns peak resident set size of this process in megabytes."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Bytes on macOS, kilobytes on Linux
+    if sys.platform == "darwin":
+        return max_rss / 1024 / 1024
+
+    return max_rss / 1024
+
+
+def _load_pipeline(pipeline_config: Dict[str, Any], parameters: Dict[str, Any]):
+    """Returns loaded pipeline."""
+    from pypelines.pipeline import Pipeline
+
+    pipeline = Pipeline()
+    pipeline.load(pipeline_config, parameters)
+
+    return pipeline
+
+
+def run_scenario(
+    scenario: str, items_count: int, options: argparse.Namespace
+) -> Dict[str, Any]:
+    """Runs the scenario in this process and returns its measurements."""
+    _register_no_op_task()
+
+    workload, completed_fraction = SCENARIOS[scenario]
+    pipeline_config = _get_pipeline_config(workload, options.work_directory, options)
+
+    completed_before = 0
+    if completed_fraction:
+        # Earlier run completes only a part of the items
+        pipeline = _load_pipeline(
+            pipeline_config,
+            {
+                "fail-above": str(int(items_count * completed_fraction)),
+                "fail-fast": str(workload == "lines").lower(),
+            },
+        )
+        try:
+            pipeline.run()
+        except Exception:
+            pass
+
+        completed_before = pipeline.snapshot_store.count_completed_tasks(
+            pipeline.options.pipeline_id
+        )
+
+    start = time.perf_counter()
+    pipeline = _load_pipeline(pipeline_config, {})
+    load_seconds = time.perf_counter() - start
+    pipeline.run()
+    seconds = time.perf_counter() - start
+
+    store_stats = pipeline.snapshot_store.get_stats()
+    store_calls = sum(stats["calls"] for stats in store_stats.values())
+    store_seconds = sum(stats["total_seconds"] for stats in store_stats.values())
+
+    return {
+        "scenario": scenario,
+        "items": items_count,
+        "items_completed_before": completed_before,
+        "seconds": round(seconds, 3),
+        "load_seconds": round(load_seconds, 3),
+        "items_per_second": round(items_count / seconds, 1),
+        "overhead_us_per_item": round(seconds / items_count * 1e6, 2),
+        "peak_rss_mb": round(_get_peak_rss_mb(), 1),
+        "store_calls": store_calls,
+        "store_calls_per_item": round(store_calls / items_count, 4),
+        "store_seconds": round(store_seconds, 3),
+        "store_calls_by_operation": {
+            operation: stats["calls"]
+            for operation, stats in sorted(store_stats.items())
+        },
+    }
+
+
+def _get_git_commit() -> str:
+    """Returns commit of the benchmarked tree, None outside of a git repo."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT_DIRECTORY,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _run_child(scenario: str, items_count: int, options: argparse.Namespace):
+    """Runs the scenario in a new process and returns its measurements."""
+    result_path = os.path.join(options.work_directory, f"result-{scenario}.json")
+    if os.path.exists(result_path):
+        os.unlink(result_path)
+
+    environment = os.environ.copy()
+    environment["SQLITE_SNAPSHOTS_PATH"] = os.path.join(
+        options.work_directory, f"snapshots-{scenario}.db"
+    )
+    if os.path.exists(environment["SQLITE_SNAPSHOTS_PATH"]):
+        os.unlink(environment["SQLITE_SNAPSHOTS_PATH"])
+
+    # Progress messages of the pipeline are not part of the results
+    subprocess.run(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "-child",
+            scenario,
+            "-child-items",
+            str(items_count),
+            "-child-result",
+            result_path,
+            "-work-directory",
+            options.work_directory,
+            "-backend",
+            options.backend,
+            "-threads",
+            str(options.threads),
+        ]
+        + (["-script"] if options.script else []),
+        env=environment,
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+
+    with open(result_path) as f:
+        return json.load(f)
+
+
+def _print_comparison(results: List[Dict[str, Any]], baseline_path: str) -> None:
+    """Prints items per second of the results compared to the baseline."""
+    with open(baseline_path) as f:
+        baseline = {result["scenario"]: result for result in json.load(f)["results"]}
+
+    print(f"{'Scenario':<20} {'Items/s':>12} {'Baseline':>12} {'Change':>8}")
+    for result in results:
+        old = baseline.get(result["scenario"])
+        if old is None or old["items"] != result["items"]:
+            print(f"{result['scenario']:<20} {result['items_per_second']:>12}")
+            continue
+
+        change = result["items_per_second"] / old["items_per_second"] - 1
+        print(
+            f"{result['scenario']:<20} {result['items_per_second']:>12} "
+            f"{old['items_per_second']:>12} {change:>+8.1%}"
+        )
+
+
+def parse_arguments() -> argparse.Namespace:
+    """Parses command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+
+    parser.add_argument(
+        "-scenarios",
+        nargs="+",
+        choices=list(SCENARIOS),
+        default=list(SCENARIOS),
+        help="Scenarios to run, all by default",
+    )
+    parser.add_argument(
+        "-scale",
+        type=float,
+        default=1.0,
+        help="Multiplier of the workload sizes, e.g. 0.01 for a quick run",
+    )
+    parser.add_argument(
+        "-backend",
+        choices=["memory", "sqlite"],
+        default="memory",
+        help="Snapshot store backend",
+    )
+    parser.add_argument(
+        "-threads", type=int, default=8, help="Threads of the fan-out tasks"
+    )
+    parser.add_argument(
+        "-script",
+        action="store_true",
+        default=False,
+        help="Run a no-op script for each item instead of a task doing nothing",
+    )
+    parser.add_argument(
+        "-work-directory",
+        default=os.path.join(tempfile.gettempdir(), "pypelines-benchmarks"),
+        help="Directory of the generated workloads",
+    )
+    parser.add_argument("-output", help="Write results to given JSON file")
+    parser.add_argument("-baseline", help="Compare with results of an earlier run")
+
+    # Used by the process running a single scenario
+    parser.add_argument("-child", help=argparse.SUPPRESS)
+    parser.add_argument("-child-items", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("-child-result", help=argparse.SUPPRESS)
+
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Main entry point."""
+    options = parse_arguments()
+    options.work_directory = os.path.abspath(options.work_directory)
+
+    if options.child is not None:
+        result = run_scenario(options.child, options.child_items, options)
+        with open(options.child_result, "w") as f:
+            json.dump(result, f)
+        return
+
+    counts = create_workloads(options.work_directory, options.scale)
+
+    results = []
+    for scenario in options.scenarios:
+        result = _run_child(scenario, counts[SCENARIOS[scenario][0]], options)
+        results.append(result)
+
+        print(
+            f"{scenario}: {result['items']} items in {result['seconds']} s, "
+            f"{result['items_per_second']} items/s, "
+            f"{result['overhead_us_per_item']} us/item, "
+            f"{result['peak_rss_mb']} MB, "
+            f"{result['store_calls_per_item']} store calls/item",
+            file=sys.stderr,
+        )
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "git_commit": _get_git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "scale": options.scale,
+        "backend": options.backend,
+        "threads": options.threads,
+        "script": options.script,
+        "results": results,
+    }
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if options.baseline:
+        _print_comparison(results, options.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,8 @@ from typing import List
 from pypelines import utils
 
 from pypelines.pipeline import Pipeline
+from pypelines.profiler import SamplingProfiler
+from pypelines.config import PROFILE_SAMPLE_INTERVAL
 
 
 def parse_arguments() -> argparse.Namespace:
@@ -28,6 +30,35 @@ def parse_arguments() -> argparse.Namespace:
         default=True,
     )
 
+    parser.add_argument(
+        "-max-workers",
+        help=(
+            "Maximum number of fan-out items running at once in the pipeline, "
+            "0 means no limit. Overrides max-workers of the pipeline config"
+        ),
+        type=int,
+        default=None,
+    )
+
+    parser.add_argument(
+        "-trace-file",
+        help=(
+            "Write timing spans of the tasks to given file in Chrome trace "
+            "format, and print a summary of the spans"
+        ),
+        default=None,
+    )
+
+    parser.add_argument(
+        "-profile",
+        help=(
+            "Sample stacks of all the threads while the pipeline runs, and write "
+            "them to PROFILE.collapsed and a summary of the hot functions to "
+            "PROFILE.txt"
+        ),
+        default=None,
+    )
+
     parser.add_argument("-debug", help="Debug mode", action="store_true", default=False)
 
     args = parser.parse_args()
@@ -47,6 +78,9 @@ def main() -> None:
     raw_parameters: List[str] = args.parameters or []
     continue_from_last_run: bool = args.continue_from_last_run
     debug: bool = args.debug
+    max_workers: int = args.max_workers
+    trace_file: str = args.trace_file
+    profile: str = args.profile
 
     # Parse parameters
     parameters = utils.get_parameters_from_string_arguments(raw_parameters)
@@ -55,9 +89,21 @@ def main() -> None:
     pipeline: Pipeline = Pipeline()
 
     # TODO: use continue_from_last_run and debug flags
-    pipeline.load_from_yaml(pipeline_path, parameters)
+    pipeline.load_from_yaml(
+        pipeline_path, parameters, max_workers=max_workers, trace_file=trace_file
+    )
 
-    pipeline.run()
+    if profile is None:
+        pipeline.run()
+        return
+
+    profiler = SamplingProfiler(PROFILE_SAMPLE_INTERVAL)
+    profiler.start()
+    try:
+        pipeline.run()
+    finally:
+        profiler.stop()
+        profiler.write(profile)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,53 @@
+"""Bloom filter for set membership tests with bounded memory."""
+import math
+import threading
+from hashlib import blake2b
+
+
+class BloomFilter:
+    """Bloom filter.
+
+    Membership tests may return false positives, at roughly the given error
+    rate while the number of added keys is within capacity, but never return
+    false negatives.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        """Init."""
+        capacity = max(1, capacity)
+
+        # Optimal number of bits and hash functions for given capacity and
+        # error rate
+        self.num_bits = max(
+            8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        )
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+        # Setting a bit is a read-modify-write of a byte, so concurrent adds must
+        # not interleave or bits may be lost
+        self._lock = threading.Lock()
+
+    def _get_bit_indexes(self, key: str):
+        """Returns bit indexes of the key, using double hashing."""
+        digest = blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key: str) -> None:
+        """Adds key to the filter."""
+        indexes = self._get_bit_indexes(key)
+
+        with self._lock:
+            for index in indexes:
+                self._bits[index >> 3] |= 1 << (index & 7)
+
+    def __contains__(self, key: str) -> bool:
+        """Checks if key may have been added to the filter."""
+        return all(
+            self._bits[index >> 3] & (1 << (index & 7))
+            for index in self._get_bit_indexes(key)
+        )
@@ -0,0 +1,97 @@
+"""Cancellation of running tasks."""
+import os
+import signal
+import threading
+from typing import Any, Set
+
+
+class TaskCancelledError(Exception):
+    """Raised by tasks which did not run, or were terminated, because their
+    fan-out was cancelled."""
+
+
+class CancellationToken:
+    """Cancels tasks of a fan-out and terminates their running scripts.
+
+    Scripts are started in their own process group and registered with the
+    token, cancelling the token terminates the process groups. Cancelling a
+    token also cancels tokens of nested fan-outs created with it as parent.
+    """
+
+    def __init__(self, parent: "CancellationToken" = None) -> None:
+        """Init."""
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._processes: Set[Any] = set()
+        self._children: Set["CancellationToken"] = set()
+        self._parent = parent
+
+        if parent is not None:
+            parent._add_child(self)
+
+    @property
+    def is_cancelled(self) -> bool:
+        """Returns true if the token was cancelled."""
+        return self._event.is_set()
+
+    def raise_if_cancelled(self) -> None:
+        """Raises TaskCancelledError if the token was cancelled."""
+        if self.is_cancelled:
+            raise TaskCancelledError("Task was cancelled")
+
+    def _add_child(self, child: "CancellationToken") -> None:
+        """Adds token of a nested fan-out."""
+        with self._lock:
+            self._children.add(child)
+            is_cancelled = self.is_cancelled
+
+        if is_cancelled:
+            child.cancel()
+
+    def cancel(self) -> None:
+        """Cancels the token, its children and terminates registered scripts."""
+        with self._lock:
+            if self.is_cancelled:
+                return
+
+            self._event.set()
+            processes = list(self._processes)
+            children = list(self._children)
+
+        for process in processes:
+            _terminate_process_group(process)
+
+        for child in children:
+            child.cancel()
+
+    def register_process(self, process: Any) -> None:
+        """Registers running script started with start_new_session, terminates
+        it if the token is already cancelled."""
+        with self._lock:
+            self._processes.add(process)
+            is_cancelled = self.is_cancelled
+
+        if is_cancelled:
+            _terminate_process_group(process)
+
+    def unregister_process(self, process: Any) -> None:
+        """Unregisters finished script."""
+        with self._lock:
+            self._processes.discard(process)
+
+    def close(self) -> None:
+        """Detaches the token from its parent."""
+        if self._parent is not None:
+            with self._parent._lock:
+                self._parent._children.discard(self)
+
+
+def _terminate_process_group(process: Any) -> None:
+    """Sends SIGTERM to the process group led by the process."""
+    if process.returncode is not None:
+        return
+
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        pass
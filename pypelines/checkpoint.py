@@ -0,0 +1,264 @@
+"""Byte offset checkpoints for tasks reading files line by line."""
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Set
+
+from pypelines.snapshot import Snapshot
+
+# Maximum number of line offsets stored in the checkpoint, when more lines
+# failed, the low-water mark stops moving
+MAX_CHECKPOINT_OFFSETS = 100000
+
+
+class _LineState:
+    """State of a dispatched line."""
+
+    PENDING = 0
+    COMPLETED = 1
+    FAILED = 2
+
+
+class LineOffsetCheckpoint:
+    """Tracks committed low-water-mark byte offset of a file processed by
+    multiple threads and stores it in the snapshot.
+
+    Lines must be started in file order, but can finish in any order. All the
+    lines starting before offset are finished. Offsets of lines completed out of
+    order, and of lines below the low-water mark which failed, are stored with
+    the offset, so that on resume only the failed lines and the lines after the
+    offset which are not completed are run again. Failed lines of the loaded
+    checkpoint are stored until their retry succeeds.
+
+    file_identity identifies the version of the file, a checkpoint saved for
+    another version is ignored, as its offsets are not valid anymore.
+
+    Checkpoint is saved every save_interval seconds by a background thread
+    between start() and close(), so that finishing a line never waits for the
+    store, even on the event loop of the asyncio executor.
+
+    At most max_held_lines lines are held after the low-water mark,
+    start_line() blocks until a line before them finishes. When the low-water
+    mark stops moving because too many lines failed, following lines are not
+    tracked anymore, they run again on resume.
+    """
+
+    def __init__(
+        self,
+        snapshot: Snapshot,
+        key: str,
+        save_interval: float,
+        file_identity: str,
+        max_held_lines: int = MAX_CHECKPOINT_OFFSETS,
+    ) -> None:
+        """Init."""
+        self.snapshot = snapshot
+        self.key = key
+        self.save_interval = save_interval
+        self.file_identity = file_identity
+        self.max_held_lines = max_held_lines
+
+        # Low-water mark, all the lines starting before it are finished
+        self.offset = 0
+        # Lines below the low-water mark which failed
+        self.failed_offsets: List[int] = []
+
+        # Lines finished out of order and failed lines of the loaded checkpoint
+        self.loaded_completed_offsets: Set[int] = set()
+        self.loaded_failed_offsets: List[int] = []
+        # Failed lines of the loaded checkpoint which were not retried
+        # successfully yet
+        self._unresolved_retries: Set[int] = set()
+
+        # Dispatched lines after the low-water mark, in file order
+        self._lines: Deque[List[int]] = deque()
+        self._lines_by_start: Dict[int, List[int]] = {}
+        # Set when the low-water mark stopped moving, with the lines completed
+        # out of order at that time
+        self._frozen_completed_offsets: List[int] = None
+
+        self._lock = threading.Lock()
+        self._line_released = threading.Condition(self._lock)
+        self._save_lock = threading.Lock()
+        self._version = 0
+        self._saved_version = 0
+
+        self._closed = False
+        self._close_requested = threading.Condition(self._lock)
+        self._save_thread: threading.Thread = None
+
+    def load(self) -> bool:
+        """Loads checkpoint from the snapshot.
+
+        Returns false if the checkpoint was saved for another version of the
+        file, it is then ignored.
+        """
+        checkpoint = self.snapshot.get_checkpoint(self.key)
+
+        if checkpoint is None:
+            return True
+
+        if checkpoint.get("file_identity") != self.file_identity:
+            return False
+
+        self.offset = checkpoint["offset"]
+        self.loaded_completed_offsets = set(checkpoint["completed_offsets"])
+        self.loaded_failed_offsets = checkpoint["failed_offsets"]
+        self._unresolved_retries = set(self.loaded_failed_offsets)
+
+        return True
+
+    def start_line(self, start: int, end: int) -> None:
+        """Marks line [start, end) as dispatched.
+
+        Blocks while max_held_lines lines are held after the low-water mark.
+        """
+        line = [start, end, _LineState.PENDING]
+
+        with self._lock:
+            while (
+                len(self._lines) >= self.max_held_lines
+                and self._frozen_completed_offsets is None
+            ):
+                self._line_released.wait()
+
+            if self._frozen_completed_offsets is not None:
+                return
+
+            self._lines.append(line)
+            self._lines_by_start[start] = line
+
+    def finish_line(self, start: int, succeeded: bool) -> None:
+        """Marks line starting at given offset as finished."""
+        with self._lock:
+            line = self._lines_by_start.get(start)
+            if line is None:
+                # Not tracked, the low-water mark stopped moving
+                return
+
+            line[2] = _LineState.COMPLETED if succeeded else _LineState.FAILED
+
+            # Move low-water mark over the finished prefix
+            while self._lines and self._lines[0][2] != _LineState.PENDING:
+                line_start, line_end, state = self._lines[0]
+
+                if state == _LineState.FAILED:
+                    if (
+                        len(self.failed_offsets) + len(self._unresolved_retries)
+                        >= MAX_CHECKPOINT_OFFSETS
+                    ):
+                        self._freeze()
+                        break
+                    self.failed_offsets.append(line_start)
+
+                self._lines.popleft()
+                del self._lines_by_start[line_start]
+                self.offset = line_end
+
+            self._line_released.notify_all()
+            self._version += 1
+
+    def finish_retried_line(self, start: int, succeeded: bool) -> None:
+        """Marks failed line of the loaded checkpoint, which is below the
+        low-water mark, as finished. It is stored as failed until it succeeds."""
+        if not succeeded:
+            return
+
+        with self._lock:
+            self._unresolved_retries.discard(start)
+            self._version += 1
+
+    def _freeze(self) -> None:
+        """Stops tracking lines after the low-water mark, must be called with
+        the lock held."""
+        self._frozen_completed_offsets = self._get_completed_offsets()
+        self._lines.clear()
+        self._lines_by_start.clear()
+
+    def clear(self) -> None:
+        """Stores an empty checkpoint, the file is read from the beginning by the
+        next run."""
+        with self._lock:
+            self.offset = 0
+            self.failed_offsets = []
+            self._unresolved_retries.clear()
+            self._lines.clear()
+            self._lines_by_start.clear()
+            self._frozen_completed_offsets = None
+            self._version += 1
+
+        self.save()
+
+    def _get_completed_offsets(self) -> List[int]:
+        """Returns lines completed out of order, must be called with the lock
+        held."""
+        if self._frozen_completed_offsets is not None:
+            return list(self._frozen_completed_offsets)
+
+        completed_offsets = []
+        for line_start, _, state in self._lines:
+            if len(completed_offsets) >= MAX_CHECKPOINT_OFFSETS:
+                break
+            if state == _LineState.COMPLETED:
+                completed_offsets.append(line_start)
+
+        return completed_offsets
+
+    def _get_state(self) -> Dict[str, Any]:
+        """Returns checkpoint to store, must be called with the lock held."""
+        return dict(
+            file_identity=self.file_identity,
+            offset=self.offset,
+            completed_offsets=self._get_completed_offsets(),
+            failed_offsets=sorted(self._unresolved_retries) + self.failed_offsets,
+        )
+
+    def save(self) -> None:
+        """Stores checkpoint in the snapshot, if it changed since the last
+        save."""
+        with self._save_lock:
+            with self._lock:
+                if self._version == self._saved_version:
+                    return
+
+                version = self._version
+                state = self._get_state()
+
+            self.snapshot.set_checkpoint(self.key, state)
+
+            self._saved_version = version
+
+    def _save_periodically(self) -> None:
+        """Saves checkpoint every save_interval seconds until closed."""
+        while True:
+            with self._lock:
+                if not self._closed:
+                    self._close_requested.wait(self.save_interval)
+
+                if self._closed:
+                    return
+
+            try:
+                self.save()
+            except Exception as e:
+                # Saved again by the next save
+                print(f"Failed to save checkpoint, will retry. {e}")
+
+    def start(self) -> None:
+        """Starts saving the checkpoint in the background."""
+        self._save_thread = threading.Thread(
+            target=self._save_periodically,
+            name="pypelines-checkpoint",
+            daemon=True,
+        )
+        self._save_thread.start()
+
+    def close(self) -> None:
+        """Stops background saves and saves the checkpoint."""
+        with self._lock:
+            self._closed = True
+            self._close_requested.notify_all()
+
+        if self._save_thread is not None:
+            self._save_thread.join()
+
+        self.save()
@@ -7,6 +7,138 @@ WORKSPACE_DIRECTORY = os.path.expanduser("~/.Pypelines/")
 # Tmp directory to store scripts
 SCRIPTS_DIRECTORY = os.path.join(WORKSPACE_DIRECTORY, "scripts")
 
+# Directory to store scripts, each unique script is stored once
+SCRIPTS_CACHE_DIRECTORY = os.path.join(WORKSPACE_DIRECTORY, "scripts-cache")
+
+# Cached scripts not used for given days are removed, 0 means never
+SCRIPTS_CACHE_MAX_AGE_DAYS = float(os.environ.get("SCRIPTS_CACHE_MAX_AGE_DAYS", 30))
+
+# Least recently used cached scripts are removed when the cache is larger than
+# given megabytes, 0 means no limit
+SCRIPTS_CACHE_MAX_SIZE_MB = float(os.environ.get("SCRIPTS_CACHE_MAX_SIZE_MB", 100))
+
+# OS environment variables passed to scripts, "full" passes the whole OS
+# environment, "minimal" passes only SCRIPT_ENVIRONMENT_ALLOW_LIST variables.
+# Can be overridden by the "script-environment" key of the pipeline config
+SCRIPT_ENVIRONMENT = os.environ.get("SCRIPT_ENVIRONMENT", "full")
+
+# Comma separated OS environment variables passed to scripts in "minimal" mode.
+# Can be overridden by the "script-environment-allow-list" key of the pipeline
+# config
+SCRIPT_ENVIRONMENT_ALLOW_LIST = os.environ.get(
+    "SCRIPT_ENVIRONMENT_ALLOW_LIST",
+    "PATH,HOME,USER,LOGNAME,SHELL,TERM,TZ,LANG,LC_ALL,TMPDIR",
+)
+
+# Maximum number of top-level tasks running at once, when tasks declare
+# depends-on. Can be overridden by the "max-parallel-tasks" key of the pipeline
+# config
+MAX_PARALLEL_TASKS = int(os.environ.get("MAX_PARALLEL_TASKS", 4))
+
+# Maximum number of fan-out items running at once in all the thread pools of
+# the pipeline, 0 means no limit. Scripts mostly wait for I/O, so the default is
+# 4 items per core, and at least 32. Can be overridden by the "max-workers" key
+# of the pipeline config or the -max-workers argument
+MAX_WORKERS = int(
+    os.environ.get("MAX_WORKERS", max(32, 4 * (os.cpu_count() or 1)))
+)
+
+# Executor running sub-tasks of fan-out tasks, "threads" or "asyncio". Can be
+# overridden by the "fan-out-executor" key of the pipeline config or the
+# "executor" input of the task
+FAN_OUT_EXECUTOR = os.environ.get("FAN_OUT_EXECUTOR", "threads")
+
+# Where output of scripts is written, "terminal", "task-files" (a log file per
+# task) or "pipeline-file" (a single log file, lines prefixed with task name).
+# Can be overridden by the "output-mode" key of the pipeline config
+OUTPUT_MODE = os.environ.get("OUTPUT_MODE", "terminal")
+
+# Directory of log files, each pipeline run writes to its own sub-directory.
+# Can be overridden by the "logs-directory" key of the pipeline config
+LOGS_DIRECTORY = os.environ.get(
+    "LOGS_DIRECTORY", os.path.join(WORKSPACE_DIRECTORY, "logs")
+)
+
+# Task log files are truncated, and the pipeline log file is rotated, when they
+# are larger than given megabytes, 0 means no limit. Can be overridden by the
+# "log-max-file-size-mb" key of the pipeline config
+LOG_MAX_FILE_SIZE_MB = float(os.environ.get("LOG_MAX_FILE_SIZE_MB", 10))
+
+# Number of rotated pipeline log files kept
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", 5))
+
+# Maximum number of chunks of output queued for the log writer thread. When
+# the queue is full, tasks writing output wait for the writer, and progress
+# messages are not written to the pipeline log
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 1024))
+
+# When output of scripts is written to log files, progress messages are printed
+# at most once per given seconds. Can be overridden by the
+# "output-sample-interval" key of the pipeline config
+OUTPUT_SAMPLE_INTERVAL = float(os.environ.get("OUTPUT_SAMPLE_INTERVAL", 1))
+
+# What the hash of a completed task depends on, "name" or "inputs". With
+# "inputs", the task runs again when its parsed inputs or input-files change.
+# Can be overridden by the "task-hash-mode" key of the pipeline config
+TASK_HASH_MODE = os.environ.get("TASK_HASH_MODE", "name")
+
+# How input-files of tasks are fingerprinted, "stat" (size and modification
+# time) or "content" (also SHA256 of the content). Can be overridden by the
+# "input-file-fingerprint" key of the pipeline config
+INPUT_FILE_FINGERPRINT = os.environ.get("INPUT_FILE_FINGERPRINT", "stat")
+
+# Maximum number of spans kept in memory when the pipeline is traced, later
+# spans are only counted in the summary table
+TRACE_MAX_EVENTS = int(os.environ.get("TRACE_MAX_EVENTS", 1000000))
+
+# Prometheus text file with live metrics of the pipeline, rewritten every
+# METRICS_INTERVAL seconds. Use a ".prom" file in the directory of the node
+# exporter textfile collector to scrape it. Can be overridden by the
+# "metrics-file" key of the pipeline config
+METRICS_FILE = os.environ.get("METRICS_FILE")
+
+# Port of the local HTTP endpoint serving metrics on /metrics, 0 means metrics
+# are not served. Can be overridden by the "metrics-port" key of the pipeline
+# config
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+
+# Address the metrics endpoint listens on
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+# Seconds between writes of the metrics file, and window of the items per
+# second rate. Can be overridden by the "metrics-interval" key of the pipeline
+# config
+METRICS_INTERVAL = float(os.environ.get("METRICS_INTERVAL", 10))
+
+# Seconds between two samples of the -profile mode
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", 0.01))
+
+# Snapshot store backend, "mongodb", "sqlite" or "memory" (kept in memory of
+# the process only). Can be overridden by the "snapshot-backend" key of the
+# pipeline config
+SNAPSHOT_BACKEND = os.environ.get("SNAPSHOT_BACKEND", "mongodb")
+
+# Database file of the sqlite snapshot backend
+SQLITE_SNAPSHOTS_PATH = os.environ.get(
+    "SQLITE_SNAPSHOTS_PATH", os.path.join(WORKSPACE_DIRECTORY, "snapshots.db")
+)
+
+# How task completions are written to the snapshot store, "sync", "batched" or
+# "async". Can be overridden by the "snapshot-write-mode" key of the pipeline config
+SNAPSHOT_WRITE_MODE = os.environ.get("SNAPSHOT_WRITE_MODE", "batched")
+
+# Number of buffered task completions written in a single batch
+SNAPSHOT_FLUSH_SIZE = int(os.environ.get("SNAPSHOT_FLUSH_SIZE", 500))
+
+# Maximum number of seconds task completions stay buffered
+SNAPSHOT_FLUSH_INTERVAL = float(os.environ.get("SNAPSHOT_FLUSH_INTERVAL", 1))
+
+# Hashes of completed tasks are loaded in memory when a pipeline starts. When the
+# pipeline has more completed tasks than this limit, a bloom filter is loaded
+# instead. Can be overridden by the "snapshot-preload-limit" key of the pipeline
+# config
+SNAPSHOT_PRELOAD_LIMIT = int(os.environ.get("SNAPSHOT_PRELOAD_LIMIT", 1000000))
+
 # DB connection string
 DB_CONNECTION_STRING = os.environ.get(
     "DB_CONNECTION_STRING", "mongodb://localhost:27017/"
@@ -18,6 +150,41 @@ DB_NAME = os.environ.get("DB_NAME", "Pypelines")
 # Snapshots collection name
 DB_SNAPSHOT_COLLECTION_NAME = os.environ.get("DB_SNAPSHOT_COLLECTION_NAME", "Snapshots")
 
+# Completed tasks collection name, stores one record per completed task
+DB_SNAPSHOT_TASKS_COLLECTION_NAME = os.environ.get(
+    "DB_SNAPSHOT_TASKS_COLLECTION_NAME", "SnapshotTasks"
+)
+
+# Checkpoints collection name, stores progress of tasks which can be resumed
+# from the middle, for example, byte offset of for-each-line-of-file tasks
+DB_SNAPSHOT_CHECKPOINTS_COLLECTION_NAME = os.environ.get(
+    "DB_SNAPSHOT_CHECKPOINTS_COLLECTION_NAME", "SnapshotCheckpoints"
+)
+
+# File index collection name, stores fingerprints of the files processed by
+# incremental for-each-file tasks
+DB_FILE_INDEX_COLLECTION_NAME = os.environ.get(
+    "DB_FILE_INDEX_COLLECTION_NAME", "FileIndex"
+)
+
+# Snapshots and completed task records older than given days are deleted by
+# the database, 0 means records never expire
+DB_SNAPSHOT_TTL_DAYS = float(os.environ.get("DB_SNAPSHOT_TTL_DAYS", 0))
+
+# Maximum number of connections in the snapshot store connection pool
+DB_MAX_POOL_SIZE = int(os.environ.get("DB_MAX_POOL_SIZE", 100))
+
+# Timeout (in milliseconds) for opening a new connection to the database
+DB_CONNECT_TIMEOUT_MS = int(os.environ.get("DB_CONNECT_TIMEOUT_MS", 20000))
+
+# Timeout (in milliseconds) for finding a suitable database server
+DB_SERVER_SELECTION_TIMEOUT_MS = int(
+    os.environ.get("DB_SERVER_SELECTION_TIMEOUT_MS", 30000)
+)
+
+# Timeout (in milliseconds) for a single database operation, 0 means no timeout
+DB_SOCKET_TIMEOUT_MS = int(os.environ.get("DB_SOCKET_TIMEOUT_MS", 0))
+
 # Create directories
-for dir_path in [SCRIPTS_DIRECTORY]:
+for dir_path in [SCRIPTS_DIRECTORY, SCRIPTS_CACHE_DIRECTORY]:
     os.makedirs(dir_path, exist_ok=True)
@@ -10,3 +10,81 @@ class SnapshotCollectionFields:
     RECORD_ID = "_id"
     COMPLETED_TASKS = "completed_tasks"
     IS_COMPLETED = "is_completed"
+    COMPLETED_AT = "completed_at"
+    TASK_HASH = "task_hash"
+    CHECKPOINT_KEY = "key"
+    CHECKPOINT_VALUE = "value"
+    UPDATED_AT = "updated_at"
+    INDEX_KEY = "index_key"
+    PATH = "path"
+    SIZE = "size"
+    MTIME_NS = "mtime_ns"
+    CONTENT_HASH = "content_hash"
+    SCHEMA_VERSION = "schema_version"
+
+
+class SnapshotWriteModes:
+    """Modes for writing task completions to the snapshot store"""
+
+    SYNC = "sync"
+    BATCHED = "batched"
+    ASYNC = "async"
+
+    ALL = [SYNC, BATCHED, ASYNC]
+
+
+class ScriptEnvironmentModes:
+    """OS environment variables passed to scripts"""
+
+    # Whole OS environment
+    FULL = "full"
+    # Only allow-listed OS environment variables
+    MINIMAL = "minimal"
+
+    ALL = [FULL, MINIMAL]
+
+
+class FanOutExecutors:
+    """Executors running sub-tasks of fan-out tasks"""
+
+    # Thread pool, each running sub-task blocks a thread
+    THREADS = "threads"
+    # Event loop, scripts run without blocking threads
+    ASYNCIO = "asyncio"
+
+    ALL = [THREADS, ASYNCIO]
+
+
+class OutputModes:
+    """Where output of scripts is written"""
+
+    # Scripts write to the terminal
+    TERMINAL = "terminal"
+    # Each task writes to its own log file
+    TASK_FILES = "task-files"
+    # All tasks write to a single rotated log file, lines prefixed with task name
+    PIPELINE_FILE = "pipeline-file"
+
+    ALL = [TERMINAL, TASK_FILES, PIPELINE_FILE]
+
+
+class TaskHashModes:
+    """What the hash of a completed task, stored in snapshots, depends on"""
+
+    # Task name only
+    NAME = "name"
+    # Task name, parsed inputs and fingerprints of input files
+    INPUTS = "inputs"
+
+    ALL = [NAME, INPUTS]
+
+
+class InputFileFingerprints:
+    """How input files are fingerprinted in the task hash"""
+
+    # Size and modification time
+    STAT = "stat"
+    # Size, modification time and SHA256 of the content
+    CONTENT = "content"
+
+    ALL = [STAT, CONTENT]
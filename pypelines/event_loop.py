@@ -0,0 +1,47 @@
+"""Event loop shared by tasks running on asyncio."""
+import asyncio
+import threading
+import concurrent.futures
+from typing import Coroutine
+
+
+class EventLoopThread:
+    """asyncio event loop running in a daemon thread.
+
+    The loop is started on first use, coroutines are submitted from any thread.
+    """
+
+    def __init__(self) -> None:
+        """Init."""
+        self._loop: asyncio.AbstractEventLoop = None
+        self._lock = threading.Lock()
+
+        # Identifier of the thread running the loop, None until it is started
+        self.thread_ident: int = None
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        """Returns the event loop, starts it if it is not running."""
+        if self._loop is not None:
+            return self._loop
+
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+
+                thread = threading.Thread(
+                    target=loop.run_forever, name="pypelines-event-loop", daemon=True
+                )
+                thread.start()
+
+                self.thread_ident = thread.ident
+                self._loop = loop
+
+        return self._loop
+
+    def submit(self, coroutine: Coroutine) -> concurrent.futures.Future:
+        """Schedules coroutine on the event loop."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.get_loop())
+
+
+# Event loop shared by all the pipelines of the process
+event_loop_thread = EventLoopThread()
@@ -0,0 +1,160 @@
+"""Executors for running sub-tasks of fan-out tasks."""
+import asyncio
+import threading
+import concurrent.futures
+from typing import Any, Callable, Set
+
+from pypelines.event_loop import event_loop_thread
+from pypelines.worker_budget import WorkerBudget
+
+
+class BoundedExecutor:
+    """Thread pool executor with a bounded number of in-flight items.
+
+    submit() blocks while max_in_flight submitted items are queued or running,
+    so items can be submitted from a lazy iterator without materializing it in
+    memory.
+
+    When worker_budget is given, items run only when a token of the
+    pipeline-wide budget is available.
+    """
+
+    def __init__(
+        self, max_workers: int, max_in_flight: int, worker_budget: WorkerBudget = None
+    ) -> None:
+        """Init."""
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers
+        )
+        self._in_flight = threading.BoundedSemaphore(max(max_workers, max_in_flight))
+        self._worker_budget = worker_budget
+
+    def _on_done(self, future: concurrent.futures.Future) -> None:
+        """Releases in-flight slot of the completed item."""
+        self._in_flight.release()
+
+    def submit(self, fn: Callable, *args: Any) -> concurrent.futures.Future:
+        """Submits fn(*args), blocks until an in-flight slot is available."""
+        self._in_flight.acquire()
+
+        try:
+            if self._worker_budget is not None:
+                future = self._executor.submit(self._worker_budget.run, fn, *args)
+            else:
+                future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._in_flight.release()
+            raise
+
+        future.add_done_callback(self._on_done)
+        return future
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Shuts down the executor."""
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self) -> "BoundedExecutor":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.shutdown(wait=True)
+
+
+class AsyncioExecutor:
+    """Executor running coroutine functions on the shared event loop.
+
+    At most max_workers coroutines run at once, submit() blocks while
+    max_in_flight submitted items are queued or running, like BoundedExecutor.
+
+    Items take tokens of the worker budget while they run blocking calls with
+    run_blocking(), and scripts take one while their process is alive, so that
+    nested fan-outs do not run more than max-workers items at once.
+    """
+
+    def __init__(
+        self, max_workers: int, max_in_flight: int, worker_budget: WorkerBudget = None
+    ) -> None:
+        """Init."""
+        self._max_workers = max_workers
+        # Created on the event loop by the first item
+        self._running: asyncio.Semaphore = None
+        self._in_flight = threading.BoundedSemaphore(max(max_workers, max_in_flight))
+
+        # Each running item runs at most one blocking call at once, so blocking
+        # calls never wait for a thread, even when they run nested fan-outs
+        # which wait for their own items
+        self._thread_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers
+        )
+        self._worker_budget = worker_budget
+
+        self._futures: Set[concurrent.futures.Future] = set()
+        self._lock = threading.Lock()
+
+    async def run_blocking(self, fn: Callable, *args: Any) -> Any:
+        """Runs fn(*args) in a thread of the executor, without blocking the
+        event loop.
+
+        When worker_budget is given, fn runs only when a token of the
+        pipeline-wide budget is available.
+        """
+        loop = asyncio.get_running_loop()
+
+        if self._worker_budget is not None:
+            return await loop.run_in_executor(
+                self._thread_pool, self._worker_budget.run, fn, *args
+            )
+
+        return await loop.run_in_executor(self._thread_pool, fn, *args)
+
+    async def _run(self, fn: Callable, *args: Any) -> Any:
+        """Runs coroutine function once a running slot is available."""
+        if self._running is None:
+            self._running = asyncio.Semaphore(self._max_workers)
+
+        async with self._running:
+            return await fn(*args)
+
+    def _on_done(self, future: concurrent.futures.Future) -> None:
+        """Releases in-flight slot of the completed item."""
+        with self._lock:
+            self._futures.discard(future)
+
+        self._in_flight.release()
+
+    def submit(self, fn: Callable, *args: Any) -> concurrent.futures.Future:
+        """Schedules coroutine function fn(*args), blocks until an in-flight
+        slot is available."""
+        self._in_flight.acquire()
+
+        try:
+            future = event_loop_thread.submit(self._run(fn, *args))
+        except BaseException:
+            self._in_flight.release()
+            raise
+
+        with self._lock:
+            self._futures.add(future)
+
+        future.add_done_callback(self._on_done)
+        return future
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Waits for submitted items if wait is true, else cancels them, and
+        shuts down threads of the blocking calls."""
+        with self._lock:
+            futures = list(self._futures)
+
+        if wait:
+            concurrent.futures.wait(futures)
+        else:
+            for future in futures:
+                future.cancel()
+
+        self._thread_pool.shutdown(wait=wait)
+
+    def __enter__(self) -> "AsyncioExecutor":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.shutdown(wait=True)
@@ -0,0 +1,71 @@
+"""Results of items of fan-out tasks."""
+import threading
+from typing import Dict, List
+
+from pypelines.cancellation import TaskCancelledError
+
+# Maximum number of distinct errors shown in the failure summary
+MAX_SUMMARY_ERRORS = 10
+
+
+class FanOutResults:
+    """Thread safe counts of finished, failed and cancelled items of a fan-out
+    task, with failed items grouped by error message."""
+
+    def __init__(self) -> None:
+        """Init."""
+        self.finished = 0
+        self.failed = 0
+        self.cancelled = 0
+
+        # Error message to number of failed items and description of the first
+        # failed item
+        self._errors: Dict[str, List] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def has_errors(self) -> bool:
+        """Returns true if any item failed or was cancelled."""
+        return self.failed > 0 or self.cancelled > 0
+
+    def add(self, items_count: int, error: Exception, description: str) -> None:
+        """Records result of items_count items which finished with given error,
+        None if they succeeded."""
+        with self._lock:
+            self.finished += items_count
+
+            if error is None:
+                return
+
+            if isinstance(error, TaskCancelledError):
+                self.cancelled += items_count
+                return
+
+            self.failed += items_count
+
+            message = str(error) or type(error).__name__
+            if message in self._errors:
+                self._errors[message][0] += items_count
+            else:
+                self._errors[message] = [items_count, description]
+
+    def get_failure_rate(self) -> float:
+        """Returns ratio of failed items to finished items."""
+        return self.failed / self.finished if self.finished else 0
+
+    def get_summary(self) -> str:
+        """Returns summary of the failed items, most frequent errors first."""
+        with self._lock:
+            errors = sorted(self._errors.items(), key=lambda x: x[1][0], reverse=True)
+            lines = [
+                f"{self.failed} of {self.finished} items failed, "
+                f"{self.cancelled} cancelled."
+            ]
+
+        for message, (count, description) in errors[:MAX_SUMMARY_ERRORS]:
+            lines.append(f"  {count} x {message} (first: {description})")
+
+        if len(errors) > MAX_SUMMARY_ERRORS:
+            lines.append(f"  ... and {len(errors) - MAX_SUMMARY_ERRORS} other errors")
+
+        return "\n".join(lines)
@@ -0,0 +1,119 @@
+"""Persistent fingerprints of the files processed by incremental tasks."""
+import time
+import threading
+from typing import Dict, List, Tuple
+
+from pypelines.snapshot_store import SnapshotStore
+
+# Number of deleted paths removed from the index at once
+DELETE_BATCH_SIZE = 10000
+
+
+class FileIndex:
+    """Size, modification time and optional content hash of the files which
+    were processed successfully by a task, stored in the snapshot store.
+
+    The whole index is loaded in memory when the task starts. While files are
+    walked, their entries are popped from memory, so that entries left at the
+    end of the walk are the files which were deleted.
+
+    Updates of all the threads are buffered and written in batches of
+    flush_size entries, or every flush_interval seconds.
+    """
+
+    def __init__(
+        self,
+        snapshot_store: SnapshotStore,
+        pipeline_name: str,
+        index_key: str,
+        flush_size: int,
+        flush_interval: float,
+    ) -> None:
+        """Init."""
+        self.snapshot_store = snapshot_store
+        self.pipeline_name = pipeline_name
+        self.index_key = index_key
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = flush_interval
+
+        # Path to (size, mtime_ns, content_hash) of the files not walked yet
+        self._entries: Dict[str, Tuple[int, int, str]] = {}
+
+        self._pending: List[Tuple[str, int, int, str]] = []
+        self._lock = threading.Lock()
+        # Only one batch is written at a time
+        self._flush_lock = threading.Lock()
+        self._last_flush_time = time.monotonic()
+
+    def load(self) -> None:
+        """Loads the index from the snapshot store."""
+        entries = self.snapshot_store.iter_file_index(
+            self.pipeline_name, self.index_key
+        )
+
+        self._entries = {
+            path: (size, mtime_ns, content_hash)
+            for path, size, mtime_ns, content_hash in entries
+        }
+
+    def pop(self, path: str) -> Tuple[int, int, str]:
+        """Returns (size, mtime_ns, content_hash) of the indexed file, None if the
+        file is not indexed, and forgets it."""
+        return self._entries.pop(path, None)
+
+    def pop_remaining_paths(self) -> List[str]:
+        """Returns paths which were not popped, and forgets them."""
+        paths = list(self._entries)
+        self._entries = {}
+
+        return paths
+
+    def update(self, path: str, size: int, mtime_ns: int, content_hash: str) -> None:
+        """Stores fingerprint of the processed file, can be called from any
+        thread."""
+        with self._lock:
+            self._pending.append((path, size, mtime_ns, content_hash))
+
+            should_flush = (
+                len(self._pending) >= self.flush_size
+                or time.monotonic() - self._last_flush_time >= self.flush_interval
+            )
+
+        if should_flush:
+            self.flush()
+
+    def delete(self, paths: List[str]) -> None:
+        """Removes entries of the paths from the store."""
+        for start in range(0, len(paths), DELETE_BATCH_SIZE):
+            self.snapshot_store.delete_file_index_entries(
+                self.pipeline_name,
+                self.index_key,
+                paths[start : start + DELETE_BATCH_SIZE],
+            )
+
+    def flush(self) -> None:
+        """Writes buffered updates to the store.
+
+        If the write fails, the updates are buffered again and written by the
+        next flush.
+        """
+        with self._flush_lock:
+            with self._lock:
+                # Keeps only the latest update of each path, updates buffered
+                # again after a failed flush can be followed by newer ones
+                entries = list({entry[0]: entry for entry in self._pending}.values())
+                self._pending = []
+                self._last_flush_time = time.monotonic()
+
+            try:
+                self.snapshot_store.set_file_index_entries(
+                    self.pipeline_name, self.index_key, entries
+                )
+            except BaseException:
+                with self._lock:
+                    # Updates buffered while writing are newer
+                    updated_paths = {entry[0] for entry in self._pending}
+                    self._pending[:0] = [
+                        entry for entry in entries if entry[0] not in updated_paths
+                    ]
+                raise
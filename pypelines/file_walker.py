@@ -0,0 +1,189 @@
+"""Lazy walking of files matching glob pattern."""
+import os
+import stat
+from glob import iglob, has_magic
+from fnmatch import fnmatch
+from typing import Iterator, List, Tuple
+
+
+class FileWalker:
+    """Yields paths matching glob pattern one by one, while the directory tree is
+    being walked, skipping paths rejected by the configured filters."""
+
+    def __init__(
+        self,
+        glob_pattern: str,
+        include_subdirectories: bool = False,
+        exclude_patterns: List[str] = None,
+        min_size: int = None,
+        max_size: int = None,
+        modified_since: float = None,
+        follow_symlinks: bool = True,
+    ) -> None:
+        """Init."""
+        self.glob_pattern = glob_pattern
+        self.include_subdirectories = include_subdirectories
+        self.exclude_patterns = exclude_patterns or []
+        self.min_size = min_size
+        self.max_size = max_size
+        self.modified_since = modified_since
+        self.follow_symlinks = follow_symlinks
+
+        # Directory of the pattern without any glob wildcard, symlinks above it
+        # are always followed
+        self._root_directory = self._get_root_directory(glob_pattern)
+
+    @staticmethod
+    def _get_root_directory(glob_pattern: str) -> str:
+        """Returns the longest leading directory of the pattern without wildcards."""
+        root_directory = os.path.dirname(glob_pattern)
+
+        while has_magic(root_directory):
+            root_directory = os.path.dirname(root_directory)
+
+        return root_directory
+
+    def _is_excluded(self, path: str) -> bool:
+        """Checks if path or file name matches any exclude pattern."""
+        file_name = os.path.basename(path)
+
+        return any(
+            fnmatch(path, pattern) or fnmatch(file_name, pattern)
+            for pattern in self.exclude_patterns
+        )
+
+    @staticmethod
+    def _list_directory(directory: str) -> List[Tuple[str, bool]]:
+        """Returns (name, is directory) of the entries of the directory, except
+        symlinks."""
+        try:
+            with os.scandir(directory or os.curdir) as entries:
+                return [
+                    (entry.name, entry.is_dir(follow_symlinks=False))
+                    for entry in entries
+                    if not entry.is_symlink()
+                ]
+        except OSError:
+            # Directory was removed while walking, or is not a directory
+            return []
+
+    def _walk(self, directory: str) -> Iterator[Tuple[str, bool]]:
+        """Yields (path, is directory) of the entries below the directory, except
+        symlinks and hidden entries, without entering symlinked directories."""
+        for name, is_directory in self._list_directory(directory):
+            if name.startswith("."):
+                continue
+
+            path = os.path.join(directory, name)
+            yield path, is_directory
+
+            if is_directory:
+                yield from self._walk(path)
+
+    def _iter_unlinked_matches(
+        self, directory: str, components: List[str]
+    ) -> Iterator[str]:
+        """Yields paths below the directory matching the pattern components,
+        like iglob(), except symlinks and paths inside symlinked directories."""
+        component, rest = components[0], components[1:]
+
+        if not has_magic(component):
+            path = os.path.join(directory, component)
+
+            if os.path.islink(path):
+                return
+
+            if rest:
+                if os.path.isdir(path):
+                    yield from self._iter_unlinked_matches(path, rest)
+            elif os.path.lexists(path):
+                yield path
+            return
+
+        if component == "**" and self.include_subdirectories:
+            if not rest:
+                yield os.path.join(directory, "")
+                for path, _ in self._walk(directory):
+                    yield path
+                return
+
+            yield from self._iter_unlinked_matches(directory, rest)
+            for path, is_directory in self._walk(directory):
+                if is_directory:
+                    yield from self._iter_unlinked_matches(path, rest)
+            return
+
+        # Like glob, wildcards do not match hidden names
+        match_hidden = component.startswith(".")
+
+        for name, is_directory in self._list_directory(directory):
+            if name.startswith(".") and not match_hidden:
+                continue
+
+            if not fnmatch(name, component):
+                continue
+
+            path = os.path.join(directory, name)
+
+            if not rest:
+                yield path
+            elif is_directory:
+                yield from self._iter_unlinked_matches(path, rest)
+
+    def _iglob_unlinked(self) -> Iterator[str]:
+        """Yields paths matching the pattern, except symlinks and paths inside
+        symlinked directories below the root directory of the pattern, which are
+        never entered."""
+        root_directory = self._root_directory
+        components = (
+            self.glob_pattern[len(root_directory) :].lstrip(os.sep).split(os.sep)
+        )
+
+        yield from self._iter_unlinked_matches(root_directory, components)
+
+    def _matches_stat_filters(self, path: str) -> bool:
+        """Checks size and modification time of the path."""
+        try:
+            path_stat = os.stat(path, follow_symlinks=self.follow_symlinks)
+        except OSError:
+            # File was removed while walking
+            return False
+
+        if self.min_size is not None or self.max_size is not None:
+            # Size filters only match regular files
+            if not stat.S_ISREG(path_stat.st_mode):
+                return False
+
+            if self.min_size is not None and path_stat.st_size < self.min_size:
+                return False
+
+            if self.max_size is not None and path_stat.st_size > self.max_size:
+                return False
+
+        if self.modified_since is not None:
+            if path_stat.st_mtime < self.modified_since:
+                return False
+
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        """Yields paths matching the pattern and filters."""
+        has_stat_filters = (
+            self.min_size is not None
+            or self.max_size is not None
+            or self.modified_since is not None
+        )
+
+        if self.follow_symlinks:
+            paths = iglob(self.glob_pattern, recursive=self.include_subdirectories)
+        else:
+            paths = self._iglob_unlinked()
+
+        for path in paths:
+            if self.exclude_patterns and self._is_excluded(path):
+                continue
+
+            if has_stat_filters and not self._matches_stat_filters(path):
+                continue
+
+            yield path
@@ -0,0 +1,463 @@
+"""Live metrics of pipeline runs in Prometheus text format."""
+import os
+import time
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+
+from pypelines.snapshot_store import SnapshotStore
+
+# Counters of tasks and fan-out items, per task name of the pipeline config
+TASKS_COMPLETED = "tasks-completed"
+TASKS_FAILED = "tasks-failed"
+TASKS_CANCELLED = "tasks-cancelled"
+TASKS_SKIPPED = "tasks-skipped"
+ITEMS_SUBMITTED = "items-submitted"
+ITEMS_STARTED = "items-started"
+ITEMS_COMPLETED = "items-completed"
+ITEMS_FAILED = "items-failed"
+ITEMS_CANCELLED = "items-cancelled"
+ITEMS_SKIPPED = "items-skipped"
+
+COUNTERS = [
+    TASKS_COMPLETED,
+    TASKS_FAILED,
+    TASKS_CANCELLED,
+    TASKS_SKIPPED,
+    ITEMS_SUBMITTED,
+    ITEMS_STARTED,
+    ITEMS_COMPLETED,
+    ITEMS_FAILED,
+    ITEMS_CANCELLED,
+    ITEMS_SKIPPED,
+]
+
+# Upper bounds of the item latency buckets in seconds, from 1 ms to about one
+# hour, each bucket is 25% wider than the previous one
+LATENCY_BUCKETS = [0.001 * 1.25**i for i in range(68)]
+
+LATENCY_QUANTILES = [0.5, 0.95, 0.99]
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Shard:
+    """Counters updated by a single thread."""
+
+    __slots__ = ("counts", "latency_counts", "latency_sum")
+
+    def __init__(self) -> None:
+        """Init."""
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        # Last bucket counts latencies above the largest bound
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+
+
+class TaskMetrics:
+    """Counters and item latencies of a task of the pipeline config.
+
+    Every thread updates its own shard without locking, shards are summed when
+    the metrics are exported.
+    """
+
+    def __init__(self) -> None:
+        """Init."""
+        self._local = threading.local()
+        self._shards: List[_Shard] = []
+        self._lock = threading.Lock()
+
+    def _get_shard(self) -> _Shard:
+        """Returns shard of the current thread."""
+        shard = getattr(self._local, "shard", None)
+
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+
+        return shard
+
+    def add(self, counter: str, count: int = 1) -> None:
+        """Increments the counter."""
+        self._get_shard().counts[counter] += count
+
+    def add_latency(self, seconds: float) -> None:
+        """Records latency of a finished item, or batch."""
+        shard = self._get_shard()
+        shard.latency_counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        shard.latency_sum += seconds
+
+    def get_totals(self) -> Tuple[Dict[str, int], List[int], float]:
+        """Returns counters, latency bucket counts and latency sum of all the
+        threads."""
+        counts = dict.fromkeys(COUNTERS, 0)
+        latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        latency_sum = 0.0
+
+        with self._lock:
+            shards = list(self._shards)
+
+        for shard in shards:
+            for counter, count in list(shard.counts.items()):
+                counts[counter] += count
+            for index, count in enumerate(list(shard.latency_counts)):
+                latency_counts[index] += count
+            latency_sum += shard.latency_sum
+
+        return counts, latency_counts, latency_sum
+
+
+class _NullTaskMetrics:
+    """Metrics of a disabled exporter, records nothing."""
+
+    def add(self, counter: str, count: int = 1) -> None:
+        """Ignores the counter."""
+        pass
+
+    def add_latency(self, seconds: float) -> None:
+        """Ignores the latency."""
+        pass
+
+
+_NULL_TASK_METRICS = _NullTaskMetrics()
+
+
+def get_quantile(latency_counts: List[int], quantile: float) -> float:
+    """Returns quantile of the latencies estimated from the bucket counts, by
+    interpolating inside the bucket."""
+    total = sum(latency_counts)
+    if total == 0:
+        return float("nan")
+
+    rank = quantile * total
+    seen = 0
+
+    for index, count in enumerate(latency_counts):
+        if count and seen + count >= rank:
+            if index == len(LATENCY_BUCKETS):
+                return LATENCY_BUCKETS[-1]
+
+            lower = LATENCY_BUCKETS[index - 1] if index > 0 else 0.0
+            upper = LATENCY_BUCKETS[index]
+            return lower + (upper - lower) * (rank - seen) / count
+
+        seen += count
+
+    return LATENCY_BUCKETS[-1]
+
+
+def _escape_label(value: Any) -> str:
+    """Escapes label value of the Prometheus text format."""
+    return (
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    )
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    """Returns labels of a sample."""
+    return ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels.items())
+
+
+class Metrics:
+    """Counters of tasks and fan-out items, exported in Prometheus text format
+    to a file rewritten every interval seconds, and/or served over HTTP.
+
+    Metrics are grouped by the task name of the pipeline config, so that all
+    the items of a fan-out are counted together. Items per second are computed
+    over the last interval, latency quantiles over the whole run. A disabled
+    exporter records nothing.
+    """
+
+    def __init__(
+        self,
+        pipeline_name: str = None,
+        metrics_file: str = None,
+        port: int = 0,
+        host: str = "127.0.0.1",
+        interval: float = 10,
+    ) -> None:
+        """Init."""
+        self.pipeline_name = pipeline_name
+        self.metrics_file = metrics_file
+        self.port = port
+        self.host = host
+        self.interval = interval
+        self.enabled = metrics_file is not None or port > 0
+
+        self._tasks: Dict[str, TaskMetrics] = {}
+        self._lock = threading.Lock()
+
+        # Task name to items per second over the last interval
+        self._rates: Dict[str, float] = {}
+        self._last_finished: Dict[str, int] = {}
+        self._last_rate_time = time.monotonic()
+
+        self._snapshot_store: SnapshotStore = None
+        self._server: ThreadingHTTPServer = None
+        self._thread: threading.Thread = None
+        self._stopped = threading.Event()
+
+    def get(self, task_name: str) -> TaskMetrics:
+        """Returns metrics of the task of the pipeline config."""
+        if not self.enabled:
+            return _NULL_TASK_METRICS
+
+        task_metrics = self._tasks.get(task_name)
+
+        if task_metrics is None:
+            with self._lock:
+                task_metrics = self._tasks.setdefault(task_name, TaskMetrics())
+
+        return task_metrics
+
+    def start(self, snapshot_store: SnapshotStore = None) -> None:
+        """Starts writing the metrics file and serving metrics over HTTP."""
+        if not self.enabled:
+            return
+
+        self._snapshot_store = snapshot_store
+
+        if self.port > 0:
+            self._server = ThreadingHTTPServer(
+                (self.host, self.port), _create_request_handler(self)
+            )
+            self._server.daemon_threads = True
+            threading.Thread(
+                target=self._server.serve_forever,
+                name="pypelines-metrics-http",
+                daemon=True,
+            ).start()
+            print(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+        self._thread = threading.Thread(
+            target=self._run, name="pypelines-metrics", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        """Updates rates and writes the metrics file every interval."""
+        while not self._stopped.wait(self.interval):
+            self._update_rates()
+            self.write_file()
+
+    def _update_rates(self) -> None:
+        """Computes items per second of each task since the last update."""
+        now = time.monotonic()
+        elapsed = now - self._last_rate_time
+
+        with self._lock:
+            tasks = list(self._tasks.items())
+
+        rates = {}
+        for task_name, task_metrics in tasks:
+            counts = task_metrics.get_totals()[0]
+            finished = (
+                counts[ITEMS_COMPLETED] + counts[ITEMS_FAILED] + counts[ITEMS_CANCELLED]
+            )
+            last_finished = self._last_finished.get(task_name, 0)
+            rates[task_name] = (finished - last_finished) / elapsed if elapsed else 0
+            self._last_finished[task_name] = finished
+
+        self._rates = rates
+        self._last_rate_time = now
+
+    def write_file(self) -> None:
+        """Rewrites the metrics file, the file is replaced at once so that
+        readers never see a partial file."""
+        if self.metrics_file is None:
+            return
+
+        temp_path = f"{self.metrics_file}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(self.format())
+
+        os.replace(temp_path, self.metrics_file)
+
+    def format(self) -> str:
+        """Returns metrics in Prometheus text format."""
+        lines = []
+        pipeline = {"pipeline": self.pipeline_name}
+
+        with self._lock:
+            tasks = sorted(self._tasks.items())
+
+        totals = [
+            (task_name, *task_metrics.get_totals())
+            for task_name, task_metrics in tasks
+        ]
+
+        def add_family(name: str, metric_type: str, help_text: str) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        def add_sample(name: str, labels: Dict[str, Any], value: float) -> None:
+            lines.append(f"{name}{{{_format_labels({**pipeline, **labels})}}} {value}")
+
+        add_family("pypelines_tasks_total", "counter", "Finished tasks by result.")
+        for task_name, counts, _, _ in totals:
+            for result, counter in [
+                ("completed", TASKS_COMPLETED),
+                ("failed", TASKS_FAILED),
+                ("cancelled", TASKS_CANCELLED),
+                ("skipped", TASKS_SKIPPED),
+            ]:
+                if counts[counter]:
+                    add_sample(
+                        "pypelines_tasks_total",
+                        {"task": task_name, "result": result},
+                        counts[counter],
+                    )
+
+        fan_outs = [
+            row for row in totals if row[1][ITEMS_SUBMITTED] or row[1][ITEMS_SKIPPED]
+        ]
+
+        add_family(
+            "pypelines_items_total", "counter", "Finished fan-out items by result."
+        )
+        for task_name, counts, _, _ in fan_outs:
+            for result, counter in [
+                ("completed", ITEMS_COMPLETED),
+                ("failed", ITEMS_FAILED),
+                ("cancelled", ITEMS_CANCELLED),
+                ("skipped", ITEMS_SKIPPED),
+            ]:
+                add_sample(
+                    "pypelines_items_total",
+                    {"task": task_name, "result": result},
+                    counts[counter],
+                )
+
+        add_family(
+            "pypelines_items_per_second",
+            "gauge",
+            "Fan-out items finished per second over the last interval.",
+        )
+        for task_name, _, _, _ in fan_outs:
+            add_sample(
+                "pypelines_items_per_second",
+                {"task": task_name},
+                round(self._rates.get(task_name, 0), 3),
+            )
+
+        add_family(
+            "pypelines_items_in_flight",
+            "gauge",
+            "Fan-out items waiting for a worker or running.",
+        )
+        for task_name, counts, _, _ in fan_outs:
+            finished = (
+                counts[ITEMS_COMPLETED] + counts[ITEMS_FAILED] + counts[ITEMS_CANCELLED]
+            )
+            # Counters of different threads are read at slightly different times
+            add_sample(
+                "pypelines_items_in_flight",
+                {"task": task_name},
+                max(0, counts[ITEMS_SUBMITTED] - finished),
+            )
+
+        add_family(
+            "pypelines_items_queued", "gauge", "Fan-out items waiting for a worker."
+        )
+        for task_name, counts, _, _ in fan_outs:
+            add_sample(
+                "pypelines_items_queued",
+                {"task": task_name},
+                max(0, counts[ITEMS_SUBMITTED] - counts[ITEMS_STARTED]),
+            )
+
+        add_family(
+            "pypelines_item_latency_seconds",
+            "summary",
+            "Duration of fan-out items, or batches, since the start of the run.",
+        )
+        for task_name, _, latency_counts, latency_sum in fan_outs:
+            for quantile in LATENCY_QUANTILES:
+                add_sample(
+                    "pypelines_item_latency_seconds",
+                    {"task": task_name, "quantile": quantile},
+                    round(get_quantile(latency_counts, quantile), 6),
+                )
+            add_sample(
+                "pypelines_item_latency_seconds_sum",
+                {"task": task_name},
+                round(latency_sum, 6),
+            )
+            add_sample(
+                "pypelines_item_latency_seconds_count",
+                {"task": task_name},
+                sum(latency_counts),
+            )
+
+        store_stats = (
+            self._snapshot_store.get_stats() if self._snapshot_store is not None else {}
+        )
+
+        for name, metric_type, help_text, key in [
+            (
+                "pypelines_snapshot_store_calls_total",
+                "counter",
+                "Calls of the snapshot store by operation.",
+                "calls",
+            ),
+            (
+                "pypelines_snapshot_store_seconds_total",
+                "counter",
+                "Time spent in the snapshot store by operation.",
+                "total_seconds",
+            ),
+            (
+                "pypelines_snapshot_store_max_seconds",
+                "gauge",
+                "Slowest call of the snapshot store by operation.",
+                "max_seconds",
+            ),
+        ]:
+            add_family(name, metric_type, help_text)
+            for operation, stats in sorted(store_stats.items()):
+                add_sample(name, {"operation": operation}, round(stats[key], 6))
+
+        return "\n".join(lines) + "\n"
+
+    def close(self) -> None:
+        """Writes the final metrics file and stops the HTTP server."""
+        if not self.enabled:
+            return
+
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+        self._update_rates()
+        self.write_file()
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _create_request_handler(metrics: Metrics) -> type:
+    """Returns HTTP request handler serving the metrics on /metrics."""
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+
+            body = metrics.format().encode()
+
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            # Requests are not logged to the output of the pipeline
+            pass
+
+    return MetricsRequestHandler
@@ -0,0 +1,50 @@
+"""Layered parameter scopes."""
+from typing import Any, Iterator, Mapping
+
+
+class ParameterScope(Mapping):
+    """Immutable mapping of parameters chained to a parent mapping.
+
+    Bindings of the scope override parameters of the parent with the same name.
+    Child scopes reference their parent instead of copying it, so adding
+    bindings for each item of nested tasks does not copy all the parameters.
+    """
+
+    __slots__ = ("_bindings", "_parent", "_length")
+
+    def __init__(
+        self, bindings: Mapping[str, Any] = None, parent: Mapping[str, Any] = None
+    ) -> None:
+        """Init."""
+        self._bindings: Mapping[str, Any] = bindings if bindings is not None else {}
+        self._parent: Mapping[str, Any] = parent if parent is not None else {}
+        self._length: int = None
+
+    def child(self, bindings: Mapping[str, Any]) -> "ParameterScope":
+        """Returns scope containing parameters of this scope and given bindings."""
+        return ParameterScope(bindings, parent=self)
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._bindings:
+            return self._bindings[key]
+
+        return self._parent[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._bindings or key in self._parent
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._bindings
+
+        for key in self._parent:
+            if key not in self._bindings:
+                yield key
+
+    def __len__(self) -> int:
+        if self._length is None:
+            self._length = sum(1 for _ in self)
+
+        return self._length
+
+    def __repr__(self) -> str:
+        return f"ParameterScope({dict(self)})"
@@ -1,10 +1,16 @@
 """Pipeline"""
 from yaml import safe_load
 from dataclasses import dataclass
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
 
 from pypelines import utils
-from pypelines.tasks import run_task
+from pypelines.plan import TaskPlan
+from pypelines.tasks import compile_tasks, run_task
+from pypelines.task_graph import TaskGraph
+from pypelines.script_cache import script_cache
+from pypelines.cancellation import CancellationToken
+from pypelines.snapshot_store import SnapshotStore
+from pypelines.snapshot_stores import get_snapshot_store
 from pypelines.pipeline_options import PipelineOptions
 
 
@@ -41,32 +47,67 @@ class Pipeline:
         self.parameters: List[PipelineParameter] = []
         self.variables = {}
 
+        # Compiled tasks of the pipeline
+        self.task_plans: Tuple[TaskPlan, ...] = ()
+        # Dependency graph of the tasks, None if no task declares depends-on
+        self.task_graph: TaskGraph = None
+
         self.options: PipelineOptions = None
 
+        # Snapshot store is shared by all tasks and threads of the pipeline
+        self.snapshot_store: SnapshotStore = None
+
     def load_from_yaml(
         self,
         pipeline_path: str,
         parameters: Dict[str, Any] = {},
+        max_workers: int = None,
+        trace_file: str = None,
     ) -> None:
         """Load pipeline from yaml file."""
         with open(pipeline_path, "r") as f:
             self._pipeline_yaml = safe_load(f.read())
-            self.load(self._pipeline_yaml, parameters)
+            self.load(
+                self._pipeline_yaml,
+                parameters,
+                max_workers=max_workers,
+                trace_file=trace_file,
+            )
 
     def load(
         self,
         pipeline_yaml: Dict[str, Any],
         parameter_values: Dict[str, Any] = {},
+        max_workers: int = None,
+        trace_file: str = None,
     ) -> None:
-        """Create pipeline from pipeline options."""
+        """Create pipeline from pipeline options.
+
+        max_workers and trace_file override max-workers and trace-file of the
+        pipeline config.
+        """
         self._pipeline_yaml = pipeline_yaml
 
         self.load_parameters(parameter_values)
 
+        # Tasks are validated before any work starts
+        self.task_plans = compile_tasks(pipeline_yaml["tasks"])
+
         # Load pipeline options
         config = pipeline_yaml["config"]
         self.options = PipelineOptions()
-        self.options.load(config, self.get_parameter_values())
+        self.options.load(
+            config,
+            self.get_parameter_values(),
+            max_workers=max_workers,
+            trace_file=trace_file,
+        )
+
+        self.load_task_graph()
+
+        # Create snapshot store of the configured backend
+        self.snapshot_store = get_snapshot_store(self.options.snapshot_backend)
+        self.options.load_snapshot(self.snapshot_store)
 
         self.validate()
 
@@ -124,6 +165,27 @@ class Pipeline:
                     )
                 )
 
+    def load_task_graph(self) -> None:
+        """Creates dependency graph of the tasks, if any task declares depends-on.
+
+        Task names in depends-on may contain pipeline parameters.
+        """
+        if not any(task_plan.depends_on for task_plan in self.task_plans):
+            return
+
+        parameters = self.options.parameters
+
+        self.task_graph = TaskGraph(
+            [task_plan.get_name(parameters) for task_plan in self.task_plans],
+            [
+                [
+                    utils.replace_parameters_from_string(name, parameters)
+                    for name in task_plan.depends_on
+                ]
+                for task_plan in self.task_plans
+            ],
+        )
+
     def validate(self) -> None:
         """Validate pipeline."""
         pass
@@ -136,15 +198,70 @@ class Pipeline:
         """Run pipeline."""
         print("Running pipeline")
 
-        for task_config in self._pipeline_yaml["tasks"]:
-            run_task(
-                task_config=task_config,
-                parameters=self.options.parameters,
-                pipeline_options=self.options,
-                extra_parameters={},
-            )
+        # Remove old scripts of earlier runs from the script cache
+        script_cache.evict()
+
+        try:
+            self.options.metrics.start(self.snapshot_store)
+
+            with self.options.tracer.span(self.options.pipeline_name, "pipeline"):
+                if self.task_graph is None:
+                    # Tasks run one by one, in the given order
+                    for task_plan in self.task_plans:
+                        self._run_task(task_plan)
+                else:
+                    self.task_graph.run(
+                        lambda index, cancellation_token: self._run_task(
+                            self.task_plans[index], cancellation_token
+                        ),
+                        max_parallel=self.options.max_parallel_tasks,
+                    )
+
+            # Pipeline is marked as completed only if all the tasks succeeded
+            self.options.snapshot.set_pipeline_completed()
+            print("Pipeline completed")
+        finally:
+            self.close()
+
+    def _run_task(
+        self, task_plan: TaskPlan, cancellation_token: CancellationToken = None
+    ) -> None:
+        """Runs top-level task, cancellation_token is set when tasks run
+        concurrently."""
+        run_task(
+            task_plan=task_plan,
+            parameters=self.options.parameters,
+            pipeline_options=self.options,
+            extra_parameters={},
+            cancellation_token=cancellation_token,
+        )
+
+    def close(self) -> None:
+        """Releases resources held by the pipeline.
+
+        Buffered task completions are written to the snapshot store before the
+        store is closed, and queued script output is written to the log files,
+        also when the pipeline fails or is interrupted.
+        """
+        try:
+            if self.options is not None:
+                self.options.task_output.close()
+
+            if self.options is not None and self.options.snapshot is not None:
+                self.options.snapshot.close()
+        finally:
+            if self.snapshot_store is not None:
+                self.snapshot_store.close()
+
+            if self.options is not None:
+                self.options.metrics.close()
+
+            if self.options is not None and self.options.trace_file is not None:
+                self.write_trace()
 
-        # TODO: When some tasks have error, don't mark pipeline as completed
+    def write_trace(self) -> None:
+        """Writes recorded spans to the trace file and prints their summary."""
+        self.options.tracer.write_chrome_trace(self.options.trace_file)
 
-        self.options.snapshot.set_pipeline_completed()
-        print("Pipeline completed")
+        print(self.options.tracer.format_summary())
+        print(f"Trace is written to {self.options.trace_file}")
@@ -1,11 +1,50 @@
 """Pipeline options."""
-from typing import Any, Dict
-from datetime import datetime
-from pymongo import DESCENDING
+import os
+import re
+import threading
+from typing import Any, Dict, List
+from datetime import datetime, timedelta
 
 from pypelines import utils
+from pypelines.config import (
+    MAX_WORKERS,
+    OUTPUT_MODE,
+    METRICS_FILE,
+    METRICS_HOST,
+    METRICS_PORT,
+    METRICS_INTERVAL,
+    TRACE_MAX_EVENTS,
+    TASK_HASH_MODE,
+    LOGS_DIRECTORY,
+    LOG_QUEUE_SIZE,
+    LOG_BACKUP_COUNT,
+    FAN_OUT_EXECUTOR,
+    MAX_PARALLEL_TASKS,
+    SCRIPT_ENVIRONMENT,
+    SCRIPT_ENVIRONMENT_ALLOW_LIST,
+    SNAPSHOT_BACKEND,
+    SNAPSHOT_FLUSH_SIZE,
+    SNAPSHOT_WRITE_MODE,
+    SNAPSHOT_PRELOAD_LIMIT,
+    SNAPSHOT_FLUSH_INTERVAL,
+    LOG_MAX_FILE_SIZE_MB,
+    OUTPUT_SAMPLE_INTERVAL,
+    INPUT_FILE_FINGERPRINT,
+)
 from pypelines.snapshot import Snapshot
-from pypelines.constants import SnapshotCollectionFields
+from pypelines.tracing import Tracer
+from pypelines.metrics import Metrics
+from pypelines.task_output import TaskOutput
+from pypelines.worker_budget import WorkerBudget
+from pypelines.snapshot_store import SnapshotStore
+from pypelines.constants import (
+    OutputModes,
+    TaskHashModes,
+    InputFileFingerprints,
+    FanOutExecutors,
+    ScriptEnvironmentModes,
+    SnapshotCollectionFields,
+)
 
 
 class PipelineOptions:
@@ -19,8 +58,47 @@ class PipelineOptions:
         self.pipeline_id: str = None
         self.pipeline_name: str = None
         self.use_snapshots: bool = False
+        self.snapshot_backend: str = SNAPSHOT_BACKEND
+        self.snapshot_write_mode: str = SNAPSHOT_WRITE_MODE
+        self.snapshot_flush_size: int = SNAPSHOT_FLUSH_SIZE
+        self.snapshot_flush_interval: float = SNAPSHOT_FLUSH_INTERVAL
+        self.snapshot_preload_limit: int = SNAPSHOT_PRELOAD_LIMIT
+
+        # Snapshots of older runs of the pipeline are deleted when the pipeline
+        # is loaded, None means snapshots are never deleted
+        self.snapshot_retention_days: float = None
         self.parameters: Dict[str, str] = None
 
+        self.task_hash_mode: str = TASK_HASH_MODE
+        self.input_file_fingerprint: str = INPUT_FILE_FINGERPRINT
+
+        self.max_parallel_tasks: int = MAX_PARALLEL_TASKS
+        self.fan_out_executor: str = FAN_OUT_EXECUTOR
+        self.max_workers: int = MAX_WORKERS
+        # Shared by the thread pools of all the fan-out tasks of the pipeline
+        self.worker_budget: WorkerBudget = WorkerBudget(MAX_WORKERS)
+        self.script_environment: str = SCRIPT_ENVIRONMENT
+        self.script_environment_allow_list: List[str] = _split_list(
+            SCRIPT_ENVIRONMENT_ALLOW_LIST
+        )
+        # Output of scripts and progress messages
+        self.task_output: TaskOutput = _create_task_output(
+            OUTPUT_MODE,
+            LOGS_DIRECTORY,
+            LOG_MAX_FILE_SIZE_MB,
+            OUTPUT_SAMPLE_INTERVAL,
+            self.now,
+            pipeline_name=None,
+        )
+        # Spans of the tasks, recorded only when trace_file is set
+        self.trace_file: str = None
+        self.tracer: Tracer = Tracer()
+        # Live metrics, exported only when a metrics file or port is set
+        self.metrics: Metrics = Metrics()
+        # Static part of environment of scripts, built once per pipeline
+        self._script_base_environment: Dict[str, str] = None
+        self._script_base_environment_lock = threading.Lock()
+
         # When pipeline is completed, set this to True
         self.is_completed: bool = False
 
@@ -33,36 +111,49 @@ class PipelineOptions:
         self.continue_from_last_run = True
 
         self.snapshot: Snapshot = None
+        self.snapshot_store: SnapshotStore = None
 
     def get_pipeline_id(self) -> str:
         """Return pipeline id.
 
         If continue-from-last-run is enabled, returns last pipeline id.
         Else returns current timestamp as new pipeline ID.
+
+        When task-hash-mode is "inputs", the last pipeline id is returned also
+        when the last run was completed, so that tasks whose inputs did not
+        change are skipped in every run.
         """
         new_pipeline_id = f"{datetime.timestamp(self.now)} - {self.pipeline_name}"
         if not self.continue_from_last_run:
             return new_pipeline_id
 
-        db = utils.get_snapshots_collection()
-
         # Finds last snapshot with same database name as pipeline name
-        last_snapshot_doc = db.find_one(
-            dict(pipeline_name=self.pipeline_name),
-            sort=[("created_at", DESCENDING)],
-        )
+        last_snapshot_doc = self.snapshot_store.find_last_snapshot(self.pipeline_name)
 
         if last_snapshot_doc is None:
             return new_pipeline_id
 
         # If last pipeline run was completed then return new pipeline id
-        if last_snapshot_doc.get(SnapshotCollectionFields.IS_COMPLETED):
+        if (
+            last_snapshot_doc.get(SnapshotCollectionFields.IS_COMPLETED)
+            and self.task_hash_mode != TaskHashModes.INPUTS
+        ):
             return new_pipeline_id
 
-        return last_snapshot_doc["_id"]
+        return last_snapshot_doc[SnapshotCollectionFields.RECORD_ID]
 
-    def load(self, config: Dict[str, Any], parameters: Dict[str, Any]) -> None:
-        """Load pipeline options."""
+    def load(
+        self,
+        config: Dict[str, Any],
+        parameters: Dict[str, Any],
+        max_workers: int = None,
+        trace_file: str = None,
+    ) -> None:
+        """Load pipeline options.
+
+        max_workers and trace_file override max-workers and trace-file of the
+        config when they are not None.
+        """
         self.parameters = parameters
 
         self.pipeline_name = utils.replace_parameters_from_anything(
@@ -75,19 +166,262 @@ class PipelineOptions:
             )
         )
 
+        self.snapshot_backend = utils.replace_parameters_from_anything(
+            config.get("snapshot-backend", SNAPSHOT_BACKEND), parameters
+        )
+
+        self.snapshot_write_mode = utils.replace_parameters_from_anything(
+            config.get("snapshot-write-mode", SNAPSHOT_WRITE_MODE), parameters
+        )
+
+        self.snapshot_flush_size = int(
+            utils.replace_parameters_from_anything(
+                config.get("snapshot-flush-size", SNAPSHOT_FLUSH_SIZE), parameters
+            )
+        )
+
+        self.snapshot_flush_interval = float(
+            utils.replace_parameters_from_anything(
+                config.get("snapshot-flush-interval", SNAPSHOT_FLUSH_INTERVAL),
+                parameters,
+            )
+        )
+
+        self.snapshot_preload_limit = int(
+            utils.replace_parameters_from_anything(
+                config.get("snapshot-preload-limit", SNAPSHOT_PRELOAD_LIMIT),
+                parameters,
+            )
+        )
+
+        snapshot_retention_days = utils.replace_parameters_from_anything(
+            config.get("snapshot-retention-days"), parameters
+        )
+        if snapshot_retention_days is not None:
+            self.snapshot_retention_days = float(snapshot_retention_days)
+
+        if trace_file is None:
+            trace_file = utils.replace_parameters_from_anything(
+                config.get("trace-file"), parameters
+            )
+        self.trace_file = trace_file
+        self.tracer = Tracer(
+            enabled=self.trace_file is not None, max_events=TRACE_MAX_EVENTS
+        )
+
+        self.metrics = Metrics(
+            self.pipeline_name,
+            metrics_file=utils.replace_parameters_from_anything(
+                config.get("metrics-file", METRICS_FILE), parameters
+            ),
+            port=int(
+                utils.replace_parameters_from_anything(
+                    config.get("metrics-port", METRICS_PORT), parameters
+                )
+            ),
+            host=METRICS_HOST,
+            interval=float(
+                utils.replace_parameters_from_anything(
+                    config.get("metrics-interval", METRICS_INTERVAL), parameters
+                )
+            ),
+        )
+
+        self.task_hash_mode = utils.replace_parameters_from_anything(
+            config.get("task-hash-mode", TASK_HASH_MODE), parameters
+        )
+        if self.task_hash_mode not in TaskHashModes.ALL:
+            raise ValueError(
+                "Task hash mode must be one of {}, provided '{}'".format(
+                    TaskHashModes.ALL, self.task_hash_mode
+                )
+            )
+
+        self.input_file_fingerprint = utils.replace_parameters_from_anything(
+            config.get("input-file-fingerprint", INPUT_FILE_FINGERPRINT), parameters
+        )
+        if self.input_file_fingerprint not in InputFileFingerprints.ALL:
+            raise ValueError(
+                "Input file fingerprint must be one of {}, provided '{}'".format(
+                    InputFileFingerprints.ALL, self.input_file_fingerprint
+                )
+            )
+
+        self.max_parallel_tasks = int(
+            utils.replace_parameters_from_anything(
+                config.get("max-parallel-tasks", MAX_PARALLEL_TASKS), parameters
+            )
+        )
+        if self.max_parallel_tasks < 1:
+            raise ValueError("max-parallel-tasks must be at least 1")
+
+        if max_workers is None:
+            max_workers = utils.replace_parameters_from_anything(
+                config.get("max-workers", MAX_WORKERS), parameters
+            )
+        self.max_workers = int(max_workers)
+        if self.max_workers < 0:
+            raise ValueError("max-workers must not be negative")
+        self.worker_budget = WorkerBudget(self.max_workers)
+
+        self.fan_out_executor = utils.replace_parameters_from_anything(
+            config.get("fan-out-executor", FAN_OUT_EXECUTOR), parameters
+        )
+        if self.fan_out_executor not in FanOutExecutors.ALL:
+            raise ValueError(
+                "Fan-out executor must be one of {}, provided '{}'".format(
+                    FanOutExecutors.ALL, self.fan_out_executor
+                )
+            )
+
+        self.script_environment = utils.replace_parameters_from_anything(
+            config.get("script-environment", SCRIPT_ENVIRONMENT), parameters
+        )
+        if self.script_environment not in ScriptEnvironmentModes.ALL:
+            raise ValueError(
+                "Script environment must be one of {}, provided '{}'".format(
+                    ScriptEnvironmentModes.ALL, self.script_environment
+                )
+            )
+
+        script_environment_allow_list = utils.replace_parameters_from_anything(
+            config.get("script-environment-allow-list"), parameters
+        )
+        if script_environment_allow_list is not None:
+            self.script_environment_allow_list = _split_list(
+                script_environment_allow_list
+            )
+
+        output_mode = utils.replace_parameters_from_anything(
+            config.get("output-mode", OUTPUT_MODE), parameters
+        )
+        if output_mode not in OutputModes.ALL:
+            raise ValueError(
+                "Output mode must be one of {}, provided '{}'".format(
+                    OutputModes.ALL, output_mode
+                )
+            )
+
+        self.task_output = _create_task_output(
+            output_mode,
+            utils.replace_parameters_from_anything(
+                config.get("logs-directory", LOGS_DIRECTORY), parameters
+            ),
+            float(
+                utils.replace_parameters_from_anything(
+                    config.get("log-max-file-size-mb", LOG_MAX_FILE_SIZE_MB),
+                    parameters,
+                )
+            ),
+            float(
+                utils.replace_parameters_from_anything(
+                    config.get("output-sample-interval", OUTPUT_SAMPLE_INTERVAL),
+                    parameters,
+                )
+            ),
+            self.now,
+            pipeline_name=self.pipeline_name,
+        )
+
+    def load_snapshot(self, snapshot_store: SnapshotStore) -> None:
+        """Load pipeline id and snapshot from the snapshot store."""
+        self.snapshot_store = snapshot_store
+
         self.pipeline_id = self.get_pipeline_id()
 
-        self.snapshot = Snapshot(self.pipeline_id, self.pipeline_name)
+        self.snapshot = Snapshot(
+            self.pipeline_id,
+            self.pipeline_name,
+            self.snapshot_store,
+            write_mode=self.snapshot_write_mode,
+            flush_size=self.snapshot_flush_size,
+            flush_interval=self.snapshot_flush_interval,
+            preload_limit=self.snapshot_preload_limit,
+        )
 
         # Insert new snapshot doc if it does not exist
         self.snapshot.create_if_not_exist()
 
+        # When continuing from last run, completed tasks are checked in memory
+        self.snapshot.load_completed_tasks()
+
+        if self.snapshot_retention_days is not None:
+            self.snapshot_store.delete_snapshots(
+                self.pipeline_name,
+                created_before=self.now - timedelta(days=self.snapshot_retention_days),
+                keep_pipeline_id=self.pipeline_id,
+            )
+
+    def get_script_base_environment(self) -> Dict[str, str]:
+        """Returns environment variables passed to all the scripts of the
+        pipeline: OS environment variables and pipeline config.
+
+        The environment is built once, on the first call after the pipeline is
+        loaded, and must not be modified.
+        """
+        if self._script_base_environment is not None:
+            return self._script_base_environment
+
+        with self._script_base_environment_lock:
+            if self._script_base_environment is None:
+                if self.script_environment == ScriptEnvironmentModes.MINIMAL:
+                    environment = {
+                        key: os.environ[key]
+                        for key in self.script_environment_allow_list
+                        if key in os.environ
+                    }
+                else:
+                    environment = os.environ.copy()
+
+                for key, value in self.get_config_dict().items():
+                    # Replaces special chars from key
+                    key = f"pipeline_{re.sub(r'[^a-zA-Z0-9_]', '_', key)}"
+                    environment[key] = str(value)
+
+                self._script_base_environment = environment
+
+        return self._script_base_environment
+
     def get_config_dict(self) -> Dict[str, Any]:
         """Get config dict."""
         return {
             "id": self.pipeline_id,
             "name": self.pipeline_name,
             "use-snapshot": self.use_snapshots,
+            "snapshot-backend": self.snapshot_backend,
             "start-time": self.pipeline_start_time,
             "is-completed": self.is_completed,
         }
+
+
+def _split_list(value: Any) -> List[str]:
+    """Splits comma separated string, lists are returned as they are."""
+    if isinstance(value, list):
+        return [str(item) for item in value]
+
+    return [item.strip() for item in str(value).split(",") if item.strip()]
+
+
+def _create_task_output(
+    mode: str,
+    logs_directory: str,
+    max_file_size_mb: float,
+    sample_interval: float,
+    now: datetime,
+    pipeline_name: str,
+) -> TaskOutput:
+    """Returns task output writing logs of the run to a sub-directory of
+    logs_directory named after the pipeline and its start time."""
+    run_directory_name = "{}-{}".format(
+        re.sub(r"[^a-zA-Z0-9._-]+", "_", pipeline_name or "pipeline").strip("_"),
+        now.strftime("%Y%m%d-%H%M%S"),
+    )
+
+    return TaskOutput(
+        mode,
+        os.path.join(os.path.expanduser(logs_directory), run_directory_name),
+        max_file_size=int(max_file_size_mb * 1024 * 1024),
+        backup_count=LOG_BACKUP_COUNT,
+        sample_interval=sample_interval,
+        queue_size=LOG_QUEUE_SIZE,
+    )
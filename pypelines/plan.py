@@ -0,0 +1,225 @@
+"""Execution plan compiled from the pipeline tasks."""
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Tuple, Type
+
+from pypelines import utils
+
+# Keys allowed in the task config
+TASK_CONFIG_KEYS = ["task", "name", "inputs", "depends-on", "input-files"]
+
+
+def _has_parameters(obj: Any) -> bool:
+    """Returns true if obj, or any of its items, contains parameters."""
+    if isinstance(obj, str):
+        return "${{" in obj
+    if isinstance(obj, list):
+        return any(_has_parameters(item) for item in obj)
+    if isinstance(obj, dict):
+        return any(
+            _has_parameters(key) or _has_parameters(value) for key, value in obj.items()
+        )
+
+    return False
+
+
+def _convert_input_value(task_input: Any, value: Any) -> Any:
+    """Converts input value to the type of the input, and validates it."""
+    if task_input.value_type is not None:
+        try:
+            value = task_input.value_type(value)
+        except Exception:
+            raise Exception(
+                f"{task_input.name} is not of type {task_input.value_type}"
+            )
+
+    if task_input.allowed_values is not None and value not in task_input.allowed_values:
+        raise ValueError(
+            "{} must be one of {}, provided '{}'".format(
+                task_input.name, task_input.allowed_values, value
+            )
+        )
+
+    return value
+
+
+@dataclass(frozen=True)
+class TaskPlan:
+    """Validated task of the pipeline.
+
+    Inputs which do not contain parameters are parsed once, when the plan is
+    compiled, only inputs containing parameters are parsed for each run.
+    """
+
+    task_type: str
+    # Task class, a PipelineTask
+    task_class: Type
+    # Task name, may contain parameters
+    name: str
+    # Raw input values of the task config
+    input_values: Mapping[str, Any]
+    # Parsed inputs not containing parameters, and default values
+    static_inputs: Mapping[str, Any]
+    # Raw inputs containing parameters, parsed for each run
+    dynamic_inputs: Mapping[str, Any]
+    # Names of the tasks which must be completed before this task
+    depends_on: Tuple[str, ...] = ()
+    # Paths or glob patterns of the files read by the task, may contain
+    # parameters. Fingerprints of the files are part of the task hash when
+    # task-hash-mode is "inputs"
+    input_files: Tuple[str, ...] = ()
+
+    def get_name(self, parameters: Mapping[str, Any]) -> str:
+        """Returns name of the task with parameters replaced."""
+        return utils.replace_parameters_from_string(self.name, parameters)
+
+    def get_input_files(self, parameters: Mapping[str, Any]) -> List[str]:
+        """Returns input file paths and patterns with parameters replaced."""
+        return [
+            utils.replace_parameters_from_string(path, parameters)
+            for path in self.input_files
+        ]
+
+    def get_parsed_inputs(self, parameters: Mapping[str, Any]) -> Dict[str, Any]:
+        """Returns parsed input values, replacing parameters in dynamic inputs."""
+        parsed_input_values = dict(self.static_inputs)
+
+        if not self.dynamic_inputs:
+            return parsed_input_values
+
+        for task_input in self.task_class.task_input_schema:
+            val = self.dynamic_inputs.get(task_input.name)
+
+            if val is None:
+                continue
+
+            val = utils.replace_parameters_from_anything(val, parameters)
+            parsed_input_values[task_input.name] = _convert_input_value(task_input, val)
+
+        return parsed_input_values
+
+
+def compile_task_plan(
+    task_class: Type,
+    name: str,
+    input_values: Dict[str, Any],
+    task_classes: Mapping[str, Type] = None,
+    depends_on: Tuple[str, ...] = (),
+    input_files: Tuple[str, ...] = (),
+) -> TaskPlan:
+    """Validates inputs of the task and returns its plan.
+
+    task_classes is the task registry, used to compile sub-tasks.
+    """
+    if task_classes is None:
+        from pypelines.tasks import tasks as task_classes
+
+    input_values = input_values or {}
+    if not isinstance(input_values, dict):
+        raise ValueError(f"Inputs of task '{name}' must be a dictionary")
+
+    unique_input_keys = set([x.name for x in task_class.task_input_schema])
+
+    # If invalid key is provided, then raise error
+    for key in input_values:
+        if key not in unique_input_keys:
+            raise ValueError(
+                f"{key} is not a valid input for task {task_class.task_type}"
+            )
+
+    static_inputs: Dict[str, Any] = {}
+    dynamic_inputs: Dict[str, Any] = {}
+
+    for task_input in task_class.task_input_schema:
+        val = input_values.get(task_input.name)
+
+        if val is None:
+            static_inputs[task_input.name] = task_input.default_value
+
+        elif task_input.sub_tasks:
+            # Parameters of sub-tasks are replaced when the sub-tasks run
+            static_inputs[task_input.name] = compile_task_plans(val, task_classes)
+
+        elif task_input.allow_parameters and _has_parameters(val):
+            dynamic_inputs[task_input.name] = val
+            continue
+
+        else:
+            static_inputs[task_input.name] = _convert_input_value(task_input, val)
+
+        if task_input.required and static_inputs[task_input.name] is None:
+            raise ValueError(
+                f"{task_input.name} is required but not provided for task '{name}'"
+            )
+
+    return TaskPlan(
+        task_type=task_class.task_type,
+        task_class=task_class,
+        name=name,
+        input_values=MappingProxyType(input_values),
+        static_inputs=MappingProxyType(static_inputs),
+        dynamic_inputs=MappingProxyType(dynamic_inputs),
+        depends_on=depends_on,
+        input_files=input_files,
+    )
+
+
+def compile_task_plans(
+    task_configs: List[Dict[str, Any]],
+    task_classes: Mapping[str, Type],
+    allow_depends_on: bool = False,
+) -> Tuple[TaskPlan, ...]:
+    """Validates task configs, and their sub-tasks, and returns their plans.
+
+    depends-on is only allowed when allow_depends_on is true, sub-tasks always
+    run in the given order.
+    """
+    if not isinstance(task_configs, list):
+        raise ValueError("Tasks must be a list")
+
+    task_plans = []
+
+    for task_config in task_configs:
+        if not isinstance(task_config, dict):
+            raise ValueError(
+                f"Task config must be a dictionary, provided {task_config}"
+            )
+
+        for key in task_config:
+            if key not in TASK_CONFIG_KEYS:
+                raise ValueError(
+                    f"'{key}' is not a valid key for task '{task_config.get('name')}'"
+                )
+
+        for key in ["task", "name"]:
+            if task_config.get(key) is None:
+                raise ValueError(f"'{key}' is required for task {task_config}")
+
+        task_type = task_config["task"]
+        if task_type not in task_classes:
+            raise ValueError("Task of '{}' type was not found.".format(task_type))
+
+        depends_on = task_config.get("depends-on") or []
+        if depends_on and not allow_depends_on:
+            raise ValueError(
+                f"depends-on is not allowed in sub-task '{task_config['name']}'"
+            )
+        if not isinstance(depends_on, list):
+            depends_on = [depends_on]
+
+        input_files = task_config.get("input-files") or []
+        if not isinstance(input_files, list):
+            input_files = [input_files]
+
+        task_plans.append(
+            compile_task_plan(
+                task_classes[task_type],
+                str(task_config["name"]),
+                task_config.get("inputs"),
+                task_classes,
+                depends_on=tuple(str(name) for name in depends_on),
+                input_files=tuple(str(path) for path in input_files),
+            )
+        )
+
+    return tuple(task_plans)
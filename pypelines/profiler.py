@@ -0,0 +1,256 @@
+"""Sampling profiler of all the threads of a pipeline run."""
+import os
+import re
+import sys
+import time
+import threading
+from collections import Counter
+from types import CodeType
+from typing import Dict, List, Set, Tuple
+
+# Number of functions listed in the summary
+TOP_FUNCTIONS = 25
+
+# Categories of the samples
+ORCHESTRATION = "orchestration"
+SUBPROCESS_WAIT = "subprocess-wait"
+IDLE = "idle"
+
+# (file name, function name) of innermost Python frames of threads waiting for
+# a script to exit, or blocked on its pipes
+SUBPROCESS_WAIT_FUNCTIONS = {
+    ("subprocess.py", "wait"),
+    ("subprocess.py", "_wait"),
+    ("subprocess.py", "_try_wait"),
+    ("subprocess.py", "_communicate"),
+    ("unix_events.py", "_do_waitpid"),
+    ("task_script.py", "_capture_output"),
+    ("task_script.py", "_write_stdin"),
+}
+
+# (file name, function name) of innermost Python frames of threads blocked on a
+# lock, a queue or a select call
+WAIT_FUNCTIONS = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("selectors.py", "select"),
+}
+
+# Waits of threads running a frame of this file are waits for scripts
+SCRIPT_TASK_FILE_NAME = "task_script.py"
+
+EVENT_LOOP_THREAD_NAME = "pypelines-event-loop"
+
+PACKAGE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _get_thread_group(thread_name: str) -> str:
+    """Returns thread name without the index of the thread in its pool."""
+    return re.sub(r"[-_]\d+$", "", thread_name)
+
+
+def _get_label(code: CodeType) -> str:
+    """Returns function name and location of the code, used in the outputs."""
+    file_name = code.co_filename
+    if file_name.startswith(PACKAGE_DIRECTORY):
+        file_name = os.path.relpath(file_name, PACKAGE_DIRECTORY)
+    else:
+        file_name = os.path.basename(file_name)
+
+    name = getattr(code, "co_qualname", code.co_name)
+
+    # Semicolons separate frames in collapsed stacks
+    return f"{name} ({file_name}:{code.co_firstlineno})".replace(";", ":")
+
+
+class SamplingProfiler:
+    """Samples stacks of all the threads every interval seconds.
+
+    Samples of threads waiting for scripts, or blocked in a wait while running a
+    script task, or of the event loop running scripts, are counted as
+    subprocess wait. Samples of other blocked threads are counted as idle, and
+    all the other samples as orchestration.
+
+    Stacks are stored as tuples of code objects, labels are built only when
+    the profile is written.
+    """
+
+    def __init__(self, interval: float) -> None:
+        """Init."""
+        self.interval = interval
+
+        # (thread group, stack from innermost frame) to number of samples
+        self._samples: Counter = Counter()
+        self._ticks = 0
+        self._thread_idents: Set[int] = set()
+        self._thread_names: Dict[int, str] = {}
+
+        self._thread: threading.Thread = None
+        self._stopped = threading.Event()
+        self._start_time = 0.0
+        self._elapsed = 0.0
+
+    def start(self) -> None:
+        """Starts sampling in a daemon thread."""
+        self._start_time = time.perf_counter()
+        self._thread = threading.Thread(
+            target=self._run, name="pypelines-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops sampling."""
+        self._stopped.set()
+        self._thread.join()
+        self._elapsed = time.perf_counter() - self._start_time
+
+    def _get_thread_name(self, ident: int) -> str:
+        """Returns group name of the thread."""
+        name = self._thread_names.get(ident)
+
+        if name is None:
+            self._thread_names = {
+                thread.ident: _get_thread_group(thread.name)
+                for thread in threading.enumerate()
+            }
+            name = self._thread_names.get(ident, f"thread-{ident}")
+
+        return name
+
+    def _run(self) -> None:
+        """Samples stacks of the other threads until stopped."""
+        own_ident = threading.get_ident()
+
+        while not self._stopped.wait(self.interval):
+            self._ticks += 1
+
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+
+                self._thread_idents.add(ident)
+                self._samples[(self._get_thread_name(ident), tuple(stack))] += 1
+
+    @staticmethod
+    def _get_category(thread_name: str, stack: Tuple[CodeType, ...]) -> str:
+        """Returns category of the sample."""
+        code = stack[0]
+        function = (os.path.basename(code.co_filename), code.co_name)
+
+        if function in SUBPROCESS_WAIT_FUNCTIONS:
+            return SUBPROCESS_WAIT
+
+        if function not in WAIT_FUNCTIONS:
+            return ORCHESTRATION
+
+        if thread_name == EVENT_LOOP_THREAD_NAME:
+            return SUBPROCESS_WAIT
+
+        for code in stack:
+            if os.path.basename(code.co_filename) == SCRIPT_TASK_FILE_NAME:
+                return SUBPROCESS_WAIT
+
+        return IDLE
+
+    def format_summary(self) -> str:
+        """Returns time of each category and the functions taking most of the
+        orchestration time."""
+        # Thread seconds represented by a sample
+        sample_seconds = self._elapsed / self._ticks if self._ticks else 0
+
+        categories: Counter = Counter()
+        own: Counter = Counter()
+        total: Dict[str, Counter] = {
+            ORCHESTRATION: Counter(),
+            SUBPROCESS_WAIT: Counter(),
+        }
+
+        for (thread_name, stack), count in self._samples.items():
+            category = self._get_category(thread_name, stack)
+            categories[category] += count
+
+            if category == IDLE:
+                continue
+
+            if category == ORCHESTRATION:
+                own[stack[0]] += count
+
+            for code in set(stack):
+                total[category][code] += count
+
+        samples_count = sum(categories.values())
+
+        lines = [
+            f"Profile of {self._elapsed:.1f} s, {samples_count} samples of "
+            f"{len(self._thread_idents)} threads every {self.interval * 1000:g} ms"
+        ]
+        for category in [ORCHESTRATION, SUBPROCESS_WAIT, IDLE]:
+            lines.append(
+                "  {:<16} {:>10.2f} thread s {:>6.1%}".format(
+                    category,
+                    categories[category] * sample_seconds,
+                    categories[category] / samples_count if samples_count else 0,
+                )
+            )
+
+        lines.append("")
+        lines.append(f"Top {TOP_FUNCTIONS} functions by own orchestration time")
+        lines.append(
+            "{:>10} {:>10} {:>10}  {}".format(
+                "Own s", "Total s", "Wait s", "Function"
+            )
+        )
+
+        for code, count in own.most_common(TOP_FUNCTIONS):
+            lines.append(
+                "{:>10.2f} {:>10.2f} {:>10.2f}  {}".format(
+                    count * sample_seconds,
+                    total[ORCHESTRATION][code] * sample_seconds,
+                    total[SUBPROCESS_WAIT][code] * sample_seconds,
+                    _get_label(code),
+                )
+            )
+
+        return "\n".join(lines)
+
+    def write_collapsed_stacks(self, path: str) -> None:
+        """Writes samples as collapsed stacks, rooted at their category and
+        thread, which can be rendered with flamegraph.pl or speedscope."""
+        labels: Dict[CodeType, str] = {}
+        stacks: Counter = Counter()
+
+        for (thread_name, stack), count in self._samples.items():
+            frames: List[str] = [self._get_category(thread_name, stack), thread_name]
+
+            for code in reversed(stack):
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = _get_label(code)
+                frames.append(label)
+
+            stacks[";".join(frames)] += count
+
+        with open(path, "w") as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+    def write(self, path_prefix: str) -> None:
+        """Writes collapsed stacks to PATH_PREFIX.collapsed and the summary to
+        PATH_PREFIX.txt, and prints the summary."""
+        summary = self.format_summary()
+
+        self.write_collapsed_stacks(f"{path_prefix}.collapsed")
+        with open(f"{path_prefix}.txt", "w") as f:
+            f.write(summary + "\n")
+
+        print(summary)
+        print(
+            f"Profile is written to {path_prefix}.collapsed and {path_prefix}.txt"
+        )
@@ -0,0 +1,132 @@
+"""Content-addressed cache of script files."""
+import os
+import stat
+import time
+import tempfile
+import threading
+from typing import Dict
+
+from pypelines.utils import sha256_hash
+from pypelines.config import (
+    SCRIPTS_CACHE_DIRECTORY,
+    SCRIPTS_CACHE_MAX_AGE_DAYS,
+    SCRIPTS_CACHE_MAX_SIZE_MB,
+)
+
+# Scripts used within this many seconds are never evicted, so that scripts used
+# by running pipelines are not removed
+EVICTION_GRACE_PERIOD = 60 * 60
+
+# Prefix of temporary files, they are ignored when looking up scripts
+TMP_FILE_PREFIX = ".tmp-"
+
+
+class ScriptCache:
+    """Stores each unique script once, in a file named by the SHA256 of its
+    content, so that identical scripts of all items and runs reuse the same
+    executable file.
+
+    Scripts are written to a temporary file and atomically renamed, so that
+    concurrent threads and processes never see a partially written script.
+    """
+
+    def __init__(
+        self,
+        directory: str = SCRIPTS_CACHE_DIRECTORY,
+        max_age_days: float = SCRIPTS_CACHE_MAX_AGE_DAYS,
+        max_size_mb: float = SCRIPTS_CACHE_MAX_SIZE_MB,
+    ) -> None:
+        """Init."""
+        self.directory = directory
+        self.max_age_days = max_age_days
+        self.max_size_mb = max_size_mb
+
+        # Scripts already materialized by this process, script hash to path
+        self._paths: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _write_script(self, script_path: str, script: str) -> None:
+        """Atomically writes script to given path."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=TMP_FILE_PREFIX)
+
+        try:
+            # Gives RWX permission for the owner
+            os.chmod(tmp_path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
+
+            with os.fdopen(fd, "w") as tmp_file:
+                tmp_file.write(script)
+
+            os.replace(tmp_path, script_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def get_script_path(self, script: str) -> str:
+        """Returns path of the executable file containing given script."""
+        script_hash = sha256_hash(script)
+
+        script_path = self._paths.get(script_hash)
+        if script_path is not None:
+            return script_path
+
+        with self._lock:
+            script_path = os.path.join(self.directory, script_hash)
+
+            if os.path.isfile(script_path):
+                # Marks script as recently used, used by eviction
+                os.utime(script_path)
+            else:
+                self._write_script(script_path, script)
+
+            self._paths[script_hash] = script_path
+
+        return script_path
+
+    def forget(self, script: str) -> None:
+        """Forgets that the script was materialized by this process, for example
+        when it was evicted by another process."""
+        self._paths.pop(sha256_hash(script), None)
+
+    def evict(self) -> None:
+        """Removes scripts not used for max_age_days, then least recently used
+        scripts until the cache is smaller than max_size_mb."""
+        now = time.time()
+        max_size = self.max_size_mb * 1024 * 1024
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                entry_stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+
+            if stat.S_ISREG(entry_stat.st_mode):
+                entries.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+
+        # Least recently used first
+        entries.sort()
+        total_size = sum(size for _, size, _ in entries)
+
+        for mtime, size, path in entries:
+            age = now - mtime
+
+            if age < EVICTION_GRACE_PERIOD:
+                break
+
+            is_expired = self.max_age_days and age > self.max_age_days * 24 * 60 * 60
+            is_over_size = self.max_size_mb and total_size > max_size
+
+            if not is_expired and not is_over_size:
+                continue
+
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+            total_size -= size
+
+
+# Script cache shared by all the pipelines of the process
+script_cache = ScriptCache()
@@ -1,61 +1,118 @@
 """Snapshot class for pipeline."""
-from datetime import datetime
+from typing import Any, Dict, Set
 
-from pypelines.utils import get_snapshots_collection
+from pypelines.bloom_filter import BloomFilter
+from pypelines.snapshot_store import SnapshotStore
+from pypelines.snapshot_writer import SnapshotWriter
+
+# False positive rate of the completed tasks bloom filter
+COMPLETED_TASKS_FILTER_ERROR_RATE = 0.01
 
 
 class Snapshot:
     """Snapshot class for pipeline."""
 
-    def __init__(self, pipeline_id: str, pipeline_name: str):
+    def __init__(
+        self,
+        pipeline_id: str,
+        pipeline_name: str,
+        snapshot_store: SnapshotStore,
+        write_mode: str,
+        flush_size: int,
+        flush_interval: float,
+        preload_limit: int,
+    ):
         """Initialize snapshot."""
         self.pipeline_id = pipeline_id
         self.pipeline_name = pipeline_name
 
+        # Store is shared by all the snapshots of the pipeline
+        self.snapshot_store = snapshot_store
+
+        # Buffers task completions of all the threads
+        self.writer = SnapshotWriter(
+            snapshot_store, pipeline_id, write_mode, flush_size, flush_interval
+        )
+
+        # Local view of completed tasks, loaded by load_completed_tasks().
+        # Either a set holding all completed task hashes, or a bloom filter when
+        # the pipeline has more than preload_limit completed tasks.
+        self.preload_limit = preload_limit
+        self._completed_tasks: Set[str] = None
+        self._completed_tasks_filter: BloomFilter = None
+
     def is_pipeline_completed(self) -> bool:
         """Checks if pipeline is completed"""
-        snapshot_doc = get_snapshots_collection().find_one(dict(_id=self.pipeline_id))
-        if snapshot_doc is None:
-            return False
-
-        return snapshot_doc.get("is_completed")
+        return self.snapshot_store.is_pipeline_completed(self.pipeline_id)
 
     def set_pipeline_completed(self):
         """Sets pipeline as completed"""
-        get_snapshots_collection().update_one(
-            dict(_id=self.pipeline_id),
-            {"$set": dict(is_completed=True, completed_at=datetime.now())},
-        )
+        # Completed tasks must be stored before the pipeline is marked completed
+        self.writer.flush()
+        self.snapshot_store.set_pipeline_completed(self.pipeline_id)
 
     def create_if_not_exist(self):
         """Creates snapshot if it does not exist."""
-        client = get_snapshots_collection()
-
-        old_snapshot = client.count_documents(dict(_id=self.pipeline_id), limit=1)
-
-        if old_snapshot == 0:
-            get_snapshots_collection().insert_one(
-                dict(
-                    _id=self.pipeline_id,
-                    pipeline_name=self.pipeline_name,
-                    is_completed=False,
-                    created_at=datetime.now(),
-                )
+        self.snapshot_store.create_snapshot_if_not_exist(
+            self.pipeline_id, self.pipeline_name
+        )
+
+    def load_completed_tasks(self):
+        """Loads hashes of completed tasks from the store, so that completed
+        tasks can be checked without querying the store for each task."""
+        count = self.snapshot_store.count_completed_tasks(self.pipeline_id)
+
+        if count <= self.preload_limit:
+            completed_tasks = set(
+                self.snapshot_store.iter_completed_tasks(self.pipeline_id)
             )
+            self._completed_tasks = completed_tasks
+            return
+
+        # Leave room for the tasks completed by this run
+        completed_tasks_filter = BloomFilter(
+            capacity=2 * count, error_rate=COMPLETED_TASKS_FILTER_ERROR_RATE
+        )
+        for task_hash in self.snapshot_store.iter_completed_tasks(self.pipeline_id):
+            completed_tasks_filter.add(task_hash)
+
+        self._completed_tasks_filter = completed_tasks_filter
 
     def is_task_completed(self, task_hash: str) -> bool:
         """Checks if task is completed"""
-        return (
-            get_snapshots_collection().count_documents(
-                dict(_id=self.pipeline_id, completed_tasks={"$in": [task_hash]}),
-                limit=1,
-            )
-            != 0
-        )
+        if self._completed_tasks is not None:
+            return task_hash in self._completed_tasks
+
+        # Bloom filter has no false negatives, only tasks which may be completed
+        # are checked in the store
+        if (
+            self._completed_tasks_filter is not None
+            and task_hash not in self._completed_tasks_filter
+        ):
+            return False
+
+        if self.writer.is_pending(task_hash):
+            return True
+
+        return self.snapshot_store.is_task_completed(self.pipeline_id, task_hash)
 
     def set_task_completed(self, task_hash: str):
         """Sets task as completed"""
-        get_snapshots_collection().update_one(
-            dict(_id=self.pipeline_id),
-            {"$push": dict(completed_tasks=task_hash)},
-        )
+        if self._completed_tasks is not None:
+            self._completed_tasks.add(task_hash)
+        elif self._completed_tasks_filter is not None:
+            self._completed_tasks_filter.add(task_hash)
+
+        self.writer.add(task_hash)
+
+    def get_checkpoint(self, key: str) -> Dict[str, Any]:
+        """Returns checkpoint stored with given key."""
+        return self.snapshot_store.get_checkpoint(self.pipeline_id, key)
+
+    def set_checkpoint(self, key: str, value: Dict[str, Any]):
+        """Stores checkpoint with given key."""
+        self.snapshot_store.set_checkpoint(self.pipeline_id, key, value)
+
+    def close(self):
+        """Writes buffered task completions to the store."""
+        self.writer.close()
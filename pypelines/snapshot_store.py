@@ -0,0 +1,151 @@
+"""Abstract class for SnapshotStore"""
+import time
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+
+class SnapshotStore:
+    """Base class for snapshot store backends.
+
+    A single store is owned by the Pipeline and shared by all the snapshots,
+    tasks and threads of the pipeline, so implementations must be thread-safe.
+    The store must be closed when the pipeline ends.
+    """
+
+    # Backend name, used to select the store from pipeline config
+    store_type: str = "SnapshotStore"
+
+    def __init__(self) -> None:
+        """Init."""
+        # Per-operation latency counters
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._stats_lock = threading.Lock()
+
+    @contextmanager
+    def _timed(self, operation: str) -> Iterator[None]:
+        """Records latency of the operation executed inside the context."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+
+            with self._stats_lock:
+                stats = self._stats.setdefault(
+                    operation, dict(calls=0, total_seconds=0.0, max_seconds=0.0)
+                )
+                stats["calls"] += 1
+                stats["total_seconds"] += elapsed
+                stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """Returns number of calls and latency of each store operation."""
+        with self._stats_lock:
+            return {
+                operation: {
+                    **stats,
+                    "avg_seconds": stats["total_seconds"] / stats["calls"],
+                }
+                for operation, stats in self._stats.items()
+            }
+
+    def find_last_snapshot(self, pipeline_name: str) -> Dict[str, Any]:
+        """Returns last snapshot of the pipeline with given name.
+
+        Returned dict contains SnapshotCollectionFields.RECORD_ID and
+        SnapshotCollectionFields.IS_COMPLETED keys, None is returned if the
+        pipeline has no snapshot.
+        """
+        raise NotImplementedError("Snapshot store is not implemented")
+
+    def create_snapshot_if_not_exist(self, pipeline_id: str, pipeline_name: str):
+        """Creates snapshot if it does not exist."""
+        raise NotImplementedError("Snapshot store is not implemented")
+
+    def is_pipeline_completed(self, pipeline_id: str) -> bool:
+        """Checks if pipeline is completed"""
+        raise NotImplementedError("Snapshot store is not implemented")
+
+    def set_pipeline_completed(self, pipeline_id: str):
+        """Sets pipeline as completed"""
+        raise NotImplementedError("Snapshot store is not implemented")
+
+    def is_task_completed(self, pipeline_id: str, task_hash: str) -> bool:
+        """Checks if task is completed"""
+        raise NotImplementedError("Snapshot store is not implemented")
+
+    def set_tasks_completed(self, pipeline_id: str, task_hashes: List[str]):
+        """Sets all the given tasks as completed in a single batch."""
+        raise NotImplementedError("Snapshot store is not implemented")
+
+    def count_completed_tasks(self, pipeline_id: str) -> int:
+        """Returns number of completed tasks of the pipeline."""
+        raise NotImplementedError("Snapshot store is not implemented")
+
+    def iter_completed_tasks(self, pipeline_id: str) -> Iterator[str]:
+        """Yields hashes of all the completed tasks of the pipeline.
+
+        Hashes are streamed from the store, so they are never all held in
+        memory by the store.
+        """
+        raise NotImplementedError("Snapshot store is not implemented")
+
+    def set_task_completed(self, pipeline_id: str, task_hash: str):
+        """Sets task as completed"""
+        self.set_tasks_completed(pipeline_id, [task_hash])
+
+    def get_checkpoint(self, pipeline_id: str, key: str) -> Dict[str, Any]:
+        """Returns checkpoint of the pipeline stored with given key, None is
+        returned if checkpoint does not exist."""
+        raise NotImplementedError("Snapshot store is not implemented")
+
+    def set_checkpoint(self, pipeline_id: str, key: str, value: Dict[str, Any]):
+        """Creates or replaces checkpoint of the pipeline with given key.
+
+        Value must be JSON serializable.
+        """
+        raise NotImplementedError("Snapshot store is not implemented")
+
+    def iter_file_index(
+        self, pipeline_name: str, index_key: str
+    ) -> Iterator[Tuple[str, int, int, str]]:
+        """Yields (path, size, mtime_ns, content_hash) of the files stored in the
+        file index of the pipeline with given key.
+
+        File indexes are stored per pipeline name, not per run, so they are kept
+        when old snapshots are deleted.
+        """
+        raise NotImplementedError("Snapshot store is not implemented")
+
+    def set_file_index_entries(
+        self,
+        pipeline_name: str,
+        index_key: str,
+        entries: List[Tuple[str, int, int, str]],
+    ):
+        """Creates or replaces (path, size, mtime_ns, content_hash) entries of the
+        file index in a single batch."""
+        raise NotImplementedError("Snapshot store is not implemented")
+
+    def delete_file_index_entries(
+        self, pipeline_name: str, index_key: str, paths: List[str]
+    ):
+        """Deletes entries of the given paths from the file index."""
+        raise NotImplementedError("Snapshot store is not implemented")
+
+    def delete_snapshots(
+        self, pipeline_name: str, created_before: datetime, keep_pipeline_id: str
+    ) -> int:
+        """Deletes snapshots, completed tasks and checkpoints of old runs of the
+        pipeline.
+
+        Snapshot of keep_pipeline_id is never deleted. Returns number of deleted
+        snapshots.
+        """
+        raise NotImplementedError("Snapshot store is not implemented")
+
+    def close(self) -> None:
+        """Releases connections held by the store."""
+        pass
@@ -0,0 +1,41 @@
+"""Contains snapshot store backends."""
+from typing import Dict, Type
+
+from pypelines.snapshot_store import SnapshotStore
+from pypelines.snapshot_stores.store_sqlite import SQLiteSnapshotStore
+from pypelines.snapshot_stores.store_memory import MemorySnapshotStore
+from pypelines.snapshot_stores.store_mongodb import MongoDBSnapshotStore
+
+# Contains all registered snapshot stores
+snapshot_stores: Dict[str, Type[SnapshotStore]] = {}
+
+
+def _add_snapshot_store(snapshot_store: Type[SnapshotStore]):
+    """Add a snapshot store to the registry. Store types must be unique."""
+    if snapshot_store.store_type in snapshot_stores:
+        raise ValueError(
+            f"Snapshot store {snapshot_store.store_type} already exists."
+        )
+
+    snapshot_stores[snapshot_store.store_type] = snapshot_store
+
+
+# Add snapshot stores in the snapshot_stores dictionary
+for snapshot_store in [
+    MongoDBSnapshotStore,
+    SQLiteSnapshotStore,
+    MemorySnapshotStore,
+]:
+    _add_snapshot_store(snapshot_store)
+
+
+def get_snapshot_store(store_type: str) -> SnapshotStore:
+    """Creates snapshot store of given type."""
+    if store_type not in snapshot_stores:
+        raise ValueError(
+            "Snapshot backend '{}' was not found, supported backends are {}.".format(
+                store_type, list(snapshot_stores)
+            )
+        )
+
+    return snapshot_stores[store_type]()
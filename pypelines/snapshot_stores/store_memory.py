@@ -0,0 +1,199 @@
+"""Snapshot store keeping snapshots in memory of the process."""
+import copy
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Set, Tuple
+
+from pypelines.snapshot_store import SnapshotStore
+from pypelines.constants import SnapshotCollectionFields
+
+
+class _MemoryDatabase:
+    """Snapshots shared by all the memory stores of the process."""
+
+    def __init__(self) -> None:
+        """Init."""
+        # Pipeline id to snapshot dict, in creation order
+        self.snapshots: Dict[str, Dict[str, Any]] = {}
+        self.completed_tasks: Dict[str, Set[str]] = {}
+        self.checkpoints: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        # (pipeline name, index key) to path to (size, mtime_ns, content_hash)
+        self.file_indexes: Dict[Tuple[str, str], Dict[str, Tuple]] = {}
+        self.lock = threading.Lock()
+
+
+class MemorySnapshotStore(SnapshotStore):
+    """Snapshot store keeping snapshots in memory of the process.
+
+    Snapshots are shared by all the pipelines of the process, so a pipeline
+    loaded again in the same process continues from its last run, and they are
+    lost when the process exits. Intended for benchmarks and for pipelines
+    which are never resumed, no database is required.
+    """
+
+    store_type: str = "memory"
+
+    _database = _MemoryDatabase()
+
+    @classmethod
+    def reset(cls) -> None:
+        """Forgets all the snapshots of the process."""
+        cls._database = _MemoryDatabase()
+
+    def find_last_snapshot(self, pipeline_name: str) -> Dict[str, Any]:
+        """Returns last snapshot of the pipeline with given name."""
+        database = self._database
+
+        with self._timed("find_last_snapshot"), database.lock:
+            for snapshot in reversed(list(database.snapshots.values())):
+                if snapshot[SnapshotCollectionFields.PIPELINE_NAME] == pipeline_name:
+                    return dict(snapshot)
+
+        return None
+
+    def create_snapshot_if_not_exist(self, pipeline_id: str, pipeline_name: str):
+        """Creates snapshot if it does not exist."""
+        database = self._database
+
+        with self._timed("create_snapshot_if_not_exist"), database.lock:
+            if pipeline_id not in database.snapshots:
+                database.snapshots[pipeline_id] = {
+                    SnapshotCollectionFields.RECORD_ID: pipeline_id,
+                    SnapshotCollectionFields.PIPELINE_NAME: pipeline_name,
+                    SnapshotCollectionFields.IS_COMPLETED: False,
+                    SnapshotCollectionFields.CREATED_AT: datetime.now(),
+                }
+                database.completed_tasks[pipeline_id] = set()
+
+    def is_pipeline_completed(self, pipeline_id: str) -> bool:
+        """Checks if pipeline is completed"""
+        with self._timed("is_pipeline_completed"):
+            snapshot = self._database.snapshots.get(pipeline_id)
+
+        return snapshot is not None and snapshot[SnapshotCollectionFields.IS_COMPLETED]
+
+    def set_pipeline_completed(self, pipeline_id: str):
+        """Sets pipeline as completed"""
+        database = self._database
+
+        with self._timed("set_pipeline_completed"), database.lock:
+            snapshot = database.snapshots.get(pipeline_id)
+            if snapshot is not None:
+                snapshot[SnapshotCollectionFields.IS_COMPLETED] = True
+
+    def is_task_completed(self, pipeline_id: str, task_hash: str) -> bool:
+        """Checks if task is completed"""
+        with self._timed("is_task_completed"):
+            return task_hash in self._database.completed_tasks.get(pipeline_id, ())
+
+    def set_tasks_completed(self, pipeline_id: str, task_hashes: List[str]):
+        """Sets all the given tasks as completed at once."""
+        if not task_hashes:
+            return
+
+        database = self._database
+
+        with self._timed("set_tasks_completed"), database.lock:
+            database.completed_tasks.setdefault(pipeline_id, set()).update(
+                task_hashes
+            )
+
+    def count_completed_tasks(self, pipeline_id: str) -> int:
+        """Returns number of completed tasks of the pipeline."""
+        with self._timed("count_completed_tasks"):
+            return len(self._database.completed_tasks.get(pipeline_id, ()))
+
+    def iter_completed_tasks(self, pipeline_id: str) -> Iterator[str]:
+        """Yields hashes of all the completed tasks of the pipeline."""
+        database = self._database
+
+        with self._timed("iter_completed_tasks"), database.lock:
+            task_hashes = list(database.completed_tasks.get(pipeline_id, ()))
+
+        yield from task_hashes
+
+    def get_checkpoint(self, pipeline_id: str, key: str) -> Dict[str, Any]:
+        """Returns checkpoint of the pipeline stored with given key."""
+        with self._timed("get_checkpoint"):
+            value = self._database.checkpoints.get((pipeline_id, key))
+
+        return copy.deepcopy(value)
+
+    def set_checkpoint(self, pipeline_id: str, key: str, value: Dict[str, Any]):
+        """Creates or replaces checkpoint of the pipeline with given key."""
+        database = self._database
+
+        with self._timed("set_checkpoint"), database.lock:
+            database.checkpoints[(pipeline_id, key)] = copy.deepcopy(value)
+
+    def iter_file_index(
+        self, pipeline_name: str, index_key: str
+    ) -> Iterator[Tuple[str, int, int, str]]:
+        """Yields (path, size, mtime_ns, content_hash) of the indexed files."""
+        database = self._database
+
+        with self._timed("iter_file_index"), database.lock:
+            entries = list(
+                database.file_indexes.get((pipeline_name, index_key), {}).items()
+            )
+
+        for path, entry in entries:
+            yield (path, *entry)
+
+    def set_file_index_entries(
+        self,
+        pipeline_name: str,
+        index_key: str,
+        entries: List[Tuple[str, int, int, str]],
+    ):
+        """Creates or replaces entries of the file index at once."""
+        if not entries:
+            return
+
+        database = self._database
+
+        with self._timed("set_file_index_entries"), database.lock:
+            file_index = database.file_indexes.setdefault(
+                (pipeline_name, index_key), {}
+            )
+            for path, size, mtime_ns, content_hash in entries:
+                file_index[path] = (size, mtime_ns, content_hash)
+
+    def delete_file_index_entries(
+        self, pipeline_name: str, index_key: str, paths: List[str]
+    ):
+        """Deletes entries of the given paths at once."""
+        if not paths:
+            return
+
+        database = self._database
+
+        with self._timed("delete_file_index_entries"), database.lock:
+            file_index = database.file_indexes.get((pipeline_name, index_key), {})
+            for path in paths:
+                file_index.pop(path, None)
+
+    def delete_snapshots(
+        self, pipeline_name: str, created_before: datetime, keep_pipeline_id: str
+    ) -> int:
+        """Deletes snapshots, completed tasks and checkpoints of old runs of the
+        pipeline."""
+        database = self._database
+
+        with self._timed("delete_snapshots"), database.lock:
+            pipeline_ids = [
+                pipeline_id
+                for pipeline_id, snapshot in database.snapshots.items()
+                if snapshot[SnapshotCollectionFields.PIPELINE_NAME] == pipeline_name
+                and snapshot[SnapshotCollectionFields.CREATED_AT] < created_before
+                and pipeline_id != keep_pipeline_id
+            ]
+
+            for pipeline_id in pipeline_ids:
+                del database.snapshots[pipeline_id]
+                database.completed_tasks.pop(pipeline_id, None)
+
+            for key in [key for key in database.checkpoints if key[0] in pipeline_ids]:
+                del database.checkpoints[key]
+
+        return len(pipeline_ids)
@@ -0,0 +1,559 @@
+"""Snapshot store backed by MongoDB."""
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Tuple
+
+try:
+    from pymongo import MongoClient, ReplaceOne, ASCENDING, DESCENDING
+    from pymongo.errors import BulkWriteError
+    from pymongo.collection import Collection
+except ImportError:
+    MongoClient = None
+
+from pypelines.config import (
+    DB_NAME,
+    DB_MAX_POOL_SIZE,
+    DB_SOCKET_TIMEOUT_MS,
+    DB_SNAPSHOT_TTL_DAYS,
+    DB_CONNECTION_STRING,
+    DB_CONNECT_TIMEOUT_MS,
+    DB_SNAPSHOT_COLLECTION_NAME,
+    DB_FILE_INDEX_COLLECTION_NAME,
+    DB_SERVER_SELECTION_TIMEOUT_MS,
+    DB_SNAPSHOT_TASKS_COLLECTION_NAME,
+    DB_SNAPSHOT_CHECKPOINTS_COLLECTION_NAME,
+)
+from pypelines.snapshot_store import SnapshotStore
+from pypelines.constants import SnapshotCollectionFields
+
+# MongoDB error code for duplicate key error
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+# Number of completed task records fetched per round trip when streaming
+ITER_BATCH_SIZE = 10000
+
+# Version of the snapshot documents. Version 1 documents stored completed tasks
+# in an array and their times as naive local times
+SCHEMA_VERSION = 2
+# Id of the document of the snapshots collection storing the version of the
+# collections, it has no pipeline name so it is never found as a snapshot
+SCHEMA_VERSION_RECORD_ID = "pypelines-schema-version"
+
+
+def _utc_now() -> datetime:
+    """Returns current time in UTC, TTL indexes expire documents by UTC time."""
+    return datetime.now(timezone.utc)
+
+
+def _local_to_utc(value: datetime) -> datetime:
+    """Returns UTC time of a naive local time stored by version 1, which
+    pymongo read back as a naive UTC time."""
+    if value is None:
+        return None
+
+    return value.replace(tzinfo=None).astimezone(timezone.utc)
+
+
+class MongoDBSnapshotStore(SnapshotStore):
+    """Snapshot store backed by MongoDB.
+
+    A single MongoClient, and therefore a single connection pool, is shared by
+    all the threads of the pipeline.
+
+    Pipeline runs are stored in the snapshots collection and every completed
+    task is stored as a separate record of the tasks collection, keyed by
+    (pipeline_id, task_hash).
+    """
+
+    store_type: str = "mongodb"
+
+    def __init__(
+        self,
+        connection_string: str = DB_CONNECTION_STRING,
+        db_name: str = DB_NAME,
+        collection_name: str = DB_SNAPSHOT_COLLECTION_NAME,
+        tasks_collection_name: str = DB_SNAPSHOT_TASKS_COLLECTION_NAME,
+        checkpoints_collection_name: str = DB_SNAPSHOT_CHECKPOINTS_COLLECTION_NAME,
+        file_index_collection_name: str = DB_FILE_INDEX_COLLECTION_NAME,
+        ttl_days: float = DB_SNAPSHOT_TTL_DAYS,
+        max_pool_size: int = DB_MAX_POOL_SIZE,
+        connect_timeout_ms: int = DB_CONNECT_TIMEOUT_MS,
+        server_selection_timeout_ms: int = DB_SERVER_SELECTION_TIMEOUT_MS,
+        socket_timeout_ms: int = DB_SOCKET_TIMEOUT_MS,
+    ) -> None:
+        """Init."""
+        super().__init__()
+
+        if MongoClient is None:
+            raise ImportError(
+                "pymongo is required for the 'mongodb' snapshot backend, "
+                "install it or use the 'sqlite' snapshot backend"
+            )
+
+        # MongoClient connects lazily, so no connection is opened until the
+        # first operation
+        self._client = MongoClient(
+            connection_string,
+            maxPoolSize=max_pool_size,
+            connectTimeoutMS=connect_timeout_ms,
+            serverSelectionTimeoutMS=server_selection_timeout_ms,
+            socketTimeoutMS=socket_timeout_ms or None,
+        )
+        self._collection: Collection = self._client[db_name][collection_name]
+        self._tasks_collection: Collection = self._client[db_name][
+            tasks_collection_name
+        ]
+        self._checkpoints_collection: Collection = self._client[db_name][
+            checkpoints_collection_name
+        ]
+        self._file_index_collection: Collection = self._client[db_name][
+            file_index_collection_name
+        ]
+
+        self.ttl_days = ttl_days
+
+        self._indexes_created = False
+        self._schema_migrated = False
+        self._indexes_lock = threading.Lock()
+
+    def _create_indexes(self) -> None:
+        """Creates indexes of snapshot collections, only once per store."""
+        with self._indexes_lock:
+            if self._indexes_created:
+                return
+
+            self._collection.create_index(
+                [
+                    (SnapshotCollectionFields.PIPELINE_NAME, ASCENDING),
+                    (SnapshotCollectionFields.CREATED_AT, DESCENDING),
+                ]
+            )
+
+            self._tasks_collection.create_index(
+                [
+                    (SnapshotCollectionFields.PIPELINE_ID, ASCENDING),
+                    (SnapshotCollectionFields.TASK_HASH, ASCENDING),
+                ],
+                unique=True,
+            )
+
+            self._checkpoints_collection.create_index(
+                [
+                    (SnapshotCollectionFields.PIPELINE_ID, ASCENDING),
+                    (SnapshotCollectionFields.CHECKPOINT_KEY, ASCENDING),
+                ],
+                unique=True,
+            )
+
+            # File indexes are kept across runs, they never expire
+            self._file_index_collection.create_index(
+                [
+                    (SnapshotCollectionFields.PIPELINE_NAME, ASCENDING),
+                    (SnapshotCollectionFields.INDEX_KEY, ASCENDING),
+                    (SnapshotCollectionFields.PATH, ASCENDING),
+                ],
+                unique=True,
+            )
+
+            if self.ttl_days:
+                expire_after_seconds = int(self.ttl_days * 24 * 60 * 60)
+
+                for collection in [
+                    self._collection,
+                    self._tasks_collection,
+                    self._checkpoints_collection,
+                ]:
+                    self._create_ttl_index(collection, expire_after_seconds)
+
+            self._indexes_created = True
+
+    def _create_ttl_index(
+        self, collection: Collection, expire_after_seconds: int
+    ) -> None:
+        """Creates TTL index on the creation time of the documents.
+
+        If the index was created with another TTL, the TTL of the index is
+        changed, as creating it again with another TTL fails.
+        """
+        key = [(SnapshotCollectionFields.CREATED_AT, ASCENDING)]
+
+        for index in collection.index_information().values():
+            if index["key"] != key:
+                continue
+
+            if index.get("expireAfterSeconds") != expire_after_seconds:
+                collection.database.command(
+                    {
+                        "collMod": collection.name,
+                        "index": {
+                            "keyPattern": dict(key),
+                            "expireAfterSeconds": expire_after_seconds,
+                        },
+                    }
+                )
+            return
+
+        collection.create_index(key, expireAfterSeconds=expire_after_seconds)
+
+    def _insert_completed_tasks(
+        self, pipeline_id: str, task_hashes: List[str], created_at: datetime = None
+    ):
+        """Inserts completed task records, already stored tasks are ignored."""
+        created_at = created_at or _utc_now()
+
+        try:
+            self._tasks_collection.insert_many(
+                [
+                    {
+                        SnapshotCollectionFields.PIPELINE_ID: pipeline_id,
+                        SnapshotCollectionFields.TASK_HASH: task_hash,
+                        SnapshotCollectionFields.CREATED_AT: created_at,
+                    }
+                    for task_hash in task_hashes
+                ],
+                ordered=False,
+            )
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+
+            if e.details.get("writeConcernErrors") or any(
+                error["code"] != DUPLICATE_KEY_ERROR_CODE for error in write_errors
+            ):
+                raise
+
+    def _migrate_schema(self) -> None:
+        """Migrates snapshot documents of version 1, only once per store.
+
+        Completed tasks stored in the array of the snapshot documents are moved
+        to the tasks collection, with the creation time of their snapshot, and
+        naive local times are converted to UTC, so that snapshots of both
+        versions are ordered by their creation time. The version is stored in
+        the database, so that documents are scanned once.
+        """
+        with self._indexes_lock:
+            if self._schema_migrated:
+                return
+
+            schema_doc = self._collection.find_one(
+                {SnapshotCollectionFields.RECORD_ID: SCHEMA_VERSION_RECORD_ID}
+            )
+            if (
+                schema_doc is None
+                or schema_doc[SnapshotCollectionFields.SCHEMA_VERSION] < SCHEMA_VERSION
+            ):
+                self._migrate_version_1_snapshots()
+
+                self._collection.update_one(
+                    {SnapshotCollectionFields.RECORD_ID: SCHEMA_VERSION_RECORD_ID},
+                    {"$set": {SnapshotCollectionFields.SCHEMA_VERSION: SCHEMA_VERSION}},
+                    upsert=True,
+                )
+
+            self._schema_migrated = True
+
+    def _migrate_version_1_snapshots(self) -> None:
+        """Migrates snapshot documents which have no schema version."""
+        cursor = self._collection.find(
+            {
+                SnapshotCollectionFields.RECORD_ID: {"$ne": SCHEMA_VERSION_RECORD_ID},
+                SnapshotCollectionFields.SCHEMA_VERSION: {"$exists": False},
+            },
+            projection={
+                SnapshotCollectionFields.COMPLETED_TASKS: True,
+                SnapshotCollectionFields.CREATED_AT: True,
+                SnapshotCollectionFields.COMPLETED_AT: True,
+            },
+        )
+
+        for snapshot_doc in cursor:
+            pipeline_id = snapshot_doc[SnapshotCollectionFields.RECORD_ID]
+            created_at = _local_to_utc(
+                snapshot_doc.get(SnapshotCollectionFields.CREATED_AT)
+            )
+
+            task_hashes = list(
+                set(snapshot_doc.get(SnapshotCollectionFields.COMPLETED_TASKS, []))
+            )
+            if task_hashes:
+                self._insert_completed_tasks(pipeline_id, task_hashes, created_at)
+
+            migrated_fields = {SnapshotCollectionFields.SCHEMA_VERSION: SCHEMA_VERSION}
+            for field, value in [
+                (SnapshotCollectionFields.CREATED_AT, created_at),
+                (
+                    SnapshotCollectionFields.COMPLETED_AT,
+                    _local_to_utc(
+                        snapshot_doc.get(SnapshotCollectionFields.COMPLETED_AT)
+                    ),
+                ),
+            ]:
+                if value is not None:
+                    migrated_fields[field] = value
+
+            self._collection.update_one(
+                {SnapshotCollectionFields.RECORD_ID: pipeline_id},
+                {
+                    "$set": migrated_fields,
+                    "$unset": {SnapshotCollectionFields.COMPLETED_TASKS: ""},
+                },
+            )
+
+    def find_last_snapshot(self, pipeline_name: str) -> Dict[str, Any]:
+        """Returns last snapshot of the pipeline with given name.
+
+        Snapshots created by an older version are migrated first.
+        """
+        with self._timed("find_last_snapshot"):
+            self._create_indexes()
+            self._migrate_schema()
+
+            return self._collection.find_one(
+                {SnapshotCollectionFields.PIPELINE_NAME: pipeline_name},
+                sort=[(SnapshotCollectionFields.CREATED_AT, DESCENDING)],
+                projection={SnapshotCollectionFields.COMPLETED_TASKS: False},
+            )
+
+    def create_snapshot_if_not_exist(self, pipeline_id: str, pipeline_name: str):
+        """Creates snapshot if it does not exist.
+
+        Snapshots created by an older version are migrated first.
+        """
+        with self._timed("create_snapshot_if_not_exist"):
+            self._create_indexes()
+            self._migrate_schema()
+
+            self._collection.update_one(
+                {SnapshotCollectionFields.RECORD_ID: pipeline_id},
+                {
+                    "$setOnInsert": {
+                        SnapshotCollectionFields.PIPELINE_NAME: pipeline_name,
+                        SnapshotCollectionFields.IS_COMPLETED: False,
+                        SnapshotCollectionFields.CREATED_AT: _utc_now(),
+                        SnapshotCollectionFields.SCHEMA_VERSION: SCHEMA_VERSION,
+                    }
+                },
+                upsert=True,
+            )
+
+    def is_pipeline_completed(self, pipeline_id: str) -> bool:
+        """Checks if pipeline is completed"""
+        with self._timed("is_pipeline_completed"):
+            snapshot_doc = self._collection.find_one(
+                {SnapshotCollectionFields.RECORD_ID: pipeline_id},
+                projection={SnapshotCollectionFields.IS_COMPLETED: True},
+            )
+
+        if snapshot_doc is None:
+            return False
+
+        return bool(snapshot_doc.get(SnapshotCollectionFields.IS_COMPLETED))
+
+    def set_pipeline_completed(self, pipeline_id: str):
+        """Sets pipeline as completed"""
+        with self._timed("set_pipeline_completed"):
+            self._collection.update_one(
+                {SnapshotCollectionFields.RECORD_ID: pipeline_id},
+                {
+                    "$set": {
+                        SnapshotCollectionFields.IS_COMPLETED: True,
+                        SnapshotCollectionFields.COMPLETED_AT: _utc_now(),
+                    }
+                },
+            )
+
+    def is_task_completed(self, pipeline_id: str, task_hash: str) -> bool:
+        """Checks if task is completed"""
+        with self._timed("is_task_completed"):
+            return (
+                self._tasks_collection.count_documents(
+                    {
+                        SnapshotCollectionFields.PIPELINE_ID: pipeline_id,
+                        SnapshotCollectionFields.TASK_HASH: task_hash,
+                    },
+                    limit=1,
+                )
+                != 0
+            )
+
+    def set_tasks_completed(self, pipeline_id: str, task_hashes: List[str]):
+        """Sets all the given tasks as completed in a single batch."""
+        if not task_hashes:
+            return
+
+        with self._timed("set_tasks_completed"):
+            self._insert_completed_tasks(pipeline_id, task_hashes)
+
+    def count_completed_tasks(self, pipeline_id: str) -> int:
+        """Returns number of completed tasks of the pipeline."""
+        with self._timed("count_completed_tasks"):
+            return self._tasks_collection.count_documents(
+                {SnapshotCollectionFields.PIPELINE_ID: pipeline_id}
+            )
+
+    def iter_completed_tasks(self, pipeline_id: str) -> Iterator[str]:
+        """Yields hashes of all the completed tasks of the pipeline."""
+        with self._timed("iter_completed_tasks"):
+            cursor = self._tasks_collection.find(
+                {SnapshotCollectionFields.PIPELINE_ID: pipeline_id},
+                projection={
+                    SnapshotCollectionFields.RECORD_ID: False,
+                    SnapshotCollectionFields.TASK_HASH: True,
+                },
+                batch_size=ITER_BATCH_SIZE,
+            )
+
+            for task_doc in cursor:
+                yield task_doc[SnapshotCollectionFields.TASK_HASH]
+
+    def get_checkpoint(self, pipeline_id: str, key: str) -> Dict[str, Any]:
+        """Returns checkpoint of the pipeline stored with given key."""
+        with self._timed("get_checkpoint"):
+            checkpoint_doc = self._checkpoints_collection.find_one(
+                {
+                    SnapshotCollectionFields.PIPELINE_ID: pipeline_id,
+                    SnapshotCollectionFields.CHECKPOINT_KEY: key,
+                }
+            )
+
+        if checkpoint_doc is None:
+            return None
+
+        return checkpoint_doc[SnapshotCollectionFields.CHECKPOINT_VALUE]
+
+    def set_checkpoint(self, pipeline_id: str, key: str, value: Dict[str, Any]):
+        """Creates or replaces checkpoint of the pipeline with given key."""
+        now = _utc_now()
+
+        with self._timed("set_checkpoint"):
+            self._checkpoints_collection.update_one(
+                {
+                    SnapshotCollectionFields.PIPELINE_ID: pipeline_id,
+                    SnapshotCollectionFields.CHECKPOINT_KEY: key,
+                },
+                {
+                    "$set": {
+                        SnapshotCollectionFields.CHECKPOINT_VALUE: value,
+                        SnapshotCollectionFields.UPDATED_AT: now,
+                    },
+                    "$setOnInsert": {SnapshotCollectionFields.CREATED_AT: now},
+                },
+                upsert=True,
+            )
+
+    def iter_file_index(
+        self, pipeline_name: str, index_key: str
+    ) -> Iterator[Tuple[str, int, int, str]]:
+        """Yields (path, size, mtime_ns, content_hash) of the indexed files."""
+        with self._timed("iter_file_index"):
+            self._create_indexes()
+
+            cursor = self._file_index_collection.find(
+                {
+                    SnapshotCollectionFields.PIPELINE_NAME: pipeline_name,
+                    SnapshotCollectionFields.INDEX_KEY: index_key,
+                },
+                projection={SnapshotCollectionFields.RECORD_ID: False},
+                batch_size=ITER_BATCH_SIZE,
+            )
+
+            for entry_doc in cursor:
+                yield (
+                    entry_doc[SnapshotCollectionFields.PATH],
+                    entry_doc[SnapshotCollectionFields.SIZE],
+                    entry_doc[SnapshotCollectionFields.MTIME_NS],
+                    entry_doc.get(SnapshotCollectionFields.CONTENT_HASH),
+                )
+
+    def set_file_index_entries(
+        self,
+        pipeline_name: str,
+        index_key: str,
+        entries: List[Tuple[str, int, int, str]],
+    ):
+        """Creates or replaces entries of the file index in a single bulk
+        write."""
+        if not entries:
+            return
+
+        now = _utc_now()
+
+        with self._timed("set_file_index_entries"):
+            self._file_index_collection.bulk_write(
+                [
+                    ReplaceOne(
+                        {
+                            SnapshotCollectionFields.PIPELINE_NAME: pipeline_name,
+                            SnapshotCollectionFields.INDEX_KEY: index_key,
+                            SnapshotCollectionFields.PATH: path,
+                        },
+                        {
+                            SnapshotCollectionFields.PIPELINE_NAME: pipeline_name,
+                            SnapshotCollectionFields.INDEX_KEY: index_key,
+                            SnapshotCollectionFields.PATH: path,
+                            SnapshotCollectionFields.SIZE: size,
+                            SnapshotCollectionFields.MTIME_NS: mtime_ns,
+                            SnapshotCollectionFields.CONTENT_HASH: content_hash,
+                            SnapshotCollectionFields.UPDATED_AT: now,
+                        },
+                        upsert=True,
+                    )
+                    for path, size, mtime_ns, content_hash in entries
+                ],
+                ordered=False,
+            )
+
+    def delete_file_index_entries(
+        self, pipeline_name: str, index_key: str, paths: List[str]
+    ):
+        """Deletes entries of the given paths from the file index."""
+        if not paths:
+            return
+
+        with self._timed("delete_file_index_entries"):
+            self._file_index_collection.delete_many(
+                {
+                    SnapshotCollectionFields.PIPELINE_NAME: pipeline_name,
+                    SnapshotCollectionFields.INDEX_KEY: index_key,
+                    SnapshotCollectionFields.PATH: {"$in": paths},
+                }
+            )
+
+    def delete_snapshots(
+        self, pipeline_name: str, created_before: datetime, keep_pipeline_id: str
+    ) -> int:
+        """Deletes snapshots, completed tasks and checkpoints of old runs of the
+        pipeline."""
+        # Naive times are local times
+        created_before = created_before.astimezone(timezone.utc)
+
+        with self._timed("delete_snapshots"):
+            pipeline_ids = [
+                snapshot_doc[SnapshotCollectionFields.RECORD_ID]
+                for snapshot_doc in self._collection.find(
+                    {
+                        SnapshotCollectionFields.PIPELINE_NAME: pipeline_name,
+                        SnapshotCollectionFields.CREATED_AT: {"$lt": created_before},
+                        SnapshotCollectionFields.RECORD_ID: {"$ne": keep_pipeline_id},
+                    },
+                    projection={SnapshotCollectionFields.RECORD_ID: True},
+                )
+            ]
+
+            if not pipeline_ids:
+                return 0
+
+            # Tasks and checkpoints are deleted first, so no orphan records are
+            # left if the cleanup is interrupted
+            for collection in [self._tasks_collection, self._checkpoints_collection]:
+                collection.delete_many(
+                    {SnapshotCollectionFields.PIPELINE_ID: {"$in": pipeline_ids}}
+                )
+            self._collection.delete_many(
+                {SnapshotCollectionFields.RECORD_ID: {"$in": pipeline_ids}}
+            )
+
+            return len(pipeline_ids)
+
+    def close(self) -> None:
+        """Closes all connections of the connection pool."""
+        self._client.close()
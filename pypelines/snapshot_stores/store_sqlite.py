@@ -0,0 +1,388 @@
+"""Snapshot store backed by an embedded SQLite database."""
+import json
+import sqlite3
+import weakref
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Set, Tuple
+
+from pypelines.config import SQLITE_SNAPSHOTS_PATH
+from pypelines.snapshot_store import SnapshotStore
+from pypelines.constants import SnapshotCollectionFields
+
+# Seconds to wait for the database lock held by another writer
+SQLITE_BUSY_TIMEOUT = 60
+
+# Number of completed task rows fetched at once when streaming
+ITER_BATCH_SIZE = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    pipeline_id TEXT PRIMARY KEY,
+    pipeline_name TEXT NOT NULL,
+    is_completed INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    completed_at TEXT
+);
+
+CREATE INDEX IF NOT EXISTS snapshots_pipeline_name_created_at
+    ON snapshots (pipeline_name, created_at);
+
+CREATE TABLE IF NOT EXISTS completed_tasks (
+    pipeline_id TEXT NOT NULL,
+    task_hash TEXT NOT NULL,
+    PRIMARY KEY (pipeline_id, task_hash)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS checkpoints (
+    pipeline_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (pipeline_id, key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS file_index (
+    pipeline_name TEXT NOT NULL,
+    index_key TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (pipeline_name, index_key, path)
+) WITHOUT ROWID;
+"""
+
+
+class _ThreadConnection:
+    """Connection of a thread, stored in the thread-local data so that it is
+    released when the thread exits."""
+
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        self.connection = connection
+
+
+class SQLiteSnapshotStore(SnapshotStore):
+    """Snapshot store backed by an embedded SQLite database.
+
+    Intended for pipelines running on a single machine, no database server is
+    required. The database runs in WAL mode so that readers never wait for
+    writers, and every thread uses its own connection, closed when the thread
+    exits.
+    """
+
+    store_type: str = "sqlite"
+
+    def __init__(self, database_path: str = SQLITE_SNAPSHOTS_PATH) -> None:
+        """Init."""
+        super().__init__()
+
+        self.database_path = database_path
+
+        self._local = threading.local()
+
+        # All opened connections, so that they can be closed from any thread
+        self._connections: Set[sqlite3.Connection] = set()
+        self._connections_lock = threading.Lock()
+
+        self._get_connection().executescript(SCHEMA)
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """Returns connection of the current thread."""
+        thread_connection = getattr(self._local, "connection", None)
+
+        if thread_connection is None:
+            # Autocommit mode, transactions are started explicitly with BEGIN
+            connection = sqlite3.connect(
+                self.database_path,
+                timeout=SQLITE_BUSY_TIMEOUT,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+
+            with self._connections_lock:
+                self._connections.add(connection)
+
+            # Threads of fan-outs are short-lived, their connections are closed
+            # when their thread-local data is released
+            thread_connection = _ThreadConnection(connection)
+            weakref.finalize(thread_connection, self._close_connection, connection)
+            self._local.connection = thread_connection
+
+        return thread_connection.connection
+
+    def _close_connection(self, connection: sqlite3.Connection) -> None:
+        """Closes connection of a thread which exited."""
+        with self._connections_lock:
+            self._connections.discard(connection)
+
+        connection.close()
+
+    def find_last_snapshot(self, pipeline_name: str) -> Dict[str, Any]:
+        """Returns last snapshot of the pipeline with given name."""
+        with self._timed("find_last_snapshot"):
+            row = (
+                self._get_connection()
+                .execute(
+                    "SELECT pipeline_id, is_completed FROM snapshots "
+                    "WHERE pipeline_name = ? ORDER BY created_at DESC LIMIT 1",
+                    (pipeline_name,),
+                )
+                .fetchone()
+            )
+
+        if row is None:
+            return None
+
+        return {
+            SnapshotCollectionFields.RECORD_ID: row[0],
+            SnapshotCollectionFields.PIPELINE_NAME: pipeline_name,
+            SnapshotCollectionFields.IS_COMPLETED: bool(row[1]),
+        }
+
+    def create_snapshot_if_not_exist(self, pipeline_id: str, pipeline_name: str):
+        """Creates snapshot if it does not exist."""
+        with self._timed("create_snapshot_if_not_exist"):
+            self._get_connection().execute(
+                "INSERT OR IGNORE INTO snapshots "
+                "(pipeline_id, pipeline_name, is_completed, created_at) "
+                "VALUES (?, ?, 0, ?)",
+                (pipeline_id, pipeline_name, datetime.now().isoformat()),
+            )
+
+    def is_pipeline_completed(self, pipeline_id: str) -> bool:
+        """Checks if pipeline is completed"""
+        with self._timed("is_pipeline_completed"):
+            row = (
+                self._get_connection()
+                .execute(
+                    "SELECT is_completed FROM snapshots WHERE pipeline_id = ?",
+                    (pipeline_id,),
+                )
+                .fetchone()
+            )
+
+        return row is not None and bool(row[0])
+
+    def set_pipeline_completed(self, pipeline_id: str):
+        """Sets pipeline as completed"""
+        with self._timed("set_pipeline_completed"):
+            self._get_connection().execute(
+                "UPDATE snapshots SET is_completed = 1, completed_at = ? "
+                "WHERE pipeline_id = ?",
+                (datetime.now().isoformat(), pipeline_id),
+            )
+
+    def is_task_completed(self, pipeline_id: str, task_hash: str) -> bool:
+        """Checks if task is completed"""
+        with self._timed("is_task_completed"):
+            row = (
+                self._get_connection()
+                .execute(
+                    "SELECT 1 FROM completed_tasks "
+                    "WHERE pipeline_id = ? AND task_hash = ?",
+                    (pipeline_id, task_hash),
+                )
+                .fetchone()
+            )
+
+        return row is not None
+
+    def set_tasks_completed(self, pipeline_id: str, task_hashes: List[str]):
+        """Sets all the given tasks as completed in a single transaction."""
+        if not task_hashes:
+            return
+
+        with self._timed("set_tasks_completed"):
+            connection = self._get_connection()
+
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(
+                    "INSERT OR IGNORE INTO completed_tasks (pipeline_id, task_hash) "
+                    "VALUES (?, ?)",
+                    [(pipeline_id, task_hash) for task_hash in task_hashes],
+                )
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+            connection.execute("COMMIT")
+
+    def count_completed_tasks(self, pipeline_id: str) -> int:
+        """Returns number of completed tasks of the pipeline."""
+        with self._timed("count_completed_tasks"):
+            return (
+                self._get_connection()
+                .execute(
+                    "SELECT COUNT(*) FROM completed_tasks WHERE pipeline_id = ?",
+                    (pipeline_id,),
+                )
+                .fetchone()[0]
+            )
+
+    def iter_completed_tasks(self, pipeline_id: str) -> Iterator[str]:
+        """Yields hashes of all the completed tasks of the pipeline."""
+        with self._timed("iter_completed_tasks"):
+            cursor = self._get_connection().execute(
+                "SELECT task_hash FROM completed_tasks WHERE pipeline_id = ?",
+                (pipeline_id,),
+            )
+
+            while True:
+                rows = cursor.fetchmany(ITER_BATCH_SIZE)
+                if not rows:
+                    return
+
+                for row in rows:
+                    yield row[0]
+
+    def get_checkpoint(self, pipeline_id: str, key: str) -> Dict[str, Any]:
+        """Returns checkpoint of the pipeline stored with given key."""
+        with self._timed("get_checkpoint"):
+            row = (
+                self._get_connection()
+                .execute(
+                    "SELECT value FROM checkpoints WHERE pipeline_id = ? AND key = ?",
+                    (pipeline_id, key),
+                )
+                .fetchone()
+            )
+
+        if row is None:
+            return None
+
+        return json.loads(row[0])
+
+    def set_checkpoint(self, pipeline_id: str, key: str, value: Dict[str, Any]):
+        """Creates or replaces checkpoint of the pipeline with given key."""
+        with self._timed("set_checkpoint"):
+            self._get_connection().execute(
+                "INSERT OR REPLACE INTO checkpoints "
+                "(pipeline_id, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                (pipeline_id, key, json.dumps(value), datetime.now().isoformat()),
+            )
+
+    def iter_file_index(
+        self, pipeline_name: str, index_key: str
+    ) -> Iterator[Tuple[str, int, int, str]]:
+        """Yields (path, size, mtime_ns, content_hash) of the indexed files."""
+        with self._timed("iter_file_index"):
+            cursor = self._get_connection().execute(
+                "SELECT path, size, mtime_ns, content_hash FROM file_index "
+                "WHERE pipeline_name = ? AND index_key = ?",
+                (pipeline_name, index_key),
+            )
+
+            while True:
+                rows = cursor.fetchmany(ITER_BATCH_SIZE)
+                if not rows:
+                    return
+
+                yield from rows
+
+    def set_file_index_entries(
+        self,
+        pipeline_name: str,
+        index_key: str,
+        entries: List[Tuple[str, int, int, str]],
+    ):
+        """Creates or replaces entries of the file index in a single
+        transaction."""
+        if not entries:
+            return
+
+        now = datetime.now().isoformat()
+
+        with self._timed("set_file_index_entries"):
+            connection = self._get_connection()
+
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO file_index (pipeline_name, index_key, "
+                    "path, size, mtime_ns, content_hash, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (pipeline_name, index_key, *entry, now)
+                        for entry in entries
+                    ],
+                )
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+            connection.execute("COMMIT")
+
+    def delete_file_index_entries(
+        self, pipeline_name: str, index_key: str, paths: List[str]
+    ):
+        """Deletes entries of the given paths in a single transaction."""
+        if not paths:
+            return
+
+        with self._timed("delete_file_index_entries"):
+            connection = self._get_connection()
+
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(
+                    "DELETE FROM file_index "
+                    "WHERE pipeline_name = ? AND index_key = ? AND path = ?",
+                    [(pipeline_name, index_key, path) for path in paths],
+                )
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+            connection.execute("COMMIT")
+
+    def delete_snapshots(
+        self, pipeline_name: str, created_before: datetime, keep_pipeline_id: str
+    ) -> int:
+        """Deletes snapshots, completed tasks and checkpoints of old runs of the
+        pipeline."""
+        with self._timed("delete_snapshots"):
+            connection = self._get_connection()
+
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                pipeline_ids = [
+                    (row[0],)
+                    for row in connection.execute(
+                        "SELECT pipeline_id FROM snapshots "
+                        "WHERE pipeline_name = ? AND created_at < ? "
+                        "AND pipeline_id != ?",
+                        (pipeline_name, created_before.isoformat(), keep_pipeline_id),
+                    )
+                ]
+
+                connection.executemany(
+                    "DELETE FROM completed_tasks WHERE pipeline_id = ?", pipeline_ids
+                )
+                connection.executemany(
+                    "DELETE FROM checkpoints WHERE pipeline_id = ?", pipeline_ids
+                )
+                connection.executemany(
+                    "DELETE FROM snapshots WHERE pipeline_id = ?", pipeline_ids
+                )
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+            connection.execute("COMMIT")
+
+            return len(pipeline_ids)
+
+    def close(self) -> None:
+        """Closes connections of all the threads."""
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+
+            self._connections = set()
+
+        self._local = threading.local()
@@ -0,0 +1,151 @@
+"""Write-behind buffer for task completion records."""
+import threading
+from typing import List, Set
+
+from pypelines.snapshot_store import SnapshotStore
+from pypelines.constants import SnapshotWriteModes
+
+
+class SnapshotWriter:
+    """Collects completed task hashes from all the threads and writes them to
+    the snapshot store.
+
+    Write modes -
+        sync: every completion is written before set_task_completed returns.
+        batched: completions are buffered and written in bulk when flush_size
+            completions are pending or every flush_interval seconds. The thread
+            which fills the buffer writes the batch, after a failed write only
+            the background thread retries it.
+        async: same as batched but batches are always written by a background
+            thread, so worker threads never wait for the database.
+    """
+
+    def __init__(
+        self,
+        snapshot_store: SnapshotStore,
+        pipeline_id: str,
+        write_mode: str,
+        flush_size: int,
+        flush_interval: float,
+    ) -> None:
+        """Init."""
+        if write_mode not in SnapshotWriteModes.ALL:
+            raise ValueError(
+                "Snapshot write mode must be one of {}, provided '{}'".format(
+                    SnapshotWriteModes.ALL, write_mode
+                )
+            )
+
+        self.snapshot_store = snapshot_store
+        self.pipeline_id = pipeline_id
+        self.write_mode = write_mode
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = flush_interval
+
+        # Hashes waiting to be written
+        self._pending: List[str] = []
+        # Hashes which are pending or being written, used for lookups
+        self._unwritten: Set[str] = set()
+
+        self._lock = threading.Lock()
+        # Only one batch is written at a time, so batches are written in order
+        self._flush_lock = threading.Lock()
+        self._flush_requested = threading.Condition(self._lock)
+
+        self._closed = False
+        self._flush_thread: threading.Thread = None
+        # Set while the last write of a batch failed
+        self._flush_failed = False
+
+        if self.write_mode != SnapshotWriteModes.SYNC:
+            self._flush_thread = threading.Thread(
+                target=self._flush_periodically,
+                name="pypelines-snapshot-writer",
+                daemon=True,
+            )
+            self._flush_thread.start()
+
+    def _flush_periodically(self) -> None:
+        """Flushes pending completions every flush_interval seconds, or as soon as
+        a batch is full in async mode."""
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+
+                if len(self._pending) < self.flush_size or self._flush_failed:
+                    self._flush_requested.wait(self.flush_interval)
+
+                if self._closed:
+                    return
+
+            try:
+                self.flush()
+            except Exception as e:
+                # Batch is kept in the buffer and written with the next flush
+                print(f"Failed to write snapshot, will retry. {e}")
+
+    def add(self, task_hash: str) -> None:
+        """Adds completed task hash."""
+        if self.write_mode == SnapshotWriteModes.SYNC or self._closed:
+            self.snapshot_store.set_task_completed(self.pipeline_id, task_hash)
+            return
+
+        with self._lock:
+            self._pending.append(task_hash)
+            self._unwritten.add(task_hash)
+            is_batch_full = len(self._pending) >= self.flush_size
+
+            if is_batch_full and self.write_mode == SnapshotWriteModes.ASYNC:
+                self._flush_requested.notify()
+
+        if (
+            is_batch_full
+            and self.write_mode == SnapshotWriteModes.BATCHED
+            and not self._flush_failed
+        ):
+            try:
+                self.flush()
+            except Exception as e:
+                # Task completed, batch is kept in the buffer and written by the
+                # background thread, or by close()
+                print(f"Failed to write snapshot, will retry. {e}")
+
+    def is_pending(self, task_hash: str) -> bool:
+        """Checks if task is completed but not yet written to the store."""
+        with self._lock:
+            return task_hash in self._unwritten
+
+    def flush(self) -> None:
+        """Writes all the pending completions to the store, raises error if the
+        write failed."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+
+            if not batch:
+                return
+
+            try:
+                self.snapshot_store.set_tasks_completed(self.pipeline_id, batch)
+            except BaseException:
+                # Put batch back in front of the buffer so it is not lost
+                with self._lock:
+                    self._pending = batch + self._pending
+                self._flush_failed = True
+                raise
+
+            with self._lock:
+                self._unwritten.difference_update(batch)
+            self._flush_failed = False
+
+    def close(self) -> None:
+        """Stops background flushes and writes all the pending completions."""
+        with self._lock:
+            self._closed = True
+            self._flush_requested.notify_all()
+
+        if self._flush_thread is not None:
+            self._flush_thread.join()
+
+        self.flush()
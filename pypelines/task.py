@@ -1,9 +1,13 @@
 """Abstract class for PipelineTask"""
 from dataclasses import dataclass
-from typing import Any, Callable, Dict, List
+from typing import Any, Awaitable, Callable, Dict, List, Mapping
 
-from pypelines import utils
+from pypelines import utils, task_hash
+from pypelines.plan import TaskPlan, compile_task_plan
+from pypelines.parameter_scope import ParameterScope
+from pypelines.cancellation import CancellationToken
 from pypelines.pipeline_options import PipelineOptions
+from pypelines.constants import InputFileFingerprints, TaskHashModes
 
 
 @dataclass
@@ -24,6 +28,9 @@ class TaskInputSchema:
     # if required is true and value is None then validation will fail
     # but if required is false it will allow None value
     required: bool = True
+    # If true, input is a list of tasks which is compiled with the pipeline,
+    # parameters of these tasks are replaced when the tasks run
+    sub_tasks: bool = False
 
 
 class PipelineTask:
@@ -45,23 +52,38 @@ class PipelineTask:
         # input values required for given tasks
         task_input_values: Dict[str, Any],
         # Pipeline Parameters
-        pipeline_parameters: Dict[str, Any],
+        pipeline_parameters: Mapping[str, Any],
         # PipelineOptions
         pipeline_options: PipelineOptions,
         # In _extra_parameters, extra/output parameters are stored
         # For example, some output parameters from previous parant task can be
         # passed via _extra_parameters
-        _extra_parameters: Dict[str, Any],
+        _extra_parameters: Mapping[str, Any],
     ) -> None:
         self.name = name
         self.pipeline_options: PipelineOptions = pipeline_options
         self.task_input_values: Dict[str, Any] = task_input_values
-        self._pipeline_parameters: Dict[str, Any] = pipeline_parameters
-        self._extra_parameters: Dict[str, Any] = _extra_parameters
+        self._pipeline_parameters: Mapping[str, Any] = pipeline_parameters
+        self._extra_parameters: Mapping[str, Any] = _extra_parameters
 
         # Parameters, any parameter with same name in the _pipeline_parameters
-        # will be orverriden by _extra_parameters
-        self.parameters = {**self._pipeline_parameters, **self._extra_parameters}
+        # will be orverriden by _extra_parameters. Parameters are not copied
+        self.parameters: Mapping[str, Any] = (
+            ParameterScope(self._extra_parameters, parent=self._pipeline_parameters)
+            if self._extra_parameters
+            else self._pipeline_parameters
+        )
+
+        # Compiled plan of the task, set by run_task. Static inputs of the plan
+        # are already parsed
+        self.task_plan: TaskPlan = None
+
+        # Set by run_task for tasks of fan-outs, cancelled when the fan-out is
+        # cancelled
+        self.cancellation_token: CancellationToken = None
+
+        # Computed once, before the task runs
+        self._task_hash: str = None
 
     def get_task_hash(self) -> str:
         """Return task hash.
@@ -69,54 +91,86 @@ class PipelineTask:
         Task hash will be used when use-snapshots is true. Tash hash will be
         stored in the database to avoid re-running the task.
 
-        Override this method to provide custom task hash, for example, if you
-        want to use task inputs as part of the task hash.
-        """
-        return utils.sha256_hash(self.name)
+        When task-hash-mode of the pipeline is "inputs", the hash also depends
+        on the parsed inputs, input-files and extra parameters of the task.
 
-    def get_parsed_inputs(self) -> Dict[str, Any]:
-        """Return parsed task input values."""
-        unique_input_keys = set([x.name for x in self.task_input_schema])
-
-        # If invalid key is provided, then raise error
-        for key in self.task_input_values:
-            if key not in unique_input_keys:
-                raise ValueError(
-                    f"{key} is not a valid input for task {self.task_type}"
-                )
-
-        # Store input values in a dictionary
-        parsed_input_values: Dict[str, Any] = {}
+        Override this method to provide custom task hash.
+        """
+        if self._task_hash is None:
+            if self.pipeline_options.task_hash_mode == TaskHashModes.INPUTS:
+                self._task_hash = self._get_inputs_hash()
+            else:
+                self._task_hash = utils.sha256_hash(self.name)
 
-        # Set default values for each input
-        for task_input in self.task_input_schema:
-            parsed_input_values[task_input.name] = task_input.default_value
+        return self._task_hash
 
-        for task_input in self.task_input_schema:
-            val = self.task_input_values.get(task_input.name)
+    def is_skipped_when_completed(self) -> bool:
+        """Returns true if the task is skipped when its hash is completed in the
+        snapshot.
 
-            if val is None:
-                continue
+        Override this method to run the task in every run, its hash is then
+        never saved.
+        """
+        return True
 
-            if task_input.allow_parameters:
-                val = utils.replace_parameters_from_anything(val, self.parameters)
+    def _get_inputs_hash(self) -> str:
+        """Returns hash of the task name, inputs, input file fingerprints and
+        extra parameters.
 
-            if task_input.value_type is not None:
-                try:
-                    val = task_input.value_type(val)
-                except:
-                    raise Exception(
-                        f"{task_input.name} is not of type {task_input.value_type}"
-                    )
+        Sub-tasks are hashed by their raw config, their parameters are replaced
+        only when they run. Extra parameters, such as values of fan-out items,
+        are hashed even when the inputs do not use them, scripts get them as
+        environment variables.
+        """
+        parsed_inputs = self.get_parsed_inputs()
+        inputs = {
+            task_input.name: (
+                self.task_input_values.get(task_input.name)
+                if task_input.sub_tasks
+                else parsed_inputs.get(task_input.name)
+            )
+            for task_input in self.task_input_schema
+        }
+
+        input_file_fingerprints = task_hash.get_input_file_fingerprints(
+            self.get_input_files(),
+            content=(
+                self.pipeline_options.input_file_fingerprint
+                == InputFileFingerprints.CONTENT
+            ),
+        )
+
+        extra_parameters = {
+            key: str(value)
+            for key, value in self._extra_parameters.items()
+            if not isinstance(value, task_hash.UnhashedValue)
+        }
+
+        return task_hash.get_inputs_hash(
+            self.task_type, self.name, inputs, input_file_fingerprints, extra_parameters
+        )
+
+    def get_input_files(self) -> List[str]:
+        """Returns paths or glob patterns of the files read by the task.
+
+        Override this method to add files which are inputs of the task.
+        """
+        if self.task_plan is None:
+            return []
 
-            parsed_input_values[task_input.name] = val
+        return self.task_plan.get_input_files(self.parameters)
 
-        # Validate inputs
-        for task_input in self.task_input_schema:
-            if task_input.required and parsed_input_values[task_input.name] is None:
-                raise ValueError(f"{task_input.name} is required but not provided")
+    def get_parsed_inputs(self) -> Dict[str, Any]:
+        """Return parsed task input values."""
+        if self.task_plan is None:
+            self.task_plan = compile_task_plan(
+                type(self), self.name, self.task_input_values
+            )
 
-        return parsed_input_values
+        with self.pipeline_options.tracer.span(
+            self.name, "parse-inputs", self.task_plan.name
+        ):
+            return self.task_plan.get_parsed_inputs(self.parameters)
 
     def validate_inputs(self) -> None:
         """Validate inputs.
@@ -136,3 +190,12 @@ class PipelineTask:
     def run(self) -> None:
         """Run the task."""
         raise NotImplementedError("Task is not implemented")
+
+    async def run_async(self, run_blocking: Callable[..., Awaitable]) -> None:
+        """Run the task from the asyncio event loop.
+
+        By default run() is called with run_blocking, in a thread of the fan-out
+        running the task. Override this method to run the task on the event
+        loop.
+        """
+        await run_blocking(self.run)
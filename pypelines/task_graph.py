@@ -0,0 +1,173 @@
+"""Dependency graph of pipeline tasks."""
+import concurrent.futures
+from collections import deque
+from typing import Callable, Dict, List, Sequence
+
+from pypelines.cancellation import CancellationToken
+
+
+class TaskGraph:
+    """Dependency graph of tasks, tasks are identified by their index.
+
+    Tasks whose dependencies are completed run concurrently, up to max_parallel
+    tasks at once. When a task fails, tasks depending on it are skipped, while
+    independent tasks continue. When the run is interrupted, running tasks are
+    cancelled and waited for.
+    """
+
+    def __init__(self, names: Sequence[str], depends_on: Sequence[Sequence[str]]):
+        """Init.
+
+        depends_on contains names of the dependencies of each task.
+        """
+        self.names = list(names)
+
+        # Task index by name, None if multiple tasks have the same name
+        indexes: Dict[str, int] = {}
+        for index, name in enumerate(self.names):
+            indexes[name] = None if name in indexes else index
+
+        # Indexes of the tasks depending on each task
+        self.dependents: List[List[int]] = [[] for _ in self.names]
+        self.dependency_counts: List[int] = [0 for _ in self.names]
+
+        for index, dependency_names in enumerate(depends_on):
+            for dependency_name in set(dependency_names):
+                if dependency_name not in indexes:
+                    raise ValueError(
+                        f"Task '{self.names[index]}' depends on '{dependency_name}'"
+                        " which does not exist"
+                    )
+
+                dependency_index = indexes[dependency_name]
+                if dependency_index is None:
+                    raise ValueError(
+                        f"Task '{self.names[index]}' depends on '{dependency_name}'"
+                        " but multiple tasks have this name"
+                    )
+
+                self.dependents[dependency_index].append(index)
+                self.dependency_counts[index] += 1
+
+        self._validate_acyclic()
+
+    def _validate_acyclic(self) -> None:
+        """Raises error if tasks have circular dependencies."""
+        counts = list(self.dependency_counts)
+        ready = deque(i for i, count in enumerate(counts) if count == 0)
+        visited = 0
+
+        while ready:
+            index = ready.popleft()
+            visited += 1
+
+            for dependent in self.dependents[index]:
+                counts[dependent] -= 1
+                if counts[dependent] == 0:
+                    ready.append(dependent)
+
+        if visited != len(self.names):
+            cycle = [self.names[i] for i, count in enumerate(counts) if count > 0]
+            raise ValueError(f"Tasks have circular dependencies: {cycle}")
+
+    def _get_all_dependents(self, index: int) -> List[int]:
+        """Returns indexes of tasks depending directly or indirectly on task."""
+        dependents = []
+        seen = set()
+        pending = list(self.dependents[index])
+
+        while pending:
+            dependent = pending.pop()
+            if dependent in seen:
+                continue
+
+            seen.add(dependent)
+            dependents.append(dependent)
+            pending.extend(self.dependents[dependent])
+
+        return dependents
+
+    def run(
+        self,
+        run_task: Callable[[int, CancellationToken], None],
+        max_parallel: int,
+    ) -> None:
+        """Runs run_task(index, cancellation_token) for each task once its
+        dependencies completed.
+
+        Raises the error of the failed task, or an error listing all the failed
+        tasks, after all the tasks which can run are finished.
+        """
+        counts = list(self.dependency_counts)
+        ready = deque(i for i, count in enumerate(counts) if count == 0)
+        running: Dict[concurrent.futures.Future, int] = {}
+        errors: Dict[int, BaseException] = {}
+        skipped = set()
+
+        # Parent of the tokens of all the tasks
+        cancellation_token = CancellationToken()
+
+        def run_graph_task(index: int) -> None:
+            task_cancellation_token = CancellationToken(parent=cancellation_token)
+            try:
+                run_task(index, task_cancellation_token)
+            finally:
+                task_cancellation_token.close()
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel)
+
+        try:
+            while ready or running:
+                while ready and len(running) < max_parallel:
+                    index = ready.popleft()
+                    running[executor.submit(run_graph_task, index)] = index
+
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+
+                for future in done:
+                    index = running.pop(future)
+                    error = future.exception()
+
+                    if error is not None:
+                        errors[index] = error
+                        print(f"Task '{self.names[index]}' failed. {error}")
+
+                        for dependent in self._get_all_dependents(index):
+                            if dependent in skipped:
+                                continue
+
+                            skipped.add(dependent)
+                            print(
+                                f"Skipping '{self.names[dependent]}', it depends on "
+                                f"failed task '{self.names[index]}'"
+                            )
+                        continue
+
+                    for dependent in self.dependents[index]:
+                        counts[dependent] -= 1
+                        if counts[dependent] == 0:
+                            ready.append(dependent)
+        except BaseException:
+            # Terminates scripts of the running tasks, and waits for the tasks
+            # so that they do not outlive the snapshot store. cancel_futures of
+            # shutdown() requires Python 3.9
+            cancellation_token.cancel()
+            for future in running:
+                future.cancel()
+            executor.shutdown(wait=True)
+            raise
+
+        executor.shutdown(wait=True)
+
+        if len(errors) == 1:
+            raise next(iter(errors.values()))
+
+        if errors:
+            raise Exception(
+                "{} tasks failed. {}".format(
+                    len(errors),
+                    {self.names[index]: error for index, error in errors.items()},
+                )
+            )
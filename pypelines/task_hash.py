@@ -0,0 +1,106 @@
+"""Task hashes depending on the inputs of the tasks."""
+import os
+import glob
+import json
+from hashlib import sha256
+from functools import lru_cache
+from typing import Any, Dict, List
+
+# Bytes of input files read at once when hashing their content
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class UnhashedValue(str):
+    """Parameter value which is not part of task hashes, such as the path of a
+    temporary file whose content is passed in another parameter."""
+
+
+@lru_cache(maxsize=65536)
+def get_file_content_hash(path: str, size: int, mtime_ns: int) -> str:
+    """Returns SHA256 of the file content.
+
+    Size and modification time are part of the cache key, so that files shared
+    by many tasks are read once, and modified files are read again.
+    """
+    file_hash = sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+
+def _get_file_fingerprint(path: str, content: bool) -> List[Any]:
+    """Returns path, size and modification time of the file, or path, size and
+    SHA256 of the file if content is true."""
+    stat = os.stat(path)
+
+    if content:
+        return [
+            path,
+            stat.st_size,
+            get_file_content_hash(path, stat.st_size, stat.st_mtime_ns),
+        ]
+
+    return [path, stat.st_size, stat.st_mtime_ns]
+
+
+def _get_files(pattern: str) -> List[str]:
+    """Returns sorted paths of the files matching the glob pattern, files of
+    matching directories are included recursively."""
+    paths = []
+
+    for path in glob.glob(os.path.expanduser(pattern), recursive=True):
+        if not os.path.isdir(path):
+            paths.append(path)
+            continue
+
+        for root, _, file_names in os.walk(path):
+            paths.extend(os.path.join(root, file_name) for file_name in file_names)
+
+    return sorted(paths)
+
+
+def get_input_file_fingerprints(patterns: List[str], content: bool) -> List[Any]:
+    """Returns fingerprints of the files matching the patterns.
+
+    Patterns matching no files are part of the fingerprints, so that the hash
+    changes when the files are created.
+    """
+    fingerprints = []
+
+    for pattern in patterns:
+        paths = _get_files(pattern)
+
+        if not paths:
+            fingerprints.append([pattern, None])
+
+        for path in paths:
+            fingerprints.append(_get_file_fingerprint(path, content))
+
+    return fingerprints
+
+
+def get_inputs_hash(
+    task_type: str,
+    name: str,
+    inputs: Dict[str, Any],
+    input_file_fingerprints: List[Any],
+    extra_parameters: Dict[str, str],
+) -> str:
+    """Returns SHA256 of the task name, inputs, input file fingerprints and
+    extra parameters."""
+    payload = json.dumps(
+        {
+            "task": task_type,
+            "name": name,
+            "inputs": inputs,
+            "input-files": input_file_fingerprints,
+            "extra-parameters": extra_parameters,
+        },
+        sort_keys=True,
+        default=str,
+    )
+
+    return sha256(payload.encode()).hexdigest()
@@ -0,0 +1,322 @@
+"""Output of scripts and progress messages of the pipeline."""
+import os
+import re
+import time
+import queue
+import threading
+from typing import Dict
+
+from pypelines.utils import sha256_hash
+from pypelines.constants import OutputModes
+
+# Name of the log file of the pipeline in the logs directory of the run
+PIPELINE_LOG_FILE_NAME = "pipeline.log"
+
+# Prefix of progress messages in the pipeline log
+PROGRESS_PREFIX = "[pypelines] "
+
+# Appended to task logs larger than the maximum size
+TRUNCATED_MESSAGE = "\n[pypelines] Log truncated, it exceeded {} bytes.\n"
+
+
+def _get_file_name(name: str) -> str:
+    """Returns file name for the task name, unique for each name."""
+    safe_name = re.sub(r"[^a-zA-Z0-9._-]+", "_", name).strip("_")[:80]
+    return f"{safe_name}-{sha256_hash(name)[:8]}.log"
+
+
+class TaskLog:
+    """Log of a single task run, written to by the thread running the task.
+
+    Records are queued and written to files by the writer thread of
+    TaskOutput, so that tasks wait for the disk only when the queue is full.
+    """
+
+    def __init__(self, task_output: "TaskOutput", path: str, prefix: str) -> None:
+        """Init, lines are prefixed with prefix if it is not None."""
+        self.task_output = task_output
+        self.path = path
+        self._prefix: bytes = None if prefix is None else prefix.encode()
+        # Last line of the written data, when it does not end with a newline
+        self._partial_line = b""
+
+    def write(self, data: bytes) -> None:
+        """Writes output of the task."""
+        if self._prefix is None:
+            self.task_output._put(self, data)
+            return
+
+        lines = (self._partial_line + data).split(b"\n")
+        self._partial_line = lines.pop()
+
+        if lines:
+            self.task_output._put(
+                self, b"".join(self._prefix + line + b"\n" for line in lines)
+            )
+
+    def close(self) -> None:
+        """Writes pending output and closes the log."""
+        if self._partial_line:
+            self.task_output._put(self, self._prefix + self._partial_line + b"\n")
+            self._partial_line = b""
+
+        self.task_output._put(self, None)
+
+
+class _LogFile:
+    """Log file opened by the writer thread."""
+
+    def __init__(self, path: str) -> None:
+        """Init."""
+        self.path = path
+        self.file = open(path, "ab")
+        self.size = self.file.tell()
+        self.is_truncated = False
+
+
+class TaskOutput:
+    """Output of scripts and progress messages of the pipeline.
+
+    In "terminal" mode scripts write to the terminal and all the progress
+    messages are printed.
+
+    In "task-files" mode output of each task is written to its own log file,
+    truncated at max_file_size bytes. In "pipeline-file" mode output of all the
+    tasks is written to the pipeline log, each line prefixed with the task
+    name, and the file is rotated at max_file_size bytes.
+
+    In both file modes progress messages are written to the pipeline log and
+    printed at most once per sample_interval seconds.
+
+    At most queue_size records are queued for the writer thread. When the queue
+    is full, writing output of a task waits for the writer, so output of
+    scripts is never lost, and progress messages are dropped from the pipeline
+    log.
+
+    Runs of tasks with the same name, in "task-files" mode, write to the same
+    file, which is closed when all of them are closed.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        directory: str,
+        max_file_size: int,
+        backup_count: int,
+        sample_interval: float,
+        queue_size: int = 0,
+    ) -> None:
+        """Init, queue_size of 0 means no limit."""
+        self.mode = mode
+        self.directory = directory
+        self.max_file_size = max_file_size
+        self.backup_count = backup_count
+        self.sample_interval = sample_interval
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._thread: threading.Thread = None
+        self._lock = threading.Lock()
+
+        # Path of the task file to number of open logs writing to it
+        self._open_logs: Dict[str, int] = {}
+
+        # Used by the writer thread only
+        self._files: Dict[str, _LogFile] = {}
+        self.truncated_logs = 0
+        self.dropped_messages = 0
+
+        # Sampling of progress messages
+        self._last_print_time = 0.0
+        self._suppressed_messages = 0
+        self._pipeline_log: TaskLog = None
+
+    @property
+    def is_captured(self) -> bool:
+        """Returns true if output of scripts is written to log files."""
+        return self.mode != OutputModes.TERMINAL
+
+    def _start(self) -> None:
+        """Starts the writer thread, if it is not running."""
+        if self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                os.makedirs(self.directory, exist_ok=True)
+
+                self._pipeline_log = TaskLog(
+                    self,
+                    os.path.join(self.directory, PIPELINE_LOG_FILE_NAME),
+                    prefix=None,
+                )
+
+                thread = threading.Thread(
+                    target=self._write_records, name="pypelines-log-writer", daemon=True
+                )
+                thread.start()
+                self._thread = thread
+
+    def open_log(self, task_name: str) -> TaskLog:
+        """Returns log for a run of the task."""
+        self._start()
+
+        if self.mode == OutputModes.PIPELINE_FILE:
+            return TaskLog(
+                self,
+                os.path.join(self.directory, PIPELINE_LOG_FILE_NAME),
+                prefix=f"[{task_name}] ",
+            )
+
+        path = os.path.join(self.directory, _get_file_name(task_name))
+        with self._lock:
+            self._open_logs[path] = self._open_logs.get(path, 0) + 1
+
+        return TaskLog(self, path, prefix=None)
+
+    def print_progress(self, message: str) -> None:
+        """Prints progress message, sampled when output is captured."""
+        if not self.is_captured:
+            print(message)
+            return
+
+        self._start()
+        is_queued = self._put(
+            self._pipeline_log,
+            (PROGRESS_PREFIX + message + "\n").encode(),
+            block=False,
+        )
+
+        with self._lock:
+            if not is_queued:
+                self.dropped_messages += 1
+
+            now = time.monotonic()
+            if now - self._last_print_time < self.sample_interval:
+                self._suppressed_messages += 1
+                return
+
+            suppressed = self._suppressed_messages
+            self._suppressed_messages = 0
+            self._last_print_time = now
+
+        if suppressed:
+            message = f"{message} ({suppressed} messages not shown)"
+        print(message)
+
+    def _put(self, task_log: TaskLog, data: bytes, block: bool = True) -> bool:
+        """Queues data for the writer thread, None closes the log.
+
+        Waits while the queue is full, unless block is false, then the data is
+        dropped and false is returned.
+        """
+        try:
+            self._queue.put((task_log, data), block=block)
+        except queue.Full:
+            return False
+
+        return True
+
+    def _release_file(self, path: str) -> bool:
+        """Returns true if the log closed by the writer thread was the last open
+        log of the task file."""
+        with self._lock:
+            self._open_logs[path] -= 1
+            if self._open_logs[path] > 0:
+                return False
+
+            del self._open_logs[path]
+            return True
+
+    def _open_file(self, path: str) -> _LogFile:
+        """Returns opened log file."""
+        log_file = self._files.get(path)
+        if log_file is None:
+            log_file = self._files[path] = _LogFile(path)
+
+        return log_file
+
+    def _rotate(self, log_file: _LogFile) -> _LogFile:
+        """Renames log file to path.1, path.1 to path.2 and so on, and opens a
+        new file."""
+        log_file.file.close()
+
+        for index in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{log_file.path}.{index}"):
+                os.replace(f"{log_file.path}.{index}", f"{log_file.path}.{index + 1}")
+
+        if self.backup_count > 0:
+            os.replace(log_file.path, f"{log_file.path}.1")
+        else:
+            os.unlink(log_file.path)
+
+        del self._files[log_file.path]
+        return self._open_file(log_file.path)
+
+    def _write(self, path: str, data: bytes, rotate: bool) -> None:
+        """Writes data to the log file, rotates or truncates it when it is
+        larger than max_file_size."""
+        log_file = self._open_file(path)
+
+        if self.max_file_size and log_file.size + len(data) > self.max_file_size:
+            if rotate:
+                if log_file.size > 0:
+                    log_file = self._rotate(log_file)
+            elif log_file.is_truncated:
+                return
+            else:
+                data = data[: max(self.max_file_size - log_file.size, 0)]
+                data += TRUNCATED_MESSAGE.format(self.max_file_size).encode()
+                log_file.is_truncated = True
+                self.truncated_logs += 1
+
+        log_file.file.write(data)
+        log_file.size += len(data)
+
+    def _write_records(self) -> None:
+        """Writes queued records until None is queued, runs in writer thread."""
+        while True:
+            record = self._queue.get()
+
+            if record is None:
+                break
+
+            task_log, data = record
+
+            try:
+                is_pipeline_log = task_log.path == self._pipeline_log.path
+
+                if data is not None:
+                    self._write(task_log.path, data, rotate=is_pipeline_log)
+                elif not is_pipeline_log and self._release_file(task_log.path):
+                    # Task files are closed, the pipeline log stays open
+                    log_file = self._files.pop(task_log.path, None)
+                    if log_file is not None:
+                        log_file.file.close()
+            except OSError as e:
+                print(f"Failed to write log {task_log.path}. {e}")
+
+            if self._queue.empty():
+                for log_file in self._files.values():
+                    log_file.file.flush()
+
+    def close(self) -> None:
+        """Writes queued records and closes the log files."""
+        if self._thread is None:
+            return
+
+        self._queue.put(None)
+        self._thread.join()
+
+        for log_file in self._files.values():
+            log_file.file.close()
+        self._files = {}
+
+        message = f"Task logs are written to {self.directory}"
+        if self.truncated_logs:
+            message += f", {self.truncated_logs} logs were truncated"
+        if self.dropped_messages:
+            message += (
+                f", {self.dropped_messages} progress messages were dropped as the "
+                "writer was too slow"
+            )
+        print(message)
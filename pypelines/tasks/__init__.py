@@ -1,8 +1,17 @@
 """Contains tasks and methods related to pipeline tasks."""
-from typing import Any, Dict
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Mapping, Tuple
 
-from pypelines import utils
 from pypelines.task import PipelineTask
+from pypelines.plan import TaskPlan, compile_task_plans
+from pypelines.tracing import Span
+from pypelines.cancellation import CancellationToken, TaskCancelledError
+from pypelines.metrics import (
+    TASKS_FAILED,
+    TASKS_SKIPPED,
+    TASKS_CANCELLED,
+    TASKS_COMPLETED,
+)
 from pypelines.tasks.task_script import ScriptTask
 from pypelines.tasks.task_for_each_file import ForEachFileTask
 from pypelines.tasks.task_for_each_line_of_file import ForEachLineOfFileTask
@@ -25,37 +34,154 @@ for task in [ScriptTask, ForEachFileTask, ForEachLineOfFileTask]:
     _add_task(task)
 
 
+def compile_tasks(task_configs: List[Dict[str, Any]]) -> Tuple[TaskPlan, ...]:
+    """Validates task configs of the pipeline and returns their plans."""
+    return compile_task_plans(task_configs, tasks, allow_depends_on=True)
+
+
+def _create_task(
+    task_plan: TaskPlan,
+    parameters: Mapping[str, Any],
+    pipeline_options: PipelineOptions,
+    extra_parameters: Mapping[str, Any],
+    cancellation_token: CancellationToken,
+) -> PipelineTask:
+    """Creates task of the plan."""
+    task: PipelineTask = task_plan.task_class(
+        name=task_plan.get_name(parameters),
+        task_input_values=task_plan.input_values,
+        pipeline_parameters=parameters,
+        pipeline_options=pipeline_options,
+        extra_parameters=extra_parameters,
+    )
+    task.task_plan = task_plan
+    task.cancellation_token = cancellation_token
+
+    return task
+
+
+def _is_task_completed(task: PipelineTask, pipeline_options: PipelineOptions) -> bool:
+    """Returns true if task was completed in the last run."""
+    if pipeline_options.snapshot.is_task_completed(task.get_task_hash()):
+        pipeline_options.task_output.print_progress(
+            f"{task.name} is already completed."
+        )
+        return True
+
+    return False
+
+
+def _skip_if_completed(
+    task: PipelineTask, pipeline_options: PipelineOptions, span: Span
+) -> bool:
+    """Returns true, and counts the task as skipped, if it was completed in the
+    last run."""
+    if not task.is_skipped_when_completed():
+        return False
+
+    group = task.task_plan.name
+
+    with pipeline_options.tracer.span(task.name, "snapshot-check", group):
+        is_completed = _is_task_completed(task, pipeline_options)
+
+    if is_completed:
+        span.set("skipped", True)
+        pipeline_options.metrics.get(group).add(TASKS_SKIPPED)
+
+    return is_completed
+
+
+@contextmanager
+def _count_failures(
+    task: PipelineTask, pipeline_options: PipelineOptions
+) -> Iterator[None]:
+    """Counts the task as cancelled or failed if the block raises, raises if the
+    task was cancelled before the block."""
+    metrics = pipeline_options.metrics.get(task.task_plan.name)
+
+    try:
+        if task.cancellation_token is not None:
+            task.cancellation_token.raise_if_cancelled()
+
+        yield
+    except TaskCancelledError:
+        metrics.add(TASKS_CANCELLED)
+        raise
+    except BaseException:
+        metrics.add(TASKS_FAILED)
+        raise
+
+
+def _set_task_completed(task: PipelineTask, pipeline_options: PipelineOptions):
+    """Saves task hash to snapshot and counts the task as completed."""
+    group = task.task_plan.name
+
+    if task.is_skipped_when_completed():
+        with pipeline_options.tracer.span(task.name, "snapshot-commit", group):
+            pipeline_options.snapshot.set_task_completed(task.get_task_hash())
+
+    pipeline_options.metrics.get(group).add(TASKS_COMPLETED)
+
+
+def _task_span(task: PipelineTask, pipeline_options: PipelineOptions) -> Span:
+    """Returns span of the whole task."""
+    task_plan = task.task_plan
+
+    return pipeline_options.tracer.span(
+        task.name, "task", task_plan.name, {"type": task_plan.task_type}
+    )
+
+
 def run_task(
-    task_config: Dict[str, Any],
-    parameters: Dict[str, Any],
+    task_plan: TaskPlan,
+    parameters: Mapping[str, Any],
     pipeline_options: PipelineOptions,
-    extra_parameters: Dict[str, Any],
+    extra_parameters: Mapping[str, Any],
+    cancellation_token: CancellationToken = None,
 ):
-    """Runs task."""
-    task_type = task_config["task"]
-    if task_type not in tasks:
-        raise ValueError("Task of '{}' type was not found.".format(task_type))
+    """Runs task of the plan.
 
-    task_name = utils.replace_parameters_from_string(task_config["name"], parameters)
+    cancellation_token is given to tasks of fan-outs, it is used to terminate
+    the task when the fan-out is cancelled.
+    """
+    task = _create_task(
+        task_plan, parameters, pipeline_options, extra_parameters, cancellation_token
+    )
 
-    task_input_values = task_config.get("inputs", {})
+    with _task_span(task, pipeline_options) as span:
+        # If task is completed, skip it
+        if _skip_if_completed(task, pipeline_options, span):
+            return
+
+        with _count_failures(task, pipeline_options):
+            task.run()
+
+        _set_task_completed(task, pipeline_options)
 
-    task: PipelineTask = tasks[task_type](
-        name=task_name,
-        task_input_values=task_input_values,
-        pipeline_parameters=parameters.copy(),
-        pipeline_options=pipeline_options,
-        extra_parameters=extra_parameters.copy(),
-    )
 
-    task_hash = task.get_task_hash()
+async def run_task_async(
+    task_plan: TaskPlan,
+    parameters: Mapping[str, Any],
+    pipeline_options: PipelineOptions,
+    extra_parameters: Mapping[str, Any],
+    run_blocking: Callable[..., Awaitable],
+    cancellation_token: CancellationToken = None,
+):
+    """Runs task of the plan from the asyncio event loop, like run_task().
+
+    Snapshot calls, which may hash input files or flush completed tasks, run
+    with run_blocking so that they do not block the event loop.
+    """
+    task = _create_task(
+        task_plan, parameters, pipeline_options, extra_parameters, cancellation_token
+    )
 
-    # If task is completed, skip it
-    if pipeline_options.snapshot.is_task_completed(task_hash):
-        print(task_name, "is already completed.")
-        return
+    with _task_span(task, pipeline_options) as span:
+        # If task is completed, skip it
+        if await run_blocking(_skip_if_completed, task, pipeline_options, span):
+            return
 
-    task.run()
+        with _count_failures(task, pipeline_options):
+            await task.run_async(run_blocking)
 
-    # Save task hash to snapshot
-    pipeline_options.snapshot.set_task_completed(task_hash)
+        await run_blocking(_set_task_completed, task, pipeline_options)
@@ -0,0 +1,647 @@
+"""Base class for tasks running sub-tasks for each item."""
+import os
+import json
+import tempfile
+from itertools import islice
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Tuple
+
+from pypelines.plan import TaskPlan
+from pypelines.parameter_scope import ParameterScope
+from pypelines.utils import (
+    sha256_hash,
+    string_to_bool,
+    replace_parameters_from_anything,
+)
+from pypelines.config import SCRIPTS_DIRECTORY
+from pypelines.constants import FanOutExecutors, TaskHashModes
+from pypelines.metrics import (
+    ITEMS_FAILED,
+    ITEMS_STARTED,
+    ITEMS_CANCELLED,
+    ITEMS_COMPLETED,
+    ITEMS_SUBMITTED,
+    TaskMetrics,
+)
+from pypelines.task_hash import UnhashedValue
+from pypelines.fan_out_results import FanOutResults
+from pypelines.cancellation import CancellationToken, TaskCancelledError
+from pypelines.executor import AsyncioExecutor, BoundedExecutor
+from pypelines.validation import output_parameter_name
+from pypelines.pipeline_options import PipelineOptions
+from pypelines.task import PipelineTask, TaskInputSchema
+
+# Task input keys
+INPUT_THREADS = "threads"
+INPUT_MAX_IN_FLIGHT = "max-in-flight"
+INPUT_OUTPUT_PARAMETER_NAME = "output-parameter-name"
+INPUT_SUB_TASKS_CONFIG = "tasks"
+INPUT_BATCH_SIZE = "batch-size"
+INPUT_SPLIT_FAILED_BATCHES = "split-failed-batches"
+INPUT_EXECUTOR = "executor"
+INPUT_FAIL_FAST = "fail-fast"
+INPUT_MAX_FAILURES = "max-failures"
+INPUT_MAX_FAILURE_RATE = "max-failure-rate"
+
+# Failure rate is checked only after given number of items finished
+FAILURE_RATE_MIN_ITEMS = 20
+
+# Suffixes of the extra output parameters passed to sub-tasks in batch mode
+BATCH_FILE_PARAMETER_SUFFIX = "_file"
+BATCH_COUNT_PARAMETER_SUFFIX = "_count"
+
+
+class ForEachTask(PipelineTask):
+    """Base class for tasks running given sub-tasks for each item.
+
+    Items are yielded lazily by _iter_items() and submitted to a thread pool,
+    at most max_in_flight items are waiting for or running sub-tasks at once.
+
+    When batch_size is greater than 1, sub-tasks run once per batch of items.
+    The output parameter then contains the values of the batch separated by
+    newlines, OUTPUT_PARAMETER_NAME_file contains path of a file with the same
+    content and OUTPUT_PARAMETER_NAME_count the number of items.
+    """
+
+    task_type: str = "for-each"
+
+    task_input_schema: List[TaskInputSchema] = [
+        TaskInputSchema(
+            name=INPUT_THREADS,
+            description="Provide number of threads for running sub-tasks.",
+            value_type=int,
+            default_value=1,
+        ),
+        TaskInputSchema(
+            name=INPUT_MAX_IN_FLIGHT,
+            description=(
+                "Maximum number of items waiting for or running sub-tasks. "
+                "Defaults to twice the number of threads."
+            ),
+            value_type=int,
+            required=False,
+        ),
+        TaskInputSchema(
+            name=INPUT_OUTPUT_PARAMETER_NAME,
+            description=(
+                "Provide name of the output parameter."
+                "A parameter with given name will be passed to sub-tasks "
+                "and can be accessed using ${{parameters.OUTPUT_PARAMETER_NAME}}"
+            ),
+            value_type=output_parameter_name,
+        ),
+        TaskInputSchema(
+            name=INPUT_SUB_TASKS_CONFIG,
+            description="Provide tasks to run for each item.",
+            sub_tasks=True,
+        ),
+        TaskInputSchema(
+            name=INPUT_BATCH_SIZE,
+            description=(
+                "Number of items passed to sub-tasks at once. "
+                "Sub-tasks run once for each batch of items."
+            ),
+            value_type=int,
+            default_value=1,
+        ),
+        TaskInputSchema(
+            name=INPUT_SPLIT_FAILED_BATCHES,
+            description=(
+                "If true, failed batches are split in halves and run again "
+                "until the failing items are found."
+            ),
+            value_type=string_to_bool,
+            default_value=False,
+        ),
+        TaskInputSchema(
+            name=INPUT_EXECUTOR,
+            description=(
+                "Executor running sub-tasks, either 'threads' or 'asyncio'. "
+                "With 'asyncio', script sub-tasks run on one event loop, other "
+                "sub-tasks in threads of the task, and threads is the number of "
+                "items running at once. Defaults to fan-out-executor of the "
+                "pipeline config."
+            ),
+            allowed_values=FanOutExecutors.ALL,
+            required=False,
+        ),
+        TaskInputSchema(
+            name=INPUT_FAIL_FAST,
+            description=(
+                "If true, remaining items are cancelled and running scripts are "
+                "terminated when an item fails."
+            ),
+            value_type=string_to_bool,
+            default_value=False,
+        ),
+        TaskInputSchema(
+            name=INPUT_MAX_FAILURES,
+            description=(
+                "Remaining items are cancelled when more than given number of "
+                "items failed."
+            ),
+            value_type=int,
+            required=False,
+        ),
+        TaskInputSchema(
+            name=INPUT_MAX_FAILURE_RATE,
+            description=(
+                "Remaining items are cancelled when the ratio of failed items to "
+                "finished items is above given value, from 0 to 1. Checked after "
+                f"{FAILURE_RATE_MIN_ITEMS} items finished."
+            ),
+            value_type=float,
+            required=False,
+        ),
+    ]
+
+    def __init__(
+        self,
+        name: str,
+        task_input_values: Dict[str, Any],
+        pipeline_parameters: Dict[str, Any],
+        pipeline_options: PipelineOptions,
+        extra_parameters: Dict[str, Any],
+    ) -> None:
+        super().__init__(
+            name,
+            task_input_values,
+            pipeline_parameters,
+            pipeline_options,
+            extra_parameters,
+        )
+
+        self.threads: int = 1
+        self.max_in_flight: int = 2
+        self.output_parameter_name: str = None
+        self.sub_tasks: Tuple[TaskPlan, ...] = ()
+        self.batch_size: int = 1
+        self.split_failed_batches: bool = False
+        self.executor: str = FanOutExecutors.THREADS
+        self.fail_fast: bool = False
+        self.max_failures: int = None
+        self.max_failure_rate: float = None
+
+        # State of run_for_each()
+        self._results: FanOutResults = None
+        self._is_aborted: bool = False
+        self._items_cancellation_token: CancellationToken = None
+        self._metrics: TaskMetrics = None
+        # run_blocking() of the asyncio executor of the items
+        self._run_blocking: Callable[..., Awaitable] = None
+
+    def set_for_each_inputs(self, inputs: Dict[str, Any]) -> None:
+        """Set inputs common to all for-each tasks from parsed inputs."""
+        self.threads = inputs[INPUT_THREADS]
+        self.max_in_flight = inputs[INPUT_MAX_IN_FLIGHT] or 2 * self.threads
+        self.output_parameter_name = inputs[INPUT_OUTPUT_PARAMETER_NAME]
+        self.sub_tasks = inputs[INPUT_SUB_TASKS_CONFIG]
+        self.batch_size = inputs[INPUT_BATCH_SIZE]
+        self.split_failed_batches = inputs[INPUT_SPLIT_FAILED_BATCHES]
+
+        if self.batch_size < 1:
+            raise ValueError(f"Batch size of '{self.name}' task must be at least 1.")
+
+        self.executor = (
+            inputs[INPUT_EXECUTOR] or self.pipeline_options.fan_out_executor
+        )
+        self.fail_fast = inputs[INPUT_FAIL_FAST]
+        self.max_failures = inputs[INPUT_MAX_FAILURES]
+        self.max_failure_rate = inputs[INPUT_MAX_FAILURE_RATE]
+
+    def is_skipped_when_completed(self) -> bool:
+        """Returns false when task-hash-mode is "inputs".
+
+        Items can be added, and parameters used by sub-tasks can change, without
+        any change of the inputs of this task. The fan-out then runs in every
+        run, and items are skipped by the hashes of their sub-tasks.
+        """
+        return self.pipeline_options.task_hash_mode != TaskHashModes.INPUTS
+
+    def get_sub_tasks_hash(self) -> str:
+        """Returns hash of the sub-task configs with parameters of this task
+        replaced. Parameters of the items are kept as placeholders."""
+        sub_tasks = [
+            {
+                "task": task_plan.task_type,
+                "name": task_plan.name,
+                "inputs": dict(task_plan.input_values),
+                "input-files": list(task_plan.input_files),
+            }
+            for task_plan in self.sub_tasks
+        ]
+
+        return sha256_hash(
+            json.dumps(
+                replace_parameters_from_anything(sub_tasks, self.parameters),
+                sort_keys=True,
+                default=str,
+            )
+        )
+
+    def get_item_value(self, item: Any) -> str:
+        """Returns value of the item passed to sub-tasks in the output parameter."""
+        return item
+
+    def get_item_description(self, item_value: str) -> str:
+        """Returns description of the item, used in logs."""
+        return item_value
+
+    def on_item_finished(self, item: Any, succeeded: bool) -> None:
+        """Called from the worker thread, or a thread of the asyncio executor,
+        when all sub-tasks of the item finished or any of them failed.
+
+        Override this method to keep track of the progress.
+        """
+        pass
+
+    def _iter_items(self) -> Iterator[Any]:
+        """Yields items to run sub-tasks for."""
+        raise NotImplementedError("Task is not implemented")
+
+    def _iter_batches(self) -> Iterator[List[Any]]:
+        """Yields items grouped in lists of at most batch_size items."""
+        items = self._iter_items()
+
+        while True:
+            batch = list(islice(items, self.batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def _should_abort(self) -> bool:
+        """Returns true if failures exceeded the configured thresholds."""
+        results = self._results
+
+        if self.fail_fast and results.failed > 0:
+            return True
+
+        if self.max_failures is not None and results.failed > self.max_failures:
+            return True
+
+        return (
+            self.max_failure_rate is not None
+            and results.finished >= FAILURE_RATE_MIN_ITEMS
+            and results.get_failure_rate() > self.max_failure_rate
+        )
+
+    def _record_result(
+        self, items_count: int, error: Exception, description: str, started_at: int
+    ) -> None:
+        """Records result of finished items, cancels remaining items if failures
+        exceeded the configured thresholds, and raises error if they failed."""
+        self._results.add(items_count, error, description)
+
+        self._metrics.add_latency(
+            (self.pipeline_options.tracer.now() - started_at) / 1e9
+        )
+        if error is None:
+            self._metrics.add(ITEMS_COMPLETED, items_count)
+        elif isinstance(error, TaskCancelledError):
+            self._metrics.add(ITEMS_CANCELLED, items_count)
+        else:
+            self._metrics.add(ITEMS_FAILED, items_count)
+
+        if error is None:
+            return
+
+        if not isinstance(error, TaskCancelledError) and not self._is_aborted:
+            if self._should_abort():
+                self._is_aborted = True
+                print(
+                    f"Cancelling remaining items of '{self.name}', "
+                    f"{self._results.failed} items failed. Last error: {error}"
+                )
+                self._items_cancellation_token.cancel()
+
+        raise error
+
+    def _record_started(self, items_count: int, submitted_at: int) -> int:
+        """Records time the item, or batch, waited for a worker, and returns its
+        start time.
+
+        submitted_at is None for halves of split batches, which were already
+        counted as started.
+        """
+        tracer = self.pipeline_options.tracer
+        started_at = tracer.now()
+
+        if submitted_at is not None:
+            tracer.add(
+                self.name, "queue-wait", self.task_plan.name, submitted_at, started_at
+            )
+            self._metrics.add(ITEMS_STARTED, items_count)
+
+        return started_at
+
+    def _start_item(
+        self, item: Any, submitted_at: int
+    ) -> Tuple[int, Dict[str, Any], str]:
+        """Returns start time, output parameters and description of the item."""
+        started_at = self._record_started(1, submitted_at)
+        item_value = self.get_item_value(item)
+
+        return (
+            started_at,
+            {self.output_parameter_name: item_value},
+            self.get_item_description(item_value),
+        )
+
+    def _finish_item(
+        self, item: Any, error: Exception, description: str, started_at: int
+    ) -> None:
+        """Records result of the item, raises error if it failed."""
+        self.on_item_finished(item, error is None)
+        self._record_result(1, error, description, started_at)
+
+    def _run_item(self, item: Any, submitted_at: int = None) -> None:
+        """Run sub-tasks for the item."""
+        started_at, output_parameters, description = self._start_item(
+            item, submitted_at
+        )
+
+        error = None
+        try:
+            self._run_sub_tasks(output_parameters, description)
+        except Exception as e:
+            error = e
+
+        self._finish_item(item, error, description, started_at)
+
+    async def _run_item_async(self, item: Any, submitted_at: int = None) -> None:
+        """Run sub-tasks for the item on the event loop."""
+        started_at, output_parameters, description = self._start_item(
+            item, submitted_at
+        )
+
+        error = None
+        try:
+            await self._run_sub_tasks_async(output_parameters, description)
+        except Exception as e:
+            error = e
+
+        # on_item_finished() may read files or write to the snapshot store
+        await self._run_blocking(
+            self._finish_item, item, error, description, started_at
+        )
+
+    def _get_batch_description(self, item_values: List[str]) -> str:
+        """Returns description of the batch, used in logs."""
+        if len(item_values) == 1:
+            return self.get_item_description(item_values[0])
+
+        return (
+            f"batch of {len(item_values)} items, from "
+            f"{self.get_item_description(item_values[0])} to "
+            f"{self.get_item_description(item_values[-1])}"
+        )
+
+    def _write_batch(self, batch: List[Any]) -> Tuple[Dict[str, Any], str]:
+        """Writes values of the batch to a temporary file, returns output
+        parameters and description of the batch.
+
+        The file is removed by _remove_batch_file().
+        """
+        item_values = [self.get_item_value(item) for item in batch]
+        batch_value = "\n".join(item_values)
+
+        fd, batch_file_path = tempfile.mkstemp(
+            dir=SCRIPTS_DIRECTORY, prefix="batch-", suffix=".txt"
+        )
+
+        try:
+            with os.fdopen(fd, "w") as batch_file:
+                batch_file.write(batch_value + "\n")
+        except BaseException:
+            os.unlink(batch_file_path)
+            raise
+
+        return (
+            {
+                self.output_parameter_name: batch_value,
+                # Content of the file is hashed through the batch value
+                self.output_parameter_name
+                + BATCH_FILE_PARAMETER_SUFFIX: UnhashedValue(batch_file_path),
+                self.output_parameter_name + BATCH_COUNT_PARAMETER_SUFFIX: len(batch),
+            },
+            self._get_batch_description(item_values),
+        )
+
+    def _remove_batch_file(self, output_parameters: Dict[str, Any]) -> None:
+        """Removes file written by _write_batch()."""
+        os.unlink(
+            output_parameters[self.output_parameter_name + BATCH_FILE_PARAMETER_SUFFIX]
+        )
+
+    def _on_batch_done(
+        self, batch: List[Any], error: Exception, description: str, started_at: int
+    ) -> List[List[Any]]:
+        """Records result of the batch.
+
+        If the batch failed and split_failed_batches is set, returns halves of
+        the batch to run again, so that only the failing items are reported.
+        Else raises error if the batch failed.
+        """
+        if (
+            error is not None
+            and not isinstance(error, TaskCancelledError)
+            and self.split_failed_batches
+            and len(batch) > 1
+        ):
+            print(f"Batch of {len(batch)} items failed, splitting it. {error}")
+
+            middle = len(batch) // 2
+            return [batch[:middle], batch[middle:]]
+
+        for item in batch:
+            self.on_item_finished(item, error is None)
+
+        self._record_result(len(batch), error, description, started_at)
+
+        return []
+
+    def _run_batch(self, batch: List[Any], submitted_at: int = None) -> None:
+        """Run sub-tasks for the batch of items."""
+        started_at = self._record_started(len(batch), submitted_at)
+        output_parameters, description = self._write_batch(batch)
+
+        error = None
+        try:
+            self._run_sub_tasks(output_parameters, description)
+        except Exception as e:
+            error = e
+        finally:
+            self._remove_batch_file(output_parameters)
+
+        halves = self._on_batch_done(batch, error, description, started_at)
+        errors = []
+        for half in halves:
+            try:
+                self._run_batch(half)
+            except Exception as e:
+                errors.append(e)
+
+        if errors:
+            raise errors[0]
+
+    async def _run_batch_async(
+        self, batch: List[Any], submitted_at: int = None
+    ) -> None:
+        """Run sub-tasks for the batch of items on the event loop."""
+        started_at = self._record_started(len(batch), submitted_at)
+        output_parameters, description = await self._run_blocking(
+            self._write_batch, batch
+        )
+
+        error = None
+        try:
+            await self._run_sub_tasks_async(output_parameters, description)
+        except Exception as e:
+            error = e
+        finally:
+            await self._run_blocking(self._remove_batch_file, output_parameters)
+
+        halves = await self._run_blocking(
+            self._on_batch_done, batch, error, description, started_at
+        )
+        errors = []
+        for half in halves:
+            try:
+                await self._run_batch_async(half)
+            except Exception as e:
+                errors.append(e)
+
+        if errors:
+            raise errors[0]
+
+    def _start_sub_tasks(
+        self, output_parameters: Dict[str, Any], description: str
+    ) -> Tuple[ParameterScope, ParameterScope]:
+        """Raises if the items were cancelled, else returns parameters and extra
+        parameters of sub-tasks.
+
+        Output parameters are added to the parameters of this task without
+        copying them.
+        """
+        self._items_cancellation_token.raise_if_cancelled()
+
+        self.pipeline_options.task_output.print_progress(
+            f"Running sub-tasks for {description}"
+        )
+
+        return (
+            ParameterScope(output_parameters, parent=self.parameters),
+            ParameterScope(output_parameters, parent=self._extra_parameters),
+        )
+
+    def _run_sub_tasks(
+        self, output_parameters: Dict[str, Any], description: str
+    ) -> None:
+        """Run sub-tasks with given output parameters."""
+        from pypelines.tasks import run_task
+
+        parameters, extra_parameters = self._start_sub_tasks(
+            output_parameters, description
+        )
+
+        # For each given task, run it with output parameters as extra_parameters
+        for task_plan in self.sub_tasks:
+            run_task(
+                task_plan=task_plan,
+                parameters=parameters,
+                pipeline_options=self.pipeline_options,
+                extra_parameters=extra_parameters,
+                cancellation_token=self._items_cancellation_token,
+            )
+
+    async def _run_sub_tasks_async(
+        self, output_parameters: Dict[str, Any], description: str
+    ) -> None:
+        """Run sub-tasks with given output parameters on the event loop."""
+        from pypelines.tasks import run_task_async
+
+        parameters, extra_parameters = self._start_sub_tasks(
+            output_parameters, description
+        )
+
+        # For each given task, run it with output parameters as extra_parameters
+        for task_plan in self.sub_tasks:
+            await run_task_async(
+                task_plan=task_plan,
+                parameters=parameters,
+                pipeline_options=self.pipeline_options,
+                extra_parameters=extra_parameters,
+                run_blocking=self._run_blocking,
+                cancellation_token=self._items_cancellation_token,
+            )
+
+    def run_for_each(self) -> None:
+        """Runs sub-tasks for each item, or for each batch of items.
+
+        When failures exceed the configured thresholds, or the task is
+        interrupted, items which did not run are cancelled and running scripts
+        are terminated.
+        """
+        self._results = FanOutResults()
+        self._is_aborted = False
+        self._metrics = self.pipeline_options.metrics.get(self.task_plan.name)
+        # Cancelled when this task is aborted, or when a parent fan-out is
+        # cancelled
+        self._items_cancellation_token = CancellationToken(
+            parent=self.cancellation_token
+        )
+
+        if self.executor == FanOutExecutors.ASYNCIO:
+            executor_class = AsyncioExecutor
+            run_item, run_batch = self._run_item_async, self._run_batch_async
+        else:
+            executor_class = BoundedExecutor
+            run_item, run_batch = self._run_item, self._run_batch
+
+        worker_budget = self.pipeline_options.worker_budget
+        tracer = self.pipeline_options.tracer
+
+        # Items are read lazily so that only max_in_flight items, or batches,
+        # are held in memory. If this task is an item of a parent fan-out, its
+        # worker token is lent to the items while waiting for them
+        try:
+            with worker_budget.lend(), executor_class(
+                max_workers=self.threads,
+                max_in_flight=self.max_in_flight,
+                worker_budget=worker_budget,
+            ) as executor:
+                if self.executor == FanOutExecutors.ASYNCIO:
+                    self._run_blocking = executor.run_blocking
+
+                try:
+                    if self.batch_size > 1:
+                        for batch in self._iter_batches():
+                            if self._items_cancellation_token.is_cancelled:
+                                break
+                            executor.submit(run_batch, batch, tracer.now())
+                            self._metrics.add(ITEMS_SUBMITTED, len(batch))
+                    else:
+                        for item in self._iter_items():
+                            if self._items_cancellation_token.is_cancelled:
+                                break
+                            executor.submit(run_item, item, tracer.now())
+                            self._metrics.add(ITEMS_SUBMITTED)
+                except BaseException:
+                    # Terminates running scripts before waiting for them
+                    self._items_cancellation_token.cancel()
+                    raise
+        except BaseException:
+            # Interrupted while waiting for running items
+            self._items_cancellation_token.cancel()
+            raise
+        finally:
+            self._items_cancellation_token.close()
+
+        if self._results.has_errors:
+            summary = self._results.get_summary()
+            print(f"Sub-tasks of '{self.name}' failed. {summary}")
+
+            # Parent fan-out counts this task as cancelled, not failed
+            if self.cancellation_token is not None:
+                self.cancellation_token.raise_if_cancelled()
+
+            raise Exception(f"Error in sub-tasks of '{self.name}'. {summary}")
@@ -1,58 +1,128 @@
 """Task to run for each file matching glob pattern."""
 import os
-from glob import glob
-import concurrent.futures
-from typing import Any, Dict, List
+import stat
+from typing import Any, Dict, Iterator, List, NamedTuple
 
-from pypelines.utils import string_to_bool
-from pypelines.validation import output_parameter_name
+from pypelines.utils import sha256_hash, string_to_bool
+from pypelines.validation import timestamp
+from pypelines.metrics import ITEMS_SKIPPED
+from pypelines.file_index import FileIndex
+from pypelines.file_walker import FileWalker
+from pypelines.task import TaskInputSchema
+from pypelines.task_hash import get_file_content_hash
+from pypelines.constants import InputFileFingerprints
 from pypelines.pipeline_options import PipelineOptions
-from pypelines.task import PipelineTask, TaskInputSchema
+from pypelines.tasks.task_for_each import ForEachTask
 
 # Task input keys
 INPUT_GLOB_PATTERN = "glob-pattern"
-INPUT_THREADS = "threads"
-INPUT_OUTPUT_PARAMETER_NAME = "output-parameter-name"
 INPUT_INCLUDE_SUBDIRECTORIES = "include-subdirectories"
-INPUT_SUB_TASKS_CONFIG = "tasks"
+INPUT_EXCLUDE_PATTERNS = "exclude-patterns"
+INPUT_MIN_SIZE = "min-size"
+INPUT_MAX_SIZE = "max-size"
+INPUT_MODIFIED_SINCE = "modified-since"
+INPUT_FOLLOW_SYMLINKS = "follow-symlinks"
+INPUT_INCREMENTAL = "incremental"
+INPUT_INCREMENTAL_FINGERPRINT = "incremental-fingerprint"
+INPUT_REPORT_DELETED_FILES = "report-deleted-files"
 
+# Maximum number of deleted files listed in the logs
+MAX_REPORTED_DELETED_FILES = 10
 
-class ForEachFileTask(PipelineTask):
+
+class IndexedFile(NamedTuple):
+    """File dispatched by an incremental task, with its fingerprint taken
+    before sub-tasks run."""
+
+    path: str
+    size: int
+    mtime_ns: int
+
+
+class ForEachFileTask(ForEachTask):
     """Task to run given sub-tasks for each file matching glob pattern."""
 
     task_type: str = "for-each-file"
 
-    task_input_schema: List[TaskInputSchema] = [
+    task_input_schema: List[TaskInputSchema] = ForEachTask.task_input_schema + [
         TaskInputSchema(
             name=INPUT_GLOB_PATTERN,
             description="Provide glob pattern to match files",
         ),
         TaskInputSchema(
-            name=INPUT_THREADS,
-            description="Provide number of threads for running sub-tasks.",
+            name=INPUT_INCLUDE_SUBDIRECTORIES,
+            description=(
+                "If true, files of subdirectories matching glob pattern will be included."
+            ),
+            value_type=string_to_bool,
+        ),
+        TaskInputSchema(
+            name=INPUT_EXCLUDE_PATTERNS,
+            description=(
+                "List of glob patterns, files whose path or name matches any of "
+                "the patterns will be skipped."
+            ),
+            value_type=list,
+            default_value=[],
+        ),
+        TaskInputSchema(
+            name=INPUT_MIN_SIZE,
+            description="If set, files smaller than given bytes will be skipped.",
             value_type=int,
-            default_value=1,
+            required=False,
         ),
         TaskInputSchema(
-            name=INPUT_OUTPUT_PARAMETER_NAME,
+            name=INPUT_MAX_SIZE,
+            description="If set, files larger than given bytes will be skipped.",
+            value_type=int,
+            required=False,
+        ),
+        TaskInputSchema(
+            name=INPUT_MODIFIED_SINCE,
             description=(
-                "Provide name of the output parameter."
-                "A parameter with given name will be passed to sub-tasks "
-                "and can be accessed using ${{parameters.OUTPUT_PARAMETER_NAME}}"
+                "If set, files modified before given date (ISO 8601 date or unix "
+                "timestamp) will be skipped."
             ),
-            value_type=output_parameter_name,
+            value_type=timestamp,
+            required=False,
         ),
         TaskInputSchema(
-            name=INPUT_INCLUDE_SUBDIRECTORIES,
+            name=INPUT_FOLLOW_SYMLINKS,
             description=(
-                "If true, files of subdirectories matching glob pattern will be included."
+                "If false, symlinks and files inside symlinked directories will be "
+                "skipped."
             ),
             value_type=string_to_bool,
+            default_value=True,
         ),
         TaskInputSchema(
-            name=INPUT_SUB_TASKS_CONFIG,
-            description="Provide tasks to run a file.",
-            value_type=list,
+            name=INPUT_INCREMENTAL,
+            description=(
+                "If true, sub-tasks run only for files which are new or changed "
+                "since their sub-tasks last succeeded. Fingerprints of the files "
+                "are kept in the snapshot store across runs."
+            ),
+            value_type=string_to_bool,
+            default_value=False,
+        ),
+        TaskInputSchema(
+            name=INPUT_INCREMENTAL_FINGERPRINT,
+            description=(
+                "How changed files are found in incremental mode, 'stat' compares "
+                "size and modification time, 'content' also compares SHA256 of "
+                "files whose modification time changed."
+            ),
+            allowed_values=InputFileFingerprints.ALL,
+            default_value=InputFileFingerprints.STAT,
+        ),
+        TaskInputSchema(
+            name=INPUT_REPORT_DELETED_FILES,
+            description=(
+                "If true, files processed by earlier runs which do not exist, or "
+                "do not match anymore, are reported in incremental mode."
+            ),
+            value_type=string_to_bool,
+            default_value=False,
         ),
     ]
 
@@ -73,65 +143,179 @@ class ForEachFileTask(PipelineTask):
         )
 
         self.glob_pattern: str = None
-        self.output_parameter_name: str = None
         self.include_subdirectories: bool = None
-        self.threads: int = 1
+        self.exclude_patterns: List[str] = []
+        self.min_size: int = None
+        self.max_size: int = None
+        self.modified_since: float = None
+        self.follow_symlinks: bool = True
+        self.incremental: bool = False
+        self.incremental_fingerprint: str = InputFileFingerprints.STAT
+        self.report_deleted_files: bool = False
+
+        # Index of processed files, used in incremental mode
+        self.file_index: FileIndex = None
 
     def set_task_inputs(self) -> None:
         """Set task inputs."""
         inputs = super().get_parsed_inputs()
 
+        self.set_for_each_inputs(inputs)
         self.glob_pattern = os.path.expanduser(inputs[INPUT_GLOB_PATTERN])
-        self.output_parameter_name = inputs[INPUT_OUTPUT_PARAMETER_NAME]
         self.include_subdirectories = inputs[INPUT_INCLUDE_SUBDIRECTORIES]
-        self.threads = inputs[INPUT_THREADS]
-        self.sub_tasks = inputs[INPUT_SUB_TASKS_CONFIG]
+        self.exclude_patterns = [str(x) for x in inputs[INPUT_EXCLUDE_PATTERNS]]
+        self.min_size = inputs[INPUT_MIN_SIZE]
+        self.max_size = inputs[INPUT_MAX_SIZE]
+        self.modified_since = inputs[INPUT_MODIFIED_SINCE]
+        self.follow_symlinks = inputs[INPUT_FOLLOW_SYMLINKS]
+        self.incremental = inputs[INPUT_INCREMENTAL]
+        self.incremental_fingerprint = inputs[INPUT_INCREMENTAL_FINGERPRINT]
+        self.report_deleted_files = inputs[INPUT_REPORT_DELETED_FILES]
 
-    def _run_sub_tasks(self, file_path: str, thread_state: Dict[str, Any]) -> None:
-        """Run sub-tasks."""
-        print(f"Running sub-tasks for {file_path}")
+    def get_item_value(self, item: Any) -> str:
+        """Returns path of the file."""
+        if isinstance(item, IndexedFile):
+            return item.path
 
-        # TODO: check snapshot
+        return item
 
-        from pypelines.tasks import run_task
+    def on_item_finished(self, item: Any, succeeded: bool) -> None:
+        """Stores fingerprint of the file in the index, in incremental mode."""
+        if not succeeded or not isinstance(item, IndexedFile):
+            return
 
-        # For each given task, run it with file_path as extra_parameters
-        for task_config in self.sub_tasks:
+        content_hash = None
+        if self.incremental_fingerprint == InputFileFingerprints.CONTENT:
             try:
-                run_task(
-                    task_config=task_config,
-                    parameters={**self.parameters, self.output_parameter_name: file_path},
-                    pipeline_options=self.pipeline_options,
-                    extra_parameters={
-                        **self._extra_parameters,
-                        self.output_parameter_name: file_path,
-                    },
+                path_stat = os.stat(item.path)
+            except OSError:
+                return
+
+            # File changed while sub-tasks were running, it runs again next time
+            if (path_stat.st_size, path_stat.st_mtime_ns) != (item.size, item.mtime_ns):
+                return
+
+            if stat.S_ISREG(path_stat.st_mode):
+                content_hash = get_file_content_hash(
+                    item.path, item.size, item.mtime_ns
                 )
-            except Exception as e:
-                thread_state["error"] = True
-                thread_state["exceptions"].append(e)
-                raise e
 
-    def run(self) -> None:
-        """Run task."""
-        self.set_task_inputs()
+        self.file_index.update(item.path, item.size, item.mtime_ns, content_hash)
+
+    def _iter_paths(self) -> Iterator[str]:
+        """Yields files matching glob pattern and filters while walking."""
+        return iter(
+            FileWalker(
+                self.glob_pattern,
+                include_subdirectories=self.include_subdirectories,
+                exclude_patterns=self.exclude_patterns,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                modified_since=self.modified_since,
+                follow_symlinks=self.follow_symlinks,
+            )
+        )
 
-        # Get list of files matching glob pattern
-        list_files = glob(self.glob_pattern, recursive=self.include_subdirectories)
+    def _is_unchanged(self, path: str, path_stat: os.stat_result) -> bool:
+        """Returns true if the file did not change since it was processed."""
+        entry = self.file_index.pop(path)
+        if entry is None:
+            return False
 
-        # To store error in any thread
-        threads_state = {"error": False, "exceptions": []}
+        size, mtime_ns, content_hash = entry
+        if (path_stat.st_size, path_stat.st_mtime_ns) == (size, mtime_ns):
+            return True
+
+        # Modification time changed, content is compared only if size is same
+        if (
+            self.incremental_fingerprint != InputFileFingerprints.CONTENT
+            or content_hash is None
+            or path_stat.st_size != size
+            or not stat.S_ISREG(path_stat.st_mode)
+        ):
+            return False
+
+        new_content_hash = get_file_content_hash(
+            path, path_stat.st_size, path_stat.st_mtime_ns
+        )
+        if new_content_hash != content_hash:
+            return False
+
+        self.file_index.update(
+            path, path_stat.st_size, path_stat.st_mtime_ns, content_hash
+        )
+        return True
+
+    def _iter_changed_files(self) -> Iterator[IndexedFile]:
+        """Yields new and changed files, then reports and forgets the files of the
+        index which were not found."""
+        changed_count = unchanged_count = 0
+        metrics = self.pipeline_options.metrics.get(self.task_plan.name)
+
+        for path in self._iter_paths():
+            try:
+                path_stat = os.stat(path)
+            except OSError:
+                # File was removed while walking
+                continue
 
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=self.threads
-        ) as executor:
-            futures = []
-            for file_path in list_files:
-                futures.append(
-                    executor.submit(self._run_sub_tasks, file_path, threads_state)
+            if self._is_unchanged(path, path_stat):
+                unchanged_count += 1
+                metrics.add(ITEMS_SKIPPED)
+                continue
+
+            changed_count += 1
+            yield IndexedFile(path, path_stat.st_size, path_stat.st_mtime_ns)
+
+        deleted_paths = self.file_index.pop_remaining_paths()
+
+        print(
+            f"'{self.name}' found {changed_count} new or changed files, "
+            f"{unchanged_count} unchanged and {len(deleted_paths)} deleted files"
+        )
+
+        if self.report_deleted_files:
+            for path in deleted_paths[:MAX_REPORTED_DELETED_FILES]:
+                print(f"  Deleted: {path}")
+
+            if len(deleted_paths) > MAX_REPORTED_DELETED_FILES:
+                print(
+                    f"  ... and {len(deleted_paths) - MAX_REPORTED_DELETED_FILES} "
+                    "other deleted files"
                 )
 
-        if threads_state["error"]:
-            raise Exception(f"Error in sub-tasks. {threads_state['exceptions']}")
+        self.file_index.delete(deleted_paths)
+
+    def _iter_items(self) -> Iterator[Any]:
+        """Yields files to run sub-tasks for."""
+        if self.file_index is not None:
+            return self._iter_changed_files()
+
+        return self._iter_paths()
+
+    def _load_file_index(self) -> None:
+        """Loads index of the files processed by earlier runs."""
+        self.file_index = FileIndex(
+            self.pipeline_options.snapshot_store,
+            self.pipeline_options.pipeline_name,
+            # Files are processed again when the sub-tasks change
+            index_key="{}:{}:{}".format(
+                self.task_type, sha256_hash(self.name), self.get_sub_tasks_hash()
+            ),
+            flush_size=self.pipeline_options.snapshot_flush_size,
+            flush_interval=self.pipeline_options.snapshot_flush_interval,
+        )
+        self.file_index.load()
+
+    def run(self) -> None:
+        """Run task."""
+        self.set_task_inputs()
+
+        if self.incremental:
+            self._load_file_index()
 
-        # TODO: Save snapshots
+        try:
+            self.run_for_each()
+        finally:
+            if self.file_index is not None:
+                self.file_index.flush()
@@ -1,47 +1,44 @@
 """Task to run sub-tasks for each line of file."""
 import os
-import concurrent.futures
-from typing import Any, Dict, List
+import glob
+import locale
+from typing import Any, Dict, Iterator, List, NamedTuple
 
 from pypelines.utils import string_to_bool
+from pypelines.task import TaskInputSchema
+from pypelines.checkpoint import MAX_CHECKPOINT_OFFSETS, LineOffsetCheckpoint
 from pypelines.pipeline_options import PipelineOptions
-from pypelines.validation import output_parameter_name
-from pypelines.task import PipelineTask, TaskInputSchema
+from pypelines.tasks.task_for_each import ForEachTask
 
 # Task input keys
 INPUT_FILE_PATH = "file-path"
-INPUT_THREADS = "threads"
 INPUT_TRIM_LINES = "trim-lines"
 INPUT_SKIP_EMPTY_LINES = "skip-empty-lines"
-INPUT_OUTPUT_PARAMETER_NAME = "output-parameter-name"
-INPUT_SUB_TASKS_CONFIG = "tasks"
 
+# Number of seconds between two checkpoint writes
+CHECKPOINT_SAVE_INTERVAL = 1
 
-class ForEachLineOfFileTask(PipelineTask):
+
+class Line(NamedTuple):
+    """Line of the file, start and end are byte offsets."""
+
+    start: int
+    end: int
+    value: str
+    # True if the line failed in the last run and is run again
+    is_retry: bool = False
+
+
+class ForEachLineOfFileTask(ForEachTask):
     """Task to run sub-tasks for each line of file."""
 
     task_type: str = "for-each-line-of-file"
 
-    task_input_schema: List[TaskInputSchema] = [
+    task_input_schema: List[TaskInputSchema] = ForEachTask.task_input_schema + [
         TaskInputSchema(
             name=INPUT_FILE_PATH,
             description="Provide the input file path.",
         ),
-        TaskInputSchema(
-            name=INPUT_THREADS,
-            description="Provide number of threads for running sub-tasks.",
-            value_type=int,
-            default_value=1,
-        ),
-        TaskInputSchema(
-            name=INPUT_OUTPUT_PARAMETER_NAME,
-            description=(
-                "Provide name of the output parameter."
-                "A parameter with given name will be passed to sub-tasks "
-                "and can be accessed using ${{parameters.OUTPUT_PARAMETER_NAME}}"
-            ),
-            value_type=output_parameter_name,
-        ),
         TaskInputSchema(
             name=INPUT_TRIM_LINES,
             description=(
@@ -56,11 +53,6 @@ class ForEachLineOfFileTask(PipelineTask):
             value_type=string_to_bool,
             default_value=True,
         ),
-        TaskInputSchema(
-            name=INPUT_SUB_TASKS_CONFIG,
-            description="Provide tasks to run a file.",
-            value_type=list,
-        ),
     ]
 
     def __init__(
@@ -80,86 +72,158 @@ class ForEachLineOfFileTask(PipelineTask):
         )
 
         self.file_path: str = None
-        self.threads: int = 1
         self.trim_lines: bool = True
         self.skip_empty_lines: bool = True
-        self.output_parameter_name: str = None
-        self.sub_tasks: list = []
+
+        # Same encoding as open() in text mode
+        self.encoding: str = locale.getpreferredencoding(False)
+
+        # Byte offset checkpoint, used when snapshots are enabled
+        self.checkpoint: LineOffsetCheckpoint = None
 
     def set_task_inputs(self) -> None:
         """Set task inputs."""
         inputs = super().get_parsed_inputs()
 
+        self.set_for_each_inputs(inputs)
         self.file_path = inputs[INPUT_FILE_PATH]
-        self.threads = inputs[INPUT_THREADS]
         self.trim_lines = inputs[INPUT_TRIM_LINES]
         self.skip_empty_lines = inputs[INPUT_SKIP_EMPTY_LINES]
-        self.output_parameter_name = inputs[INPUT_OUTPUT_PARAMETER_NAME]
-        self.sub_tasks = inputs[INPUT_SUB_TASKS_CONFIG]
-
-    def _run_sub_tasks(self, current_line: str, thread_state: Dict[str, Any]) -> None:
-        """Run sub-tasks."""
-        print(f"Running sub-tasks for line '{current_line}'")
-
-        # TODO: check snapshot
-
-        from pypelines.tasks import run_task
-
-        # Run subtasks with extra parameters containing current_line value
-        for task_config in self.sub_tasks:
-            try:
-                run_task(
-                    task_config=task_config,
-                    parameters={**self.parameters, self.output_parameter_name: current_line},
-                    pipeline_options=self.pipeline_options,
-                    extra_parameters={
-                        **self._extra_parameters,
-                        self.output_parameter_name: current_line,
-                    },
-                )
-            except Exception as e:
-                thread_state["error"] = True
-                thread_state["exceptions"].append(e)
-                raise e
-
-        # TODO: save snapshot
+
+    def get_input_files(self) -> List[str]:
+        """Returns input files of the task, including the file of the lines."""
+        file_path = self.get_parsed_inputs()[INPUT_FILE_PATH]
+        return super().get_input_files() + [glob.escape(str(file_path))]
+
+    def get_item_value(self, item: Line) -> str:
+        """Returns value of the line."""
+        return item.value
+
+    def get_item_description(self, item_value: str) -> str:
+        """Returns description of the line, used in logs."""
+        return f"line '{item_value}'"
+
+    def on_item_finished(self, item: Line, succeeded: bool) -> None:
+        """Updates checkpoint."""
+        if self.checkpoint is None:
+            return
+
+        if item.is_retry:
+            self.checkpoint.finish_retried_line(item.start, succeeded)
+        else:
+            self.checkpoint.finish_line(item.start, succeeded)
+
+    def _parse_line(self, raw_line: bytes) -> str:
+        """Decodes line, trims it if configured. Returns None if line must be
+        skipped."""
+        line = raw_line.decode(self.encoding).rstrip("\r\n")
+
+        if self.trim_lines:
+            line = line.strip()
+
+        if self.skip_empty_lines and not line:
+            return None
+
+        return line
+
+    def _iter_items(self) -> Iterator[Line]:
+        """Yields lines of the file, trimmed and filtered as configured.
+
+        When resuming from a checkpoint, lines which failed in the last run are
+        yielded first, then the file is read from the checkpoint offset skipping
+        lines completed out of order.
+        """
+        checkpoint = self.checkpoint
+
+        with open(self.file_path, "rb") as f:
+            if checkpoint is not None:
+                for start in checkpoint.loaded_failed_offsets:
+                    f.seek(start)
+                    raw_line = f.readline()
+
+                    line = self._parse_line(raw_line)
+                    if line is None:
+                        checkpoint.finish_retried_line(start, succeeded=True)
+                        continue
+
+                    yield Line(
+                        start=start,
+                        end=start + len(raw_line),
+                        value=line,
+                        is_retry=True,
+                    )
+
+                f.seek(checkpoint.offset)
+
+            position = f.tell()
+
+            for raw_line in f:
+                start, position = position, position + len(raw_line)
+
+                line = self._parse_line(raw_line)
+                if line is None:
+                    continue
+
+                if checkpoint is not None:
+                    checkpoint.start_line(start, position)
+
+                    if start in checkpoint.loaded_completed_offsets:
+                        checkpoint.finish_line(start, succeeded=True)
+                        continue
+
+                yield Line(start=start, end=position, value=line)
+
+    def _load_checkpoint(self) -> None:
+        """Loads byte offset checkpoint of the task from the snapshot."""
+        file_stat = os.stat(self.file_path)
+
+        self.checkpoint = LineOffsetCheckpoint(
+            self.pipeline_options.snapshot,
+            key=f"{self.task_type}:{self.get_task_hash()}",
+            save_interval=CHECKPOINT_SAVE_INTERVAL,
+            # Offsets are valid only for the same file, with the same content.
+            # Stored as a string, inode numbers may not fit in 64-bit signed
+            # integers
+            file_identity="{}:{}:{}".format(
+                file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino
+            ),
+            # Lines of the batch being read are not submitted yet, they must not
+            # wait for each other
+            max_held_lines=MAX_CHECKPOINT_OFFSETS + self.batch_size,
+        )
+
+        if not self.checkpoint.load():
+            print(
+                f"{self.file_path} changed since the last run of '{self.name}', "
+                "reading it from the beginning"
+            )
+
+        if self.checkpoint.offset:
+            print(
+                f"Resuming '{self.name}' from byte offset {self.checkpoint.offset} "
+                f"of {self.file_path}"
+            )
+
+        self.checkpoint.start()
 
     def run(self) -> None:
         """Run task."""
         self.set_task_inputs()
 
-        # TODO: check snapshot
-
         if not os.path.isfile(self.file_path):
             raise FileNotFoundError(
                 f"File {self.file_path} not found for '{self.name}' task."
             )
 
-        # Read lines from file
-        lines: List[str] = []
-        with open(self.file_path, "r") as f:
-            _lines = f.read().splitlines()
-
-            # Trim lines
-            _lines = [s.strip() for s in _lines] if self.trim_lines else _lines
-
-            # Remove empty
-            lines = [s for s in _lines if s] if self.skip_empty_lines else _lines
-
-        # To store error in any thread
-        threads_state = {"error": False, "exceptions": []}
-
-        # Run sub-tasks
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=self.threads
-        ) as executor:
-            futures = []
-            for line in lines:
-                futures.append(
-                    executor.submit(self._run_sub_tasks, line, threads_state)
-                )
+        if self.pipeline_options.use_snapshots:
+            self._load_checkpoint()
 
-        if threads_state["error"]:
-            raise Exception(f"Error in sub-tasks. {threads_state['exceptions']}")
+        try:
+            self.run_for_each()
 
-        # TODO: save snapshot
+            # Task runs again in the next run, which must read the whole file
+            if self.checkpoint is not None and not self.is_skipped_when_completed():
+                self.checkpoint.clear()
+        finally:
+            if self.checkpoint is not None:
+                self.checkpoint.close()
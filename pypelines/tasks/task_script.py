@@ -1,13 +1,14 @@
 """Task to run scripts."""
-import re
 import os
-import stat
-import tempfile
+import asyncio
+import threading
 import subprocess
-from typing import Any, Dict, List
+from typing import Any, Awaitable, Callable, Dict, List
 
 from pypelines.utils import string_to_bool
-from pypelines.config import SCRIPTS_DIRECTORY
+from pypelines.task_output import TaskLog
+from pypelines.script_cache import script_cache
+from pypelines.cancellation import TaskCancelledError
 from pypelines.pipeline_options import PipelineOptions
 from pypelines.task import PipelineTask, TaskInputSchema
 
@@ -18,6 +19,11 @@ INPUT_SCRIPT = "script"
 INPUT_ARGUMENTS = "arguments"
 INPUT_ENVIRONMENT_VARIABLES = "environment-variables"
 INPUT_USE_SNAPSHOTS = "use-snapshots"
+INPUT_ARGUMENT_LINES = "argument-lines"
+INPUT_STDIN = "stdin"
+
+# Bytes of captured script output read at once
+OUTPUT_CHUNK_SIZE = 64 * 1024
 
 
 class ScriptTask(PipelineTask):
@@ -48,6 +54,22 @@ class ScriptTask(PipelineTask):
             description="List of arguments.",
             default_value=[],
         ),
+        TaskInputSchema(
+            name=INPUT_ARGUMENT_LINES,
+            description=(
+                "Each non-empty line is appended to arguments, "
+                "for example ${{parameters.OUTPUT_PARAMETER_NAME}} of a batch."
+            ),
+            required=False,
+        ),
+        TaskInputSchema(
+            name=INPUT_STDIN,
+            description=(
+                "Text written to standard input of the script, "
+                "a trailing newline is added if missing."
+            ),
+            required=False,
+        ),
         TaskInputSchema(
             name=INPUT_ENVIRONMENT_VARIABLES,
             description="Environment variables for script",
@@ -82,6 +104,7 @@ class ScriptTask(PipelineTask):
         self.use_snapshots = True
         self.ignore_script_errors = False
         self.arguments = []
+        self.stdin: str = None
         self.script_environment_variables: Dict[str, str] = {}
 
     def validate_inputs(self):
@@ -99,6 +122,14 @@ class ScriptTask(PipelineTask):
         self.use_snapshots = task_input_dict[INPUT_USE_SNAPSHOTS]
         self.ignore_script_errors = task_input_dict[INPUT_IGNORE_SCRIPT_ERRORS]
         self.arguments = [str(arg) for arg in task_input_dict[INPUT_ARGUMENTS]]
+        self.stdin = task_input_dict[INPUT_STDIN]
+
+        if task_input_dict[INPUT_ARGUMENT_LINES] is not None:
+            self.arguments += [
+                line
+                for line in str(task_input_dict[INPUT_ARGUMENT_LINES]).splitlines()
+                if line
+            ]
         self.script_environment_variables = task_input_dict[INPUT_ENVIRONMENT_VARIABLES]
 
         if self.use_snapshots is None:
@@ -111,6 +142,82 @@ class ScriptTask(PipelineTask):
                 self.pipeline_options.use_snapshots and self.use_snapshots
             )
 
+    def _get_stdin(self) -> bytes:
+        """Returns input of the script, None if stdin is not set."""
+        if self.stdin is None:
+            return None
+
+        stdin = str(self.stdin)
+        if stdin and not stdin.endswith("\n"):
+            stdin += "\n"
+
+        return stdin.encode()
+
+    def _get_subprocess_environment(self) -> Dict[str, str]:
+        """Returns environment variables of the script.
+
+        OS environment variables and pipeline config are built once per
+        pipeline, only extra parameters and script environment are added here.
+        """
+        return {
+            **self.pipeline_options.get_script_base_environment(),
+            **{key: str(value) for key, value in self._extra_parameters.items()},
+            **{
+                key: str(value)
+                for key, value in self.script_environment_variables.items()
+            },
+        }
+
+    def _check_exit_code(self, exit_code: int) -> None:
+        """Raises error if script failed and errors are not ignored."""
+        if not self.ignore_script_errors and exit_code != 0:
+            raise Exception("Script terminated with {} exit code".format(exit_code))
+
+    def _open_task_log(self) -> TaskLog:
+        """Returns log capturing output of the script, None if the script
+        writes to the terminal or its output is not shown."""
+        task_output = self.pipeline_options.task_output
+        if not self.show_output or not task_output.is_captured:
+            return None
+
+        return task_output.open_log(self.name)
+
+    def _get_subprocess_options(
+        self, stdin: Any, devnull: Any, pipe: Any, task_log: TaskLog
+    ) -> Dict[str, Any]:
+        """Returns options of the script process.
+
+        Scripts of fan-outs, and of tasks running concurrently with other
+        top-level tasks, are started in their own process group, so that the
+        whole group can be terminated when they are cancelled.
+        """
+        subprocess_options = dict(
+            env=self._get_subprocess_environment(),
+            stdin=stdin,
+            start_new_session=self.cancellation_token is not None,
+        )
+
+        if not self.show_output:
+            subprocess_options.update(stdout=devnull, stderr=devnull)
+        elif task_log is not None:
+            subprocess_options.update(stdout=pipe, stderr=subprocess.STDOUT)
+
+        return subprocess_options
+
+    def _check_result(self, exit_code: int) -> None:
+        """Raises error if script was cancelled or failed."""
+        if (
+            exit_code != 0
+            and self.cancellation_token is not None
+            and self.cancellation_token.is_cancelled
+        ):
+            raise TaskCancelledError(
+                "Script was terminated with {} exit code, because its fan-out "
+                "was cancelled".format(exit_code)
+            )
+
+        self._check_exit_code(exit_code)
+
     def run(
         self,
     ) -> None:
@@ -118,48 +225,196 @@ class ScriptTask(PipelineTask):
         self.set_task_inputs()
         # TODO: snapshot check
 
-        fd, script_path = tempfile.mkstemp(dir=SCRIPTS_DIRECTORY)
-
-        # Gives RWX permission for the owner
-        os.chmod(script_path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
+        # Identical scripts share the same cached file
+        script_path = script_cache.get_script_path(self.script)
 
-        # Write script to tmp file
-        with os.fdopen(fd, "w") as tmp_file:
-            tmp_file.write(self.script)
+        stdin = self._get_stdin()
+        task_log = self._open_task_log()
 
         # Subprocess options
-        subprocess_options = (
-            dict()
-            if self.show_output
-            else dict(stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        subprocess_options = self._get_subprocess_options(
+            None if stdin is None else subprocess.PIPE,
+            subprocess.DEVNULL,
+            subprocess.PIPE,
+            task_log,
         )
 
-        # Subprocess environment variables
-        # It will contain OS environment variables, pipeline config and extra parameters
-        subprocess_environment = {
-            **os.environ.copy(),
-            **{
-                # Replaces special chars from key
-                f"pipeline_{re.sub(r'[^a-zA-Z0-9_]', '_', key)}": value
-                for key, value in self.pipeline_options.get_config_dict().items()
-            },
-            **self._extra_parameters,
-            **self.script_environment_variables,
-        }
+        tracer = self.pipeline_options.tracer
 
         # Runs the script
-        process = subprocess.run(
-            [script_path] + self.arguments,
-            env={key: str(value) for key, value in subprocess_environment.items()},
-            **subprocess_options
-        )
+        with tracer.span(self.name, "spawn", self.task_plan.name):
+            try:
+                process = subprocess.Popen(
+                    [script_path] + self.arguments, **subprocess_options
+                )
+            except FileNotFoundError:
+                if os.path.isfile(script_path):
+                    raise
 
-        # Delete script
-        os.unlink(script_path)
+                # Script was evicted from the cache by another process
+                script_cache.forget(self.script)
+                process = subprocess.Popen(
+                    [script_cache.get_script_path(self.script)] + self.arguments,
+                    **subprocess_options
+                )
 
-        if not self.ignore_script_errors and process.returncode != 0:
-            raise Exception(
-                "Script terminated with {} exit code".format(process.returncode)
-            )
+        if self.cancellation_token is not None:
+            self.cancellation_token.register_process(process)
+
+        with tracer.span(
+            self.name, "script", self.task_plan.name, {"pid": process.pid}
+        ) as span:
+            try:
+                if task_log is None:
+                    process.communicate(stdin)
+                else:
+                    _capture_output(process, stdin, task_log)
+            except BaseException:
+                process.kill()
+                process.wait()
+                raise
+            finally:
+                if self.cancellation_token is not None:
+                    self.cancellation_token.unregister_process(process)
+                if task_log is not None:
+                    task_log.close()
+
+            span.set("exit_code", process.returncode)
+
+        self._check_result(process.returncode)
 
         # TODO: Save snapshot
+
+    async def run_async(self, run_blocking: Callable[..., Awaitable]) -> None:
+        """Run script task on the asyncio event loop, without blocking a thread
+        while the script is running. run_blocking is not used."""
+        self.set_task_inputs()
+
+        # Identical scripts share the same cached file
+        script_path = script_cache.get_script_path(self.script)
+
+        stdin = self._get_stdin()
+        task_log = self._open_task_log()
+
+        # Subprocess options
+        subprocess_options = self._get_subprocess_options(
+            None if stdin is None else asyncio.subprocess.PIPE,
+            asyncio.subprocess.DEVNULL,
+            asyncio.subprocess.PIPE,
+            task_log,
+        )
+
+        tracer = self.pipeline_options.tracer
+
+        # Runs the script, holding a token of the worker budget while it is
+        # alive, like the threads of the fan-outs
+        async with self.pipeline_options.worker_budget.hold_async():
+            with tracer.span(self.name, "spawn", self.task_plan.name):
+                try:
+                    process = await asyncio.create_subprocess_exec(
+                        script_path, *self.arguments, **subprocess_options
+                    )
+                except FileNotFoundError:
+                    if os.path.isfile(script_path):
+                        raise
+
+                    # Script was evicted from the cache by another process
+                    script_cache.forget(self.script)
+                    process = await asyncio.create_subprocess_exec(
+                        script_cache.get_script_path(self.script),
+                        *self.arguments,
+                        **subprocess_options
+                    )
+
+            if self.cancellation_token is not None:
+                self.cancellation_token.register_process(process)
+
+            with tracer.span(
+                self.name, "script", self.task_plan.name, {"pid": process.pid}
+            ) as span:
+                try:
+                    if task_log is None:
+                        await process.communicate(stdin)
+                    else:
+                        await _capture_output_async(process, stdin, task_log)
+                except BaseException:
+                    if process.returncode is None:
+                        process.kill()
+                        # Reaps the killed script, else it is left as a zombie
+                        await asyncio.shield(process.wait())
+                    raise
+                finally:
+                    if self.cancellation_token is not None:
+                        self.cancellation_token.unregister_process(process)
+                    if task_log is not None:
+                        task_log.close()
+
+                span.set("exit_code", process.returncode)
+
+        self._check_result(process.returncode)
+
+
+def _write_stdin(stdin_pipe: Any, stdin: bytes) -> None:
+    """Writes input of the script and closes its stdin."""
+    try:
+        stdin_pipe.write(stdin)
+    except BrokenPipeError:
+        # Script exited without reading its input
+        pass
+    finally:
+        try:
+            stdin_pipe.close()
+        except BrokenPipeError:
+            pass
+
+
+def _capture_output(process: subprocess.Popen, stdin: bytes, task_log: TaskLog) -> None:
+    """Writes output of the script to the log until the script exits.
+
+    Input is written by another thread, so that a script writing a lot of
+    output before reading its input does not block.
+    """
+    stdin_thread = None
+    if stdin is not None:
+        stdin_thread = threading.Thread(
+            target=_write_stdin, args=(process.stdin, stdin), daemon=True
+        )
+        stdin_thread.start()
+
+    for chunk in iter(lambda: process.stdout.read1(OUTPUT_CHUNK_SIZE), b""):
+        task_log.write(chunk)
+
+    process.stdout.close()
+    process.wait()
+
+    if stdin_thread is not None:
+        stdin_thread.join()
+
+
+async def _capture_output_async(
+    process: asyncio.subprocess.Process, stdin: bytes, task_log: TaskLog
+) -> None:
+    """Writes output of the script to the log until the script exits."""
+
+    async def write_stdin() -> None:
+        try:
+            process.stdin.write(stdin)
+            await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # Script exited without reading its input
+            pass
+        process.stdin.close()
+
+    async def read_output() -> None:
+        while True:
+            chunk = await process.stdout.read(OUTPUT_CHUNK_SIZE)
+            if not chunk:
+                break
+            task_log.write(chunk)
+
+    if stdin is None:
+        await read_output()
+    else:
+        await asyncio.gather(write_stdin(), read_output())
+
+    await process.wait()
@@ -0,0 +1,71 @@
+"""Compiled parameter templates."""
+import re
+from functools import lru_cache
+from typing import Any, List, Mapping
+
+# Matches ${{parameters.NAME}} placeholders
+PLACEHOLDER_PATTERN = re.compile(r"\$\{\{parameters\.(.+?)\}\}")
+
+# Maximum number of compiled templates kept in memory
+TEMPLATE_CACHE_SIZE = 4096
+
+
+class Template:
+    """String parsed once into literal and placeholder segments.
+
+    Placeholders are replaced in a single pass, so parameter values containing
+    ${{parameters.NAME}} are not substituted again. Placeholders of parameters
+    which are not provided are kept as they are.
+    """
+
+    __slots__ = ("source", "_literals", "_keys", "_placeholders")
+
+    def __init__(self, source: str) -> None:
+        """Init."""
+        self.source = source
+
+        # Rendered string is _literals[0] + value of _keys[0] + _literals[1] ...
+        self._literals: List[str] = []
+        self._keys: List[str] = []
+        self._placeholders: List[str] = []
+
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(source):
+            self._literals.append(source[position : match.start()])
+            self._keys.append(match.group(1))
+            self._placeholders.append(match.group(0))
+            position = match.end()
+
+        self._literals.append(source[position:])
+
+    def render(self, parameters: Mapping[str, Any]) -> str:
+        """Returns the string with placeholders replaced by parameter values."""
+        if not self._keys:
+            return self.source
+
+        parts = [self._literals[0]]
+        for key, placeholder, literal in zip(
+            self._keys, self._placeholders, self._literals[1:]
+        ):
+            if key in parameters:
+                parts.append(str(parameters[key]))
+            else:
+                parts.append(placeholder)
+            parts.append(literal)
+
+        return "".join(parts)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(source: str) -> Template:
+    """Returns compiled template of the string, cached by its content."""
+    return Template(source)
+
+
+def render(s: str, parameters: Mapping[str, Any]) -> str:
+    """Replaces parameter placeholders of the string."""
+    # Strings without placeholders are not compiled nor cached
+    if "${{" not in s:
+        return s
+
+    return compile_template(s).render(parameters)
@@ -0,0 +1,288 @@
+"""Timing spans of pipeline runs and their Chrome trace export."""
+import os
+import json
+import time
+import asyncio
+import threading
+from typing import Any, Dict, List, Tuple
+
+from pypelines.event_loop import event_loop_thread
+
+# Width of the task column of the summary table
+SUMMARY_NAME_WIDTH = 48
+
+
+class Span:
+    """Span recorded when the context is exited."""
+
+    __slots__ = ("tracer", "name", "category", "group", "args", "start")
+
+    def __init__(
+        self,
+        tracer: "Tracer",
+        name: str,
+        category: str,
+        group: str,
+        args: Dict[str, Any],
+    ) -> None:
+        """Init."""
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.group = group
+        self.args = args
+        self.start = 0
+
+    def set(self, key: str, value: Any) -> None:
+        """Adds an argument shown with the span."""
+        self.args[key] = value
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+
+        self.tracer.add(
+            self.name,
+            self.category,
+            self.group,
+            self.start,
+            time.perf_counter_ns(),
+            self.args,
+        )
+
+
+class _NullSpan:
+    """Span of a disabled tracer, records nothing."""
+
+    __slots__ = ()
+
+    def set(self, key: str, value: Any) -> None:
+        """Ignores the argument."""
+        pass
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """Records spans of tasks, items and their phases from all the threads.
+
+    Spans are named after the task, and grouped in the summary by the task name
+    of the pipeline config, so that all the items of a fan-out are summarized
+    together. Spans recorded by coroutines of the event loop are shown in their
+    own lane per asyncio task.
+
+    At most max_events spans are kept for the trace file, later spans are only
+    counted in the summary. A disabled tracer records nothing.
+    """
+
+    def __init__(self, enabled: bool = False, max_events: int = 0) -> None:
+        """Init."""
+        self.enabled = enabled
+        self.max_events = max_events
+
+        # (name, category, lane, start_ns, end_ns, args)
+        self._events: List[Tuple] = []
+        self.dropped_events = 0
+
+        # Summary of each thread, (group, category) to [count, total_ns, max_ns]
+        self._local = threading.local()
+        self._summaries: List[Dict[Tuple[str, str], List[int]]] = []
+        self._lock = threading.Lock()
+
+        self._lane_names: Dict[Any, str] = {}
+        self._start_ns = time.perf_counter_ns()
+
+    def now(self) -> int:
+        """Returns current time of the spans, in nanoseconds."""
+        return time.perf_counter_ns()
+
+    def span(
+        self, name: str, category: str, group: str = None, args: Dict[str, Any] = None
+    ) -> Span:
+        """Returns span recorded when the context is exited."""
+        if not self.enabled:
+            return _NULL_SPAN
+
+        return Span(self, name, category, group or name, args or {})
+
+    def _get_summary(self) -> Dict[Tuple[str, str], List[int]]:
+        """Returns summary of the current thread."""
+        summary = getattr(self._local, "summary", None)
+
+        if summary is None:
+            summary = self._local.summary = {}
+            with self._lock:
+                self._summaries.append(summary)
+
+        return summary
+
+    def _get_lane(self) -> Any:
+        """Returns lane of the current thread, or of the current asyncio task
+        when called from the event loop."""
+        lane = threading.get_ident()
+
+        if lane == event_loop_thread.thread_ident:
+            task = asyncio.current_task()
+            if task is not None:
+                lane = ("asyncio", id(task))
+
+        if lane not in self._lane_names:
+            if isinstance(lane, tuple):
+                self._lane_names[lane] = f"asyncio task {len(self._lane_names)}"
+            else:
+                self._lane_names[lane] = threading.current_thread().name
+
+        return lane
+
+    def add(
+        self,
+        name: str,
+        category: str,
+        group: str,
+        start_ns: int,
+        end_ns: int,
+        args: Dict[str, Any] = None,
+    ) -> None:
+        """Records span which started and ended at given times."""
+        if not self.enabled:
+            return
+
+        duration_ns = end_ns - start_ns
+
+        summary = self._get_summary()
+        stats = summary.get((group, category))
+        if stats is None:
+            summary[(group, category)] = [1, duration_ns, duration_ns]
+        else:
+            stats[0] += 1
+            stats[1] += duration_ns
+            if duration_ns > stats[2]:
+                stats[2] = duration_ns
+
+        if len(self._events) >= self.max_events:
+            self.dropped_events += 1
+            return
+
+        self._events.append((name, category, self._get_lane(), start_ns, end_ns, args))
+
+    def get_summary(self) -> Dict[Tuple[str, str], List[int]]:
+        """Returns (group, category) to [count, total_ns, max_ns] of all the
+        threads."""
+        merged: Dict[Tuple[str, str], List[int]] = {}
+
+        with self._lock:
+            summaries = list(self._summaries)
+
+        for summary in summaries:
+            for key, (count, total_ns, max_ns) in list(summary.items()):
+                stats = merged.setdefault(key, [0, 0, 0])
+                stats[0] += count
+                stats[1] += total_ns
+                stats[2] = max(stats[2], max_ns)
+
+        return merged
+
+    def format_summary(self) -> str:
+        """Returns summary table of the spans, slowest groups first."""
+        rows = sorted(self.get_summary().items(), key=lambda x: x[1][1], reverse=True)
+
+        lines = [
+            "{:<{w}} {:<16} {:>9} {:>11} {:>11} {:>11}".format(
+                "Task",
+                "Phase",
+                "Count",
+                "Total s",
+                "Mean ms",
+                "Max ms",
+                w=SUMMARY_NAME_WIDTH,
+            )
+        ]
+
+        for (group, category), (count, total_ns, max_ns) in rows:
+            lines.append(
+                "{:<{w}} {:<16} {:>9} {:>11.3f} {:>11.3f} {:>11.3f}".format(
+                    group[:SUMMARY_NAME_WIDTH],
+                    category,
+                    count,
+                    total_ns / 1e9,
+                    total_ns / count / 1e6,
+                    max_ns / 1e6,
+                    w=SUMMARY_NAME_WIDTH,
+                )
+            )
+
+        if self.dropped_events:
+            lines.append(
+                f"{self.dropped_events} spans are not in the trace file, it is "
+                f"limited to {self.max_events} spans"
+            )
+
+        return "\n".join(lines)
+
+    def write_chrome_trace(self, path: str) -> None:
+        """Writes spans in Chrome trace event format, which can be opened with
+        chrome://tracing or Perfetto."""
+        pid = os.getpid()
+
+        lane_ids: Dict[Any, int] = {}
+        for lane in self._lane_names:
+            lane_ids[lane] = len(lane_ids) + 1
+
+        with open(path, "w") as f:
+            f.write('{"displayTimeUnit": "ms", "traceEvents": [\n')
+
+            for lane, lane_name in list(self._lane_names.items()):
+                f.write(
+                    json.dumps(
+                        {
+                            "ph": "M",
+                            "name": "thread_name",
+                            "pid": pid,
+                            "tid": lane_ids[lane],
+                            "args": {"name": lane_name},
+                        }
+                    )
+                    + ",\n"
+                )
+
+            for name, category, lane, start_ns, end_ns, args in self._events:
+                f.write(
+                    json.dumps(
+                        {
+                            "ph": "X",
+                            "name": name,
+                            "cat": category,
+                            "pid": pid,
+                            "tid": lane_ids[lane],
+                            "ts": (start_ns - self._start_ns) / 1000,
+                            "dur": (end_ns - start_ns) / 1000,
+                            "args": args or {},
+                        },
+                        default=str,
+                    )
+                    + ",\n"
+                )
+
+            # Trailing event, so that the list has no trailing comma
+            f.write(
+                json.dumps(
+                    {
+                        "ph": "M",
+                        "name": "process_name",
+                        "pid": pid,
+                        "args": {"name": "pypelines"},
+                    }
+                )
+                + "\n]}\n"
+            )
@@ -1,14 +1,8 @@
 """Util functions."""
 from hashlib import sha256
-from pymongo import MongoClient
-from typing import Any, Dict, List
-from pymongo.collection import Collection
+from typing import Any, Dict, List, Mapping
 
-from pypelines.config import (
-    DB_NAME,
-    DB_CONNECTION_STRING,
-    DB_SNAPSHOT_COLLECTION_NAME,
-)
+from pypelines import template
 
 
 def string_to_bool(val):
@@ -28,25 +22,20 @@ def string_to_bool(val):
     raise ValueError("Boolean value expected.")
 
 
-def replace_parameters_from_string(s: str, parameters: Dict[str, Any]) -> str:
+def replace_parameters_from_string(s: str, parameters: Mapping[str, Any]) -> str:
     """Replace parameters in string."""
-    s = str(s)
-
-    for key, value in parameters.items():
-        s = s.replace("${{parameters." + str(key) + "}}", str(value))
-
-    return s
+    return template.render(str(s), parameters)
 
 
 def replace_parameters_from_list(
-    array: List[Any], parameters: Dict[str, Any]
+    array: List[Any], parameters: Mapping[str, Any]
 ) -> List[Any]:
     """Replaces parameters from list items."""
     return [replace_parameters_from_anything(item, parameters) for item in array]
 
 
 def replace_parameters_from_dict(
-    obj: Dict[str, Any], parameters: Dict[str, Any]
+    obj: Dict[str, Any], parameters: Mapping[str, Any]
 ) -> Dict[str, Any]:
     """Replaces parameters from keys and values of dict."""
     return {
@@ -57,7 +46,7 @@ def replace_parameters_from_dict(
     }
 
 
-def replace_parameters_from_anything(obj: Any, parameters: Dict[str, Any]) -> Any:
+def replace_parameters_from_anything(obj: Any, parameters: Mapping[str, Any]) -> Any:
     """Replace parameters from if type of obj is dict,list,str, else returns obj."""
     if obj is None:
         return obj
@@ -84,11 +73,6 @@ def get_parameters_from_string_arguments(raw_parameters: List[str]) -> Dict[str,
     return parameters
 
 
-def get_snapshots_collection() -> Collection:
-    _client = MongoClient(DB_CONNECTION_STRING)
-    return _client[DB_NAME][DB_SNAPSHOT_COLLECTION_NAME]
-
-
 def sha256_hash(s: str) -> str:
     """Returns SHA256 of given string"""
     return sha256(s.encode()).hexdigest()
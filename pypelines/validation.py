@@ -1,5 +1,7 @@
 """Functions for validation."""
 import re
+from typing import Any
+from datetime import date, datetime
 
 
 def output_parameter_name(s: str) -> str:
@@ -13,3 +15,22 @@ def output_parameter_name(s: str) -> str:
         raise ValueError(f"Output parameter name '{s}' contains invalid characters.")
 
     return s
+
+
+def timestamp(value: Any) -> float:
+    """Converts datetime, ISO 8601 date string or unix timestamp to unix timestamp."""
+    if isinstance(value, datetime):
+        return value.timestamp()
+
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day).timestamp()
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        raise ValueError(f"'{value}' is not a valid date or timestamp.")
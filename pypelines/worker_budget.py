@@ -0,0 +1,87 @@
+"""Pipeline-wide budget of running workers."""
+import asyncio
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Iterator
+
+
+class WorkerBudget:
+    """Limits number of items running at once in all the thread pools of the
+    pipeline.
+
+    A worker thread holds a token while it runs an item. When the item runs a
+    nested fan-out, the thread lends its token while it waits for the nested
+    items, so that nested fan-outs never wait for tokens held by their parents.
+    Scripts run on the event loop hold a token while their process is alive.
+    """
+
+    def __init__(self, max_workers: int) -> None:
+        """Init, max_workers of 0 means no limit."""
+        self.max_workers = max_workers
+
+        self._semaphore = (
+            threading.BoundedSemaphore(max_workers) if max_workers > 0 else None
+        )
+        # Whether the current thread holds a token
+        self._local = threading.local()
+
+    def _acquire(self) -> None:
+        """Takes a token for the current thread."""
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+        self._local.holds_token = True
+
+    def _release(self) -> None:
+        """Gives back token of the current thread."""
+        self._local.holds_token = False
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def run(self, fn: Callable, *args: Any) -> Any:
+        """Runs fn(*args) in the current thread once a token is available."""
+        self._acquire()
+
+        try:
+            return fn(*args)
+        finally:
+            self._release()
+
+    @contextmanager
+    def lend(self) -> Iterator[None]:
+        """Gives back token of the current thread, if it holds one, until the
+        block is finished. Use it while waiting for nested items."""
+        if not getattr(self._local, "holds_token", False):
+            yield
+            return
+
+        self._release()
+        try:
+            yield
+        finally:
+            self._acquire()
+
+    @asynccontextmanager
+    async def hold_async(self) -> AsyncIterator[None]:
+        """Holds a token until the block is finished, from the event loop.
+
+        The token is waited for in a thread of the default executor, so that
+        the event loop is not blocked.
+        """
+        if self._semaphore is None:
+            yield
+            return
+
+        acquired = asyncio.get_running_loop().run_in_executor(
+            None, self._semaphore.acquire
+        )
+        try:
+            await asyncio.shield(acquired)
+        except asyncio.CancelledError:
+            # Token taken after the item was cancelled is given back at once
+            acquired.add_done_callback(lambda _: self._semaphore.release())
+            raise
+
+        try:
+            yield
+        finally:
+            self._semaphore.release()
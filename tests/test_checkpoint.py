@@ -0,0 +1,212 @@
+"""Tests of byte offset checkpoints of lines."""
+import threading
+
+from pypelines import checkpoint as checkpoint_module
+from pypelines.checkpoint import LineOffsetCheckpoint
+
+KEY = "for-each-line-of-file:hash"
+FILE_IDENTITY = "100:1:1"
+# Seconds to wait for a blocked thread
+TIMEOUT = 10
+
+
+class FakeSnapshot:
+    """Snapshot keeping checkpoints in a dict."""
+
+    def __init__(self) -> None:
+        self.checkpoints = {}
+
+    def get_checkpoint(self, key: str) -> dict:
+        return self.checkpoints.get(key)
+
+    def set_checkpoint(self, key: str, value: dict) -> None:
+        self.checkpoints[key] = value
+
+
+def _create_checkpoint(
+    snapshot: FakeSnapshot, file_identity: str = FILE_IDENTITY
+) -> LineOffsetCheckpoint:
+    checkpoint = LineOffsetCheckpoint(
+        snapshot, KEY, save_interval=0, file_identity=file_identity
+    )
+    assert checkpoint.load()
+    return checkpoint
+
+
+def test_offset_moves_over_finished_prefix():
+    snapshot = FakeSnapshot()
+    checkpoint = _create_checkpoint(snapshot)
+
+    for start in range(0, 40, 10):
+        checkpoint.start_line(start, start + 10)
+
+    checkpoint.finish_line(10, succeeded=True)
+    checkpoint.finish_line(0, succeeded=False)
+    checkpoint.finish_line(30, succeeded=True)
+    checkpoint.save()
+
+    assert snapshot.checkpoints[KEY] == {
+        "file_identity": FILE_IDENTITY,
+        "offset": 20,
+        "completed_offsets": [30],
+        "failed_offsets": [0],
+    }
+
+
+def test_resume_keeps_failed_lines_until_retried_successfully():
+    snapshot = FakeSnapshot()
+    snapshot.checkpoints[KEY] = {
+        "file_identity": FILE_IDENTITY,
+        "offset": 40,
+        "completed_offsets": [],
+        "failed_offsets": [10, 20, 30],
+    }
+
+    checkpoint = _create_checkpoint(snapshot)
+    assert checkpoint.loaded_failed_offsets == [10, 20, 30]
+
+    checkpoint.finish_retried_line(10, succeeded=True)
+    checkpoint.finish_retried_line(20, succeeded=False)
+    checkpoint.start_line(40, 50)
+    checkpoint.finish_line(40, succeeded=True)
+    checkpoint.save()
+
+    saved = snapshot.checkpoints[KEY]
+    assert saved["offset"] == 50
+    # 20 failed again and 30 was not retried yet
+    assert saved["failed_offsets"] == [20, 30]
+
+    # Next run retries only the remaining lines
+    resumed = _create_checkpoint(snapshot)
+    assert resumed.offset == 50
+    assert resumed.loaded_failed_offsets == [20, 30]
+
+
+def test_checkpoint_of_another_file_version_is_ignored():
+    snapshot = FakeSnapshot()
+    snapshot.checkpoints[KEY] = {
+        "file_identity": FILE_IDENTITY,
+        "offset": 40,
+        "completed_offsets": [60],
+        "failed_offsets": [10],
+    }
+
+    checkpoint = LineOffsetCheckpoint(
+        snapshot, KEY, save_interval=0, file_identity="120:2:1"
+    )
+
+    assert not checkpoint.load()
+    assert checkpoint.offset == 0
+    assert checkpoint.loaded_completed_offsets == set()
+    assert checkpoint.loaded_failed_offsets == []
+
+
+def test_clear_stores_empty_checkpoint():
+    snapshot = FakeSnapshot()
+    snapshot.checkpoints[KEY] = {
+        "file_identity": FILE_IDENTITY,
+        "offset": 40,
+        "completed_offsets": [],
+        "failed_offsets": [10],
+    }
+
+    checkpoint = _create_checkpoint(snapshot)
+    checkpoint.clear()
+
+    assert snapshot.checkpoints[KEY] == {
+        "file_identity": FILE_IDENTITY,
+        "offset": 0,
+        "completed_offsets": [],
+        "failed_offsets": [],
+    }
+
+
+def test_start_line_waits_for_held_lines():
+    checkpoint = LineOffsetCheckpoint(
+        FakeSnapshot(),
+        KEY,
+        save_interval=0,
+        file_identity=FILE_IDENTITY,
+        max_held_lines=2,
+    )
+    checkpoint.start_line(0, 10)
+    checkpoint.start_line(10, 20)
+    # Completed out of order, still held behind the first line
+    checkpoint.finish_line(10, succeeded=True)
+
+    started = threading.Event()
+    thread = threading.Thread(
+        target=lambda: (checkpoint.start_line(20, 30), started.set()), daemon=True
+    )
+    thread.start()
+
+    assert not started.wait(0.2)
+
+    checkpoint.finish_line(0, succeeded=True)
+
+    assert started.wait(TIMEOUT)
+    assert checkpoint.offset == 20
+
+
+def test_lines_are_not_held_when_too_many_failed(monkeypatch):
+    monkeypatch.setattr(checkpoint_module, "MAX_CHECKPOINT_OFFSETS", 2)
+    snapshot = FakeSnapshot()
+    checkpoint = LineOffsetCheckpoint(
+        snapshot,
+        KEY,
+        save_interval=0,
+        file_identity=FILE_IDENTITY,
+        max_held_lines=3,
+    )
+
+    for start in range(0, 30, 10):
+        checkpoint.start_line(start, start + 10)
+    checkpoint.finish_line(20, succeeded=True)
+    for start in range(0, 20, 10):
+        checkpoint.finish_line(start, succeeded=False)
+
+    checkpoint.start_line(30, 40)
+    checkpoint.finish_line(30, succeeded=False)
+
+    # Low-water mark stopped moving, following lines neither wait nor are held
+    for start in range(40, 100, 10):
+        checkpoint.start_line(start, start + 10)
+        checkpoint.finish_line(start, succeeded=True)
+    checkpoint.save()
+
+    assert snapshot.checkpoints[KEY] == {
+        "file_identity": FILE_IDENTITY,
+        "offset": 30,
+        "completed_offsets": [],
+        "failed_offsets": [0, 10],
+    }
+
+
+def test_checkpoint_is_saved_in_the_background():
+    saved = threading.Event()
+    saving_threads = []
+
+    class SavingSnapshot(FakeSnapshot):
+        def set_checkpoint(self, key: str, value: dict) -> None:
+            super().set_checkpoint(key, value)
+            saving_threads.append(threading.current_thread())
+            saved.set()
+
+    snapshot = SavingSnapshot()
+    checkpoint = LineOffsetCheckpoint(
+        snapshot, KEY, save_interval=0.05, file_identity=FILE_IDENTITY
+    )
+    checkpoint.load()
+    checkpoint.start()
+
+    checkpoint.start_line(0, 10)
+    checkpoint.finish_line(0, succeeded=True)
+
+    assert saved.wait(TIMEOUT)
+    assert threading.current_thread() not in saving_threads
+
+    checkpoint.start_line(10, 20)
+    checkpoint.finish_line(10, succeeded=True)
+    checkpoint.close()
+
+    assert snapshot.checkpoints[KEY]["offset"] == 20
@@ -0,0 +1,143 @@
+"""Tests of the index of files processed by incremental tasks."""
+import os
+
+import pytest
+
+from pypelines.pipeline import Pipeline
+from pypelines.file_index import FileIndex
+from pypelines.snapshot_stores.store_memory import MemorySnapshotStore
+
+PIPELINE_NAME = "pipeline"
+INDEX_KEY = "for-each-file:hash"
+
+
+@pytest.fixture(autouse=True)
+def memory_store():
+    MemorySnapshotStore.reset()
+    yield
+    MemorySnapshotStore.reset()
+
+
+class FailingStore(MemorySnapshotStore):
+    """Memory store failing to write file index entries while fail is set."""
+
+    fail = False
+
+    def set_file_index_entries(self, pipeline_name, index_key, entries):
+        if self.fail:
+            raise IOError("Store is not available")
+
+        super().set_file_index_entries(pipeline_name, index_key, entries)
+
+
+def _load_entries(store) -> dict:
+    return {
+        path: (size, mtime_ns, content_hash)
+        for path, size, mtime_ns, content_hash in store.iter_file_index(
+            PIPELINE_NAME, INDEX_KEY
+        )
+    }
+
+
+def test_updates_of_failed_flush_are_written_by_next_flush():
+    store = FailingStore()
+    file_index = FileIndex(
+        store, PIPELINE_NAME, INDEX_KEY, flush_size=100, flush_interval=100
+    )
+    file_index.update("a", 1, 1, None)
+    file_index.update("b", 1, 1, None)
+
+    store.fail = True
+    with pytest.raises(IOError):
+        file_index.flush()
+
+    # Newer update of the same file replaces the failed one
+    file_index.update("b", 2, 2, None)
+    store.fail = False
+    file_index.flush()
+
+    assert _load_entries(store) == {"a": (1, 1, None), "b": (2, 2, None)}
+
+
+def test_loaded_entries_are_popped_once():
+    store = MemorySnapshotStore()
+    store.set_file_index_entries(
+        PIPELINE_NAME, INDEX_KEY, [("a", 1, 1, None), ("b", 2, 2, "hash")]
+    )
+
+    file_index = FileIndex(
+        store, PIPELINE_NAME, INDEX_KEY, flush_size=100, flush_interval=100
+    )
+    file_index.load()
+
+    assert file_index.pop("b") == (2, 2, "hash")
+    assert file_index.pop("b") is None
+    assert file_index.pop_remaining_paths() == ["a"]
+
+
+@pytest.mark.parametrize("executor", ["threads", "asyncio"])
+def test_incremental_for_each_file_runs_new_and_changed_files(tmp_path, executor):
+    input_path = tmp_path / "input"
+    input_path.mkdir()
+    for name in ["a", "b", "c"]:
+        (input_path / f"{name}.txt").write_text(name)
+
+    output_path = tmp_path / "output.txt"
+    script = {
+        "task": "script",
+        "name": "process ${{parameters.f}}",
+        "inputs": {
+            "arguments": ["${{parameters.f}}", "${{parameters.value}}"],
+            "script": f'#!/bin/sh\necho "$(basename $1) $2" >> {output_path}\n',
+        },
+    }
+
+    def run(value: str = "1") -> list:
+        pipeline = Pipeline()
+        pipeline.load(
+            {
+                "parameters": [{"name": "value"}],
+                "config": {
+                    "name": f"Incremental {executor}",
+                    "use-snapshots": True,
+                    "snapshot-backend": "memory",
+                },
+                "tasks": [
+                    {
+                        "task": "for-each-file",
+                        "name": "files",
+                        "inputs": {
+                            "glob-pattern": str(input_path / "*.txt"),
+                            "include-subdirectories": False,
+                            "incremental": True,
+                            "incremental-fingerprint": "content",
+                            "executor": executor,
+                            "output-parameter-name": "f",
+                            "tasks": [script],
+                        },
+                    }
+                ],
+            },
+            {"value": value},
+        )
+        pipeline.run()
+
+        if not output_path.exists():
+            return []
+
+        lines = sorted(output_path.read_text().splitlines())
+        output_path.unlink()
+        return lines
+
+    assert run() == ["a.txt 1", "b.txt 1", "c.txt 1"]
+    assert run() == []
+
+    # Same content with a new modification time is unchanged
+    stat = os.stat(input_path / "a.txt")
+    os.utime(input_path / "a.txt", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    (input_path / "b.txt").write_text("changed")
+    (input_path / "d.txt").write_text("d")
+    assert run() == ["b.txt 1", "d.txt 1"]
+
+    # Files are processed again when the sub-tasks change
+    assert run("2") == ["a.txt 2", "b.txt 2", "c.txt 2", "d.txt 2"]
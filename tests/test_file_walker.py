@@ -0,0 +1,64 @@
+"""Tests of the lazy walking of files."""
+import os
+
+import pytest
+
+from pypelines.file_walker import FileWalker
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """Creates a tree of files, with a symlinked directory and hidden files."""
+    (tmp_path / "sub" / "deep").mkdir(parents=True)
+    (tmp_path / "a.txt").write_text("a")
+    (tmp_path / "big.txt").write_text("b" * 100)
+    (tmp_path / "b.log").write_text("b")
+    (tmp_path / ".hidden.txt").write_text("h")
+    (tmp_path / "sub" / "c.txt").write_text("c")
+    (tmp_path / "sub" / "deep" / "d.txt").write_text("d")
+    os.symlink(tmp_path / "sub", tmp_path / "linked")
+    return tmp_path
+
+
+def _walk(tree, pattern: str, **kwargs) -> list:
+    walker = FileWalker(str(tree / pattern), **kwargs)
+    return sorted(os.path.relpath(path, tree) for path in walker)
+
+
+def test_pattern_is_matched(tree):
+    assert _walk(tree, "*.txt") == ["a.txt", "big.txt"]
+
+
+def test_subdirectories_are_included(tree):
+    assert _walk(tree, "**/*.txt", include_subdirectories=True) == [
+        "a.txt",
+        "big.txt",
+        "linked/c.txt",
+        "linked/deep/d.txt",
+        "sub/c.txt",
+        "sub/deep/d.txt",
+    ]
+
+
+def test_symlinks_are_not_followed(tree):
+    assert _walk(
+        tree, "**/*.txt", include_subdirectories=True, follow_symlinks=False
+    ) == ["a.txt", "big.txt", "sub/c.txt", "sub/deep/d.txt"]
+
+
+def test_excluded_paths_are_skipped(tree):
+    assert _walk(
+        tree,
+        "**/*",
+        include_subdirectories=True,
+        follow_symlinks=False,
+        exclude_patterns=["*.log", "big*", "*/deep*"],
+    ) == ["a.txt", "sub", "sub/c.txt"]
+
+
+def test_stat_filters(tree):
+    assert _walk(tree, "*", min_size=10) == ["big.txt"]
+    assert _walk(tree, "*", max_size=10) == ["a.txt", "b.log"]
+
+    os.utime(tree / "a.txt", (0, 0))
+    assert _walk(tree, "*.txt", modified_since=1) == ["big.txt"]
@@ -0,0 +1,81 @@
+"""Tests of the live metrics of pipeline runs."""
+import threading
+
+import pytest
+
+from pypelines.metrics import (
+    ITEMS_FAILED,
+    ITEMS_STARTED,
+    LATENCY_BUCKETS,
+    ITEMS_COMPLETED,
+    ITEMS_SUBMITTED,
+    TASKS_COMPLETED,
+    Metrics,
+    get_quantile,
+)
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics("pipeline")
+
+    metrics.get("task").add(TASKS_COMPLETED)
+
+    assert not metrics.enabled
+    assert "task=" not in metrics.format()
+
+
+def test_counters_of_all_the_threads_are_summed(tmp_path):
+    metrics = Metrics("pipeline", metrics_file=str(tmp_path / "metrics.prom"))
+    task_metrics = metrics.get("items")
+
+    def run() -> None:
+        for _ in range(1000):
+            task_metrics.add(ITEMS_COMPLETED)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert task_metrics.get_totals()[0][ITEMS_COMPLETED] == 4000
+
+
+def test_quantiles_are_interpolated_inside_buckets():
+    latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+    latency_counts[1] = 10
+
+    assert get_quantile(latency_counts, 0.5) == pytest.approx(
+        (LATENCY_BUCKETS[0] + LATENCY_BUCKETS[1]) / 2
+    )
+
+    latency_counts[-1] = 90
+    assert get_quantile(latency_counts, 0.99) == LATENCY_BUCKETS[-1]
+
+
+def test_metrics_file_is_written_on_close(tmp_path):
+    metrics_path = tmp_path / "metrics.prom"
+    metrics = Metrics("pipe\"line", metrics_file=str(metrics_path), interval=3600)
+    metrics.start()
+
+    task_metrics = metrics.get("items")
+    task_metrics.add(ITEMS_SUBMITTED, 3)
+    task_metrics.add(ITEMS_STARTED, 2)
+    task_metrics.add(ITEMS_COMPLETED)
+    task_metrics.add(ITEMS_FAILED)
+    task_metrics.add_latency(0.5)
+    metrics.get("task").add(TASKS_COMPLETED)
+
+    metrics.close()
+
+    lines = metrics_path.read_text().splitlines()
+    labels = 'pipeline="pipe\\"line",task="items"'
+
+    assert f'pypelines_items_total{{{labels},result="failed"}} 1' in lines
+    assert f"pypelines_items_in_flight{{{labels}}} 1" in lines
+    assert f"pypelines_items_queued{{{labels}}} 1" in lines
+    assert f"pypelines_item_latency_seconds_count{{{labels}}} 1" in lines
+    assert (
+        'pypelines_tasks_total{pipeline="pipe\\"line",task="task",result="completed"} 1'
+        in lines
+    )
@@ -0,0 +1,158 @@
+"""Regression tests of nested fan-outs on the asyncio executor."""
+import threading
+
+from pypelines.pipeline import Pipeline
+
+# Seconds to wait for the pipeline before it is considered deadlocked
+TIMEOUT = 60
+
+
+def _for_each_line(
+    name: str, parameter_name: str, file_path: str, threads: int, tasks: list
+) -> dict:
+    """Returns config of a for-each-line-of-file task."""
+    return {
+        "task": "for-each-line-of-file",
+        "name": name,
+        "inputs": {
+            "threads": threads,
+            "file-path": file_path,
+            "output-parameter-name": parameter_name,
+            "tasks": tasks,
+        },
+    }
+
+
+def test_nested_asyncio_fan_outs_do_not_deadlock(tmp_path):
+    """Nested non-script fan-outs used to wait for threads of the default
+    executor of the event loop, held by their parents."""
+    outer_path = tmp_path / "outer.txt"
+    outer_path.write_text("".join(f"{i}\n" for i in range(16)))
+    inner_path = tmp_path / "inner.txt"
+    inner_path.write_text("1\n2\n3\n")
+
+    output_path = tmp_path / "output.txt"
+    script = {
+        "task": "script",
+        "name": "echo ${{parameters.a}} ${{parameters.b}} ${{parameters.c}}",
+        "inputs": {
+            "arguments": ["${{parameters.a}} ${{parameters.b}} ${{parameters.c}}"],
+            "script": f'#!/bin/sh\necho "$1" >> {output_path}\n',
+        },
+    }
+    config = {
+        "config": {
+            "name": "Nested asyncio fan-outs",
+            "use-snapshots": False,
+            "snapshot-backend": "memory",
+            "fan-out-executor": "asyncio",
+        },
+        "tasks": [
+            _for_each_line(
+                "outer",
+                "a",
+                str(outer_path),
+                16,
+                [
+                    _for_each_line(
+                        "middle ${{parameters.a}}",
+                        "b",
+                        str(inner_path),
+                        2,
+                        [
+                            _for_each_line(
+                                "inner ${{parameters.a}} ${{parameters.b}}",
+                                "c",
+                                str(inner_path),
+                                2,
+                                [script],
+                            )
+                        ],
+                    )
+                ],
+            )
+        ],
+    }
+
+    pipeline = Pipeline()
+    pipeline.load(config, {})
+
+    errors = []
+
+    def run():
+        try:
+            pipeline.run()
+        except BaseException as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(TIMEOUT)
+
+    assert not thread.is_alive(), "pipeline is deadlocked"
+    assert errors == []
+    assert len(output_path.read_text().splitlines()) == 16 * 3 * 3
+
+
+def test_nested_asyncio_fan_outs_run_at_most_max_workers_scripts(tmp_path):
+    """Scripts of asyncio items used to give back their worker token while they
+    ran, so nested fan-outs ran more scripts than max-workers."""
+    outer_path = tmp_path / "outer.txt"
+    outer_path.write_text("1\n2\n3\n4\n")
+
+    output_path = tmp_path / "output.txt"
+    script = {
+        "task": "script",
+        "name": "sleep ${{parameters.a}} ${{parameters.b}}",
+        "inputs": {
+            "script": (
+                f"#!/bin/sh\necho start $(date +%s%N) >> {output_path}\n"
+                f"sleep 0.2\necho end $(date +%s%N) >> {output_path}\n"
+            ),
+        },
+    }
+    config = {
+        "config": {
+            "name": "Nested asyncio fan-outs budget",
+            "use-snapshots": False,
+            "snapshot-backend": "memory",
+            "fan-out-executor": "asyncio",
+            "max-workers": 2,
+        },
+        "tasks": [
+            _for_each_line(
+                "outer",
+                "a",
+                str(outer_path),
+                4,
+                [
+                    _for_each_line(
+                        "inner ${{parameters.a}}",
+                        "b",
+                        str(outer_path),
+                        4,
+                        [script],
+                    )
+                ],
+            )
+        ],
+    }
+
+    pipeline = Pipeline()
+    pipeline.load(config, {})
+    pipeline.run()
+
+    events = sorted(
+        (int(timestamp), 1 if event == "start" else -1)
+        for event, timestamp in (
+            line.split() for line in output_path.read_text().splitlines()
+        )
+    )
+    assert len(events) == 4 * 4 * 2
+
+    running = max_running = 0
+    for _, change in events:
+        running += change
+        max_running = max(max_running, running)
+
+    assert max_running <= 2
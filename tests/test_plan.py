@@ -0,0 +1,86 @@
+"""Tests of the execution plan compiled from the pipeline tasks."""
+import pytest
+
+from pypelines.tasks import tasks
+from pypelines.plan import compile_task_plans
+
+
+def _script(name: str = "echo", **task) -> dict:
+    return {
+        "task": "script",
+        "name": name,
+        "inputs": {"script": "#!/bin/sh\necho $1\n", **task.pop("inputs", {})},
+        **task,
+    }
+
+
+def test_only_inputs_with_parameters_are_parsed_for_each_run():
+    (plan,) = compile_task_plans(
+        [
+            _script(
+                "echo ${{parameters.x}}",
+                inputs={
+                    "arguments": ["${{parameters.x}}"],
+                    "show-output": "false",
+                },
+                **{"input-files": "${{parameters.x}}.txt"},
+            )
+        ],
+        tasks,
+    )
+
+    assert plan.static_inputs["show-output"] is False
+    assert list(plan.dynamic_inputs) == ["arguments"]
+
+    parameters = {"x": "a"}
+    assert plan.get_name(parameters) == "echo a"
+    assert plan.get_input_files(parameters) == ["a.txt"]
+    assert plan.get_parsed_inputs(parameters)["arguments"] == ["a"]
+    assert plan.get_parsed_inputs({"x": "b"})["arguments"] == ["b"]
+
+
+def test_sub_tasks_are_compiled():
+    (plan,) = compile_task_plans(
+        [
+            {
+                "task": "for-each-line-of-file",
+                "name": "lines",
+                "inputs": {
+                    "file-path": "lines.txt",
+                    "output-parameter-name": "line",
+                    "tasks": [_script("echo ${{parameters.line}}")],
+                },
+            }
+        ],
+        tasks,
+    )
+
+    (sub_task,) = plan.static_inputs["tasks"]
+    assert sub_task.task_type == "script"
+    assert sub_task.name == "echo ${{parameters.line}}"
+
+
+@pytest.mark.parametrize(
+    "task_config,message",
+    [
+        ({"task": "missing", "name": "a"}, "was not found"),
+        ({"name": "a"}, "'task' is required"),
+        (_script(unknown=1), "not a valid key"),
+        (_script(inputs={"unknown": 1}), "not a valid input"),
+        (_script(inputs={"script": None}), "script is required"),
+        (_script(**{"depends-on": "other"}), "depends-on is not allowed"),
+    ],
+)
+def test_invalid_task_configs(task_config, message):
+    with pytest.raises(ValueError, match=message):
+        compile_task_plans([task_config], tasks)
+
+
+def test_dependencies_are_allowed_for_top_level_tasks():
+    plans = compile_task_plans(
+        [_script("a"), _script("b", **{"depends-on": "a"})],
+        tasks,
+        allow_depends_on=True,
+    )
+
+    assert [plan.depends_on for plan in plans] == [(), ("a",)]
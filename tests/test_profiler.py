@@ -0,0 +1,59 @@
+"""Tests of the sampling profiler."""
+import time
+import threading
+import subprocess
+
+from pypelines.profiler import (
+    IDLE,
+    ORCHESTRATION,
+    SUBPROCESS_WAIT,
+    SamplingProfiler,
+    _get_thread_group,
+)
+
+# Seconds the sampled threads run
+DURATION = 0.3
+
+
+def test_thread_groups_drop_the_index_of_the_thread():
+    assert _get_thread_group("ThreadPoolExecutor-0_12") == "ThreadPoolExecutor-0"
+    assert _get_thread_group("pypelines-event-loop") == "pypelines-event-loop"
+
+
+def test_samples_are_categorized(tmp_path):
+    stopped = threading.Event()
+
+    def busy() -> None:
+        deadline = time.monotonic() + DURATION
+        while time.monotonic() < deadline:
+            pass
+
+    def wait_for_script() -> None:
+        subprocess.Popen(["sleep", str(DURATION)]).wait()
+
+    threads = [
+        threading.Thread(target=busy, name="busy"),
+        threading.Thread(target=stopped.wait, args=(DURATION,), name="idle"),
+        threading.Thread(target=wait_for_script, name="script"),
+    ]
+
+    profiler = SamplingProfiler(interval=0.005)
+    profiler.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    profiler.stop()
+
+    profiler.write(str(tmp_path / "profile"))
+
+    roots = {
+        tuple(line.split(";")[:2])
+        for line in (tmp_path / "profile.collapsed").read_text().splitlines()
+    }
+    assert (ORCHESTRATION, "busy") in roots
+    assert (IDLE, "idle") in roots
+    assert (SUBPROCESS_WAIT, "script") in roots
+
+    summary = (tmp_path / "profile.txt").read_text()
+    assert "busy (" in summary
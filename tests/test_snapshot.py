@@ -0,0 +1,89 @@
+"""Tests of the completed tasks loaded by snapshots."""
+import pytest
+
+from pypelines.snapshot import Snapshot
+from pypelines.bloom_filter import BloomFilter
+from pypelines.constants import SnapshotWriteModes
+from pypelines.snapshot_stores.store_memory import MemorySnapshotStore
+
+PIPELINE_ID = "pipeline-id"
+PIPELINE_NAME = "pipeline"
+
+
+@pytest.fixture(autouse=True)
+def memory_store():
+    MemorySnapshotStore.reset()
+    yield
+    MemorySnapshotStore.reset()
+
+
+def _create_snapshot(store, preload_limit: int) -> Snapshot:
+    return Snapshot(
+        PIPELINE_ID,
+        PIPELINE_NAME,
+        store,
+        SnapshotWriteModes.SYNC,
+        flush_size=1,
+        flush_interval=3600,
+        preload_limit=preload_limit,
+    )
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom_filter = BloomFilter(capacity=1000)
+    keys = [f"key {i}" for i in range(1000)]
+    for key in keys:
+        bloom_filter.add(key)
+
+    assert all(key in bloom_filter for key in keys)
+
+    false_positives = sum(f"other {i}" in bloom_filter for i in range(10000))
+    assert false_positives < 10000 * 0.05
+
+
+@pytest.mark.parametrize("preload_limit", [10, 1], ids=["set", "bloom-filter"])
+def test_completed_tasks_are_preloaded(preload_limit):
+    store = MemorySnapshotStore()
+    store.create_snapshot_if_not_exist(PIPELINE_ID, PIPELINE_NAME)
+    store.set_tasks_completed(PIPELINE_ID, ["a", "b"])
+
+    snapshot = _create_snapshot(store, preload_limit)
+    snapshot.load_completed_tasks()
+
+    assert snapshot.is_task_completed("a")
+    assert snapshot.is_task_completed("b")
+    assert not snapshot.is_task_completed("c")
+
+    snapshot.set_task_completed("c")
+
+    assert snapshot.is_task_completed("c")
+    assert store.is_task_completed(PIPELINE_ID, "c")
+
+
+class CountingStore(MemorySnapshotStore):
+    """Memory store counting completed task lookups."""
+
+    lookups = 0
+
+    def is_task_completed(self, pipeline_id, task_hash):
+        self.lookups += 1
+        return super().is_task_completed(pipeline_id, task_hash)
+
+
+def test_bloom_filter_skips_lookups_of_tasks_which_are_not_completed():
+    store = CountingStore()
+    store.create_snapshot_if_not_exist(PIPELINE_ID, PIPELINE_NAME)
+    store.set_tasks_completed(PIPELINE_ID, [f"done {i}" for i in range(100)])
+
+    snapshot = _create_snapshot(store, preload_limit=10)
+    snapshot.load_completed_tasks()
+
+    assert all(snapshot.is_task_completed(f"done {i}") for i in range(100))
+    assert store.lookups == 100
+
+    store.lookups = 0
+    not_completed = sum(snapshot.is_task_completed(f"new {i}") for i in range(100))
+
+    assert not_completed == 0
+    # Only false positives of the filter are looked up in the store
+    assert store.lookups < 10
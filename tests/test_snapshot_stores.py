@@ -0,0 +1,217 @@
+"""Tests of the snapshot stores."""
+import time
+import uuid
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pypelines.constants import SnapshotCollectionFields
+from pypelines.snapshot_stores import store_mongodb
+from pypelines.snapshot_stores.store_sqlite import SQLiteSnapshotStore
+from pypelines.snapshot_stores.store_memory import MemorySnapshotStore
+
+PIPELINE_ID = "pipeline-id"
+PIPELINE_NAME = "pipeline"
+INDEX_KEY = "for-each-file:hash"
+
+
+def _create_mongodb_store(tmp_path, monkeypatch):
+    mongomock = pytest.importorskip("mongomock")
+    monkeypatch.setattr(store_mongodb, "MongoClient", mongomock.MongoClient)
+    return store_mongodb.MongoDBSnapshotStore(db_name=f"test-{uuid.uuid4()}")
+
+
+def _create_memory_store(tmp_path, monkeypatch):
+    MemorySnapshotStore.reset()
+    return MemorySnapshotStore()
+
+
+def _create_sqlite_store(tmp_path, monkeypatch):
+    return SQLiteSnapshotStore(str(tmp_path / "snapshots.db"))
+
+
+@pytest.fixture(
+    params=[_create_sqlite_store, _create_memory_store, _create_mongodb_store],
+    ids=["sqlite", "memory", "mongodb"],
+)
+def store(request, tmp_path, monkeypatch):
+    store = request.param(tmp_path, monkeypatch)
+    yield store
+    store.close()
+
+
+def _create_snapshot(store, pipeline_id: str = PIPELINE_ID) -> None:
+    store.create_snapshot_if_not_exist(pipeline_id, PIPELINE_NAME)
+    # Snapshots are ordered by their creation time
+    time.sleep(0.01)
+
+
+def test_last_snapshot_of_the_pipeline_is_found(store):
+    assert store.find_last_snapshot(PIPELINE_NAME) is None
+
+    _create_snapshot(store, "first")
+    _create_snapshot(store, "second")
+    # Existing snapshot is not created again
+    _create_snapshot(store, "first")
+    store.create_snapshot_if_not_exist("other", "other pipeline")
+
+    snapshot = store.find_last_snapshot(PIPELINE_NAME)
+    assert snapshot[SnapshotCollectionFields.RECORD_ID] == "second"
+    assert not snapshot[SnapshotCollectionFields.IS_COMPLETED]
+    assert not store.is_pipeline_completed("second")
+
+    store.set_pipeline_completed("second")
+
+    assert store.is_pipeline_completed("second")
+    assert store.find_last_snapshot(PIPELINE_NAME)[
+        SnapshotCollectionFields.IS_COMPLETED
+    ]
+
+
+def test_completed_tasks_are_stored_once(store):
+    _create_snapshot(store)
+    _create_snapshot(store, "other")
+
+    store.set_tasks_completed(PIPELINE_ID, ["a", "b"])
+    store.set_tasks_completed(PIPELINE_ID, ["b", "c"])
+    store.set_task_completed(PIPELINE_ID, "d")
+    store.set_tasks_completed(PIPELINE_ID, [])
+    store.set_task_completed("other", "e")
+
+    assert store.count_completed_tasks(PIPELINE_ID) == 4
+    assert sorted(store.iter_completed_tasks(PIPELINE_ID)) == ["a", "b", "c", "d"]
+    assert store.is_task_completed(PIPELINE_ID, "c")
+    assert not store.is_task_completed(PIPELINE_ID, "e")
+    assert store.is_task_completed("other", "e")
+
+
+def test_checkpoints_are_replaced(store):
+    _create_snapshot(store)
+
+    assert store.get_checkpoint(PIPELINE_ID, "key") is None
+
+    store.set_checkpoint(PIPELINE_ID, "key", {"offset": 10, "failed_offsets": [1]})
+    store.set_checkpoint(PIPELINE_ID, "key", {"offset": 20, "failed_offsets": []})
+
+    assert store.get_checkpoint(PIPELINE_ID, "key") == {
+        "offset": 20,
+        "failed_offsets": [],
+    }
+    assert store.get_checkpoint(PIPELINE_ID, "other key") is None
+    assert store.get_checkpoint("other", "key") is None
+
+
+def test_file_index_entries_are_replaced_and_deleted(store):
+    store.set_file_index_entries(
+        PIPELINE_NAME,
+        INDEX_KEY,
+        [("a", 1, 10, None), ("b", 2, 20, "hash"), ("c", 3, 30, None)],
+    )
+    store.set_file_index_entries(PIPELINE_NAME, INDEX_KEY, [("a", 4, 40, "new")])
+    store.set_file_index_entries(PIPELINE_NAME, "other key", [("d", 5, 50, None)])
+    store.delete_file_index_entries(PIPELINE_NAME, INDEX_KEY, ["c", "missing"])
+
+    assert sorted(store.iter_file_index(PIPELINE_NAME, INDEX_KEY)) == [
+        ("a", 4, 40, "new"),
+        ("b", 2, 20, "hash"),
+    ]
+    assert list(store.iter_file_index("other pipeline", INDEX_KEY)) == []
+
+
+def test_old_snapshots_are_deleted_with_their_records(store):
+    _create_snapshot(store, "old")
+    _create_snapshot(store, "kept")
+    store.set_tasks_completed("old", ["a"])
+    store.set_checkpoint("old", "key", {"offset": 1})
+    store.set_tasks_completed("kept", ["b"])
+
+    created_before = datetime.now()
+    _create_snapshot(store, "new")
+
+    assert store.delete_snapshots(PIPELINE_NAME, created_before, "kept") == 1
+
+    assert store.find_last_snapshot(PIPELINE_NAME)[
+        SnapshotCollectionFields.RECORD_ID
+    ] == "new"
+    assert store.count_completed_tasks("old") == 0
+    assert store.get_checkpoint("old", "key") is None
+    assert store.count_completed_tasks("kept") == 1
+
+
+@pytest.fixture
+def local_timezone(monkeypatch):
+    """Sets local time zone ahead of UTC, so that naive local times of version
+    1 snapshots are later than UTC times."""
+    monkeypatch.setenv("TZ", "Etc/GMT-5")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_mongodb_version_1_snapshots_are_migrated_once(
+    tmp_path, monkeypatch, local_timezone
+):
+    store = _create_mongodb_store(tmp_path, monkeypatch)
+    store._collection.insert_one(
+        {
+            SnapshotCollectionFields.RECORD_ID: "old",
+            SnapshotCollectionFields.PIPELINE_NAME: PIPELINE_NAME,
+            SnapshotCollectionFields.IS_COMPLETED: False,
+            SnapshotCollectionFields.CREATED_AT: datetime.now() - timedelta(hours=1),
+            SnapshotCollectionFields.COMPLETED_TASKS: ["a", "b"],
+        }
+    )
+
+    _create_snapshot(store, "new")
+
+    assert store.find_last_snapshot(PIPELINE_NAME)[
+        SnapshotCollectionFields.RECORD_ID
+    ] == "new"
+    assert sorted(store.iter_completed_tasks("old")) == ["a", "b"]
+    old_snapshot = store._collection.find_one(
+        {SnapshotCollectionFields.RECORD_ID: "old"}
+    )
+    assert SnapshotCollectionFields.COMPLETED_TASKS not in old_snapshot
+    assert old_snapshot[SnapshotCollectionFields.SCHEMA_VERSION] == (
+        store_mongodb.SCHEMA_VERSION
+    )
+
+    # Stores of later runs find the stored version and scan nothing
+    monkeypatch.setattr(
+        store_mongodb, "MongoClient", lambda *args, **kwargs: store._client
+    )
+    later_store = store_mongodb.MongoDBSnapshotStore(
+        db_name=store._collection.database.name
+    )
+
+    def fail():
+        raise AssertionError("Snapshots are migrated again")
+
+    later_store._migrate_version_1_snapshots = fail
+
+    assert later_store.find_last_snapshot(PIPELINE_NAME)[
+        SnapshotCollectionFields.RECORD_ID
+    ] == "new"
+
+
+def test_sqlite_connections_of_exited_threads_are_closed(tmp_path):
+    store = SQLiteSnapshotStore(str(tmp_path / "snapshots.db"))
+    store.create_snapshot_if_not_exist(PIPELINE_ID, PIPELINE_NAME)
+
+    for i in range(20):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(
+                pool.map(
+                    lambda j: store.set_checkpoint(PIPELINE_ID, f"{i}:{j}", {"j": j}),
+                    range(8),
+                )
+            )
+
+    try:
+        # Only the connection of the current thread is left
+        assert len(store._connections) == 1
+        assert store.get_checkpoint(PIPELINE_ID, "19:7") == {"j": 7}
+    finally:
+        store.close()
@@ -0,0 +1,94 @@
+"""Tests of the write-behind buffer of task completions."""
+import pytest
+
+from pypelines.snapshot_writer import SnapshotWriter
+from pypelines.constants import SnapshotWriteModes
+
+PIPELINE_ID = "pipeline-id"
+
+
+class FakeStore:
+    """Store keeping completed tasks in a list, failing while fail is set."""
+
+    def __init__(self) -> None:
+        self.completed_tasks = []
+        self.writes = 0
+        self.fail = False
+
+    def _write(self, task_hashes: list) -> None:
+        self.writes += 1
+        if self.fail:
+            raise IOError("Store is not available")
+
+        self.completed_tasks.extend(task_hashes)
+
+    def set_task_completed(self, pipeline_id: str, task_hash: str) -> None:
+        self._write([task_hash])
+
+    def set_tasks_completed(self, pipeline_id: str, task_hashes: list) -> None:
+        self._write(task_hashes)
+
+
+def _create_writer(store: FakeStore, write_mode: str) -> SnapshotWriter:
+    # Background flushes never run during the tests
+    return SnapshotWriter(
+        store, PIPELINE_ID, write_mode, flush_size=2, flush_interval=3600
+    )
+
+
+def test_sync_mode_writes_every_completion():
+    store = FakeStore()
+    writer = _create_writer(store, SnapshotWriteModes.SYNC)
+
+    writer.add("a")
+
+    assert store.completed_tasks == ["a"]
+    assert not writer.is_pending("a")
+    writer.close()
+
+
+def test_batched_mode_writes_full_batches():
+    store = FakeStore()
+    writer = _create_writer(store, SnapshotWriteModes.BATCHED)
+
+    writer.add("a")
+    assert store.completed_tasks == []
+    assert writer.is_pending("a")
+
+    writer.add("b")
+    assert store.completed_tasks == ["a", "b"]
+    assert not writer.is_pending("a")
+
+    writer.add("c")
+    writer.close()
+    assert store.completed_tasks == ["a", "b", "c"]
+
+
+def test_failed_batch_does_not_fail_the_completed_task():
+    store = FakeStore()
+    writer = _create_writer(store, SnapshotWriteModes.BATCHED)
+    store.fail = True
+
+    writer.add("a")
+    writer.add("b")
+    # Failed batch is retried in the background, not by every completion
+    writer.add("c")
+    writer.add("d")
+
+    assert store.writes == 1
+    assert writer.is_pending("a")
+
+    store.fail = False
+    writer.close()
+    assert store.completed_tasks == ["a", "b", "c", "d"]
+
+
+def test_close_raises_if_completions_cannot_be_written():
+    store = FakeStore()
+    writer = _create_writer(store, SnapshotWriteModes.ASYNC)
+    store.fail = True
+
+    writer.add("a")
+
+    with pytest.raises(IOError):
+        writer.close()
@@ -0,0 +1,97 @@
+"""Tests of the dependency graph of pipeline tasks."""
+import threading
+import concurrent.futures
+
+import pytest
+
+from pypelines.task_graph import TaskGraph
+
+# Seconds to wait for a task
+TIMEOUT = 10
+
+
+def test_tasks_run_after_their_dependencies():
+    graph = TaskGraph(
+        ["a", "b", "c", "d"],
+        [[], [], ["a", "b"], ["c"]],
+    )
+
+    finished = []
+    lock = threading.Lock()
+
+    def run_task(index, cancellation_token):
+        with lock:
+            finished.append(graph.names[index])
+
+    graph.run(run_task, max_parallel=2)
+
+    assert sorted(finished[:2]) == ["a", "b"]
+    assert finished[2:] == ["c", "d"]
+
+
+def test_independent_tasks_run_at_once():
+    graph = TaskGraph(["a", "b"], [[], []])
+    barrier = threading.Barrier(2, timeout=TIMEOUT)
+
+    graph.run(lambda index, cancellation_token: barrier.wait(), max_parallel=2)
+
+
+def test_dependents_of_failed_task_are_skipped():
+    graph = TaskGraph(
+        ["a", "b", "c", "d"],
+        [[], ["a"], ["b"], []],
+    )
+
+    ran = []
+
+    def run_task(index, cancellation_token):
+        ran.append(graph.names[index])
+        if graph.names[index] == "a":
+            raise ValueError("a failed")
+
+    with pytest.raises(ValueError, match="a failed"):
+        graph.run(run_task, max_parallel=1)
+
+    assert sorted(ran) == ["a", "d"]
+
+
+@pytest.mark.parametrize(
+    "names,depends_on,message",
+    [
+        (["a", "b"], [["b"], ["a"]], "circular dependencies"),
+        (["a"], [["missing"]], "does not exist"),
+        (["a", "a", "b"], [[], [], ["a"]], "multiple tasks"),
+    ],
+)
+def test_invalid_dependencies(names, depends_on, message):
+    with pytest.raises(ValueError, match=message):
+        TaskGraph(names, depends_on)
+
+
+def test_interrupt_cancels_and_waits_for_running_tasks(monkeypatch):
+    graph = TaskGraph(["a", "b"], [[], ["a"]])
+
+    started = threading.Event()
+    events = []
+
+    def run_task(index, cancellation_token):
+        started.set()
+        for _ in range(TIMEOUT * 100):
+            if cancellation_token.is_cancelled:
+                break
+            threading.Event().wait(0.01)
+
+        events.append(("finished", cancellation_token.is_cancelled))
+
+    def interrupted_wait(futures, return_when):
+        assert started.wait(TIMEOUT)
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(concurrent.futures, "wait", interrupted_wait)
+
+    with pytest.raises(KeyboardInterrupt):
+        graph.run(run_task, max_parallel=2)
+
+    # Running task was cancelled and finished before run() returned, its
+    # dependent never started
+    assert events == [("finished", True)]
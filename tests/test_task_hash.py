@@ -0,0 +1,112 @@
+"""Tests of input-aware task hashes."""
+import pytest
+
+from pypelines.pipeline import Pipeline
+from pypelines.snapshot_stores.store_memory import MemorySnapshotStore
+
+
+@pytest.fixture(autouse=True)
+def memory_store():
+    MemorySnapshotStore.reset()
+    yield
+    MemorySnapshotStore.reset()
+
+
+def _run_pipeline(tasks: list, parameters: dict = None) -> None:
+    pipeline = Pipeline()
+    pipeline.load(
+        {
+            "parameters": [{"name": "value", "default": "1"}],
+            "config": {
+                "name": "Task hash",
+                "use-snapshots": True,
+                "snapshot-backend": "memory",
+                "task-hash-mode": "inputs",
+            },
+            "tasks": tasks,
+        },
+        parameters or {},
+    )
+    pipeline.run()
+
+
+def _script(name: str, output_path, arguments: list, **task) -> dict:
+    """Returns config of a script task appending its arguments and the value of
+    the x environment variable to the output file."""
+    return {
+        "task": "script",
+        "name": name,
+        "inputs": {
+            "arguments": arguments,
+            "script": f"#!/bin/sh\necho $* $x >> {output_path}\n",
+        },
+        **task,
+    }
+
+
+def _read_lines(path) -> list:
+    if not path.exists():
+        return []
+
+    lines = path.read_text().splitlines()
+    path.unlink()
+    return lines
+
+
+def test_task_runs_again_when_inputs_change(tmp_path):
+    output_path = tmp_path / "output.txt"
+    tasks = [_script("echo", output_path, ["${{parameters.value}}"])]
+
+    _run_pipeline(tasks)
+    _run_pipeline(tasks)
+    assert _read_lines(output_path) == ["1"]
+
+    _run_pipeline(tasks, {"value": "2"})
+    assert _read_lines(output_path) == ["2"]
+
+
+def test_task_runs_again_when_input_files_change(tmp_path):
+    input_path = tmp_path / "input.txt"
+    input_path.write_text("a\n")
+    output_path = tmp_path / "output.txt"
+    tasks = [
+        _script("echo", output_path, ["ran"], **{"input-files": [str(input_path)]})
+    ]
+
+    _run_pipeline(tasks)
+    _run_pipeline(tasks)
+    assert _read_lines(output_path) == ["ran"]
+
+    input_path.write_text("a\nb\n")
+    _run_pipeline(tasks)
+    assert _read_lines(output_path) == ["ran"]
+
+
+def test_items_are_hashed_with_their_extra_parameters(tmp_path):
+    """Sub-tasks with the same name and inputs get values of the items only in
+    their environment."""
+    lines_path = tmp_path / "lines.txt"
+    lines_path.write_text("a\nb\nc\nd\n")
+    output_path = tmp_path / "output.txt"
+    tasks = [
+        {
+            "task": "for-each-line-of-file",
+            "name": "lines",
+            "inputs": {
+                "file-path": str(lines_path),
+                "output-parameter-name": "x",
+                "batch-size": 2,
+                "tasks": [_script("process", output_path, [])],
+            },
+        }
+    ]
+
+    _run_pipeline(tasks)
+    assert sorted(_read_lines(output_path)) == ["a b", "c d"]
+
+    _run_pipeline(tasks)
+    assert _read_lines(output_path) == []
+
+    lines_path.write_text("a\nb\nc\nZ\n")
+    _run_pipeline(tasks)
+    assert _read_lines(output_path) == ["c Z"]
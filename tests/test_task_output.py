@@ -0,0 +1,85 @@
+"""Tests of the captured output of scripts."""
+import os
+
+from pypelines.constants import OutputModes
+from pypelines.task_output import (
+    PIPELINE_LOG_FILE_NAME,
+    PROGRESS_PREFIX,
+    TaskOutput,
+    _get_file_name,
+)
+
+
+def _create_output(tmp_path, mode: str, max_file_size: int = 0) -> TaskOutput:
+    return TaskOutput(
+        mode,
+        str(tmp_path),
+        max_file_size=max_file_size,
+        backup_count=2,
+        sample_interval=3600,
+    )
+
+
+def test_runs_of_a_task_write_to_its_file(tmp_path):
+    task_output = _create_output(tmp_path, OutputModes.TASK_FILES)
+
+    first_log = task_output.open_log("task")
+    second_log = task_output.open_log("task")
+    first_log.write(b"first\n")
+    second_log.write(b"second\n")
+    first_log.close()
+    second_log.close()
+    task_output.close()
+
+    assert (tmp_path / _get_file_name("task")).read_bytes() == b"first\nsecond\n"
+
+
+def test_task_files_are_truncated(tmp_path):
+    task_output = _create_output(tmp_path, OutputModes.TASK_FILES, max_file_size=10)
+
+    task_log = task_output.open_log("task")
+    task_log.write(b"12345678")
+    task_log.write(b"90abcdef")
+    task_log.write(b"dropped")
+    task_log.close()
+    task_output.close()
+
+    output = (tmp_path / _get_file_name("task")).read_text()
+    assert output.startswith("1234567890\n[pypelines] Log truncated")
+    assert "dropped" not in output
+    assert task_output.truncated_logs == 1
+
+
+def test_lines_of_the_pipeline_file_are_prefixed(tmp_path):
+    task_output = _create_output(tmp_path, OutputModes.PIPELINE_FILE)
+
+    task_log = task_output.open_log("task")
+    task_log.write(b"a\nb")
+    task_output.print_progress("progress")
+    task_log.write(b"c\n")
+    task_log.write(b"partial")
+    task_log.close()
+    task_output.close()
+
+    assert (tmp_path / PIPELINE_LOG_FILE_NAME).read_text().splitlines() == [
+        "[task] a",
+        PROGRESS_PREFIX + "progress",
+        "[task] bc",
+        "[task] partial",
+    ]
+
+
+def test_pipeline_file_is_rotated(tmp_path):
+    task_output = _create_output(tmp_path, OutputModes.PIPELINE_FILE, max_file_size=8)
+
+    task_log = task_output.open_log("t")
+    for line in [b"1\n", b"2\n", b"3\n", b"4\n"]:
+        task_log.write(line)
+    task_log.close()
+    task_output.close()
+
+    log_path = tmp_path / PIPELINE_LOG_FILE_NAME
+    assert log_path.read_text() == "[t] 4\n"
+    assert (tmp_path / f"{PIPELINE_LOG_FILE_NAME}.1").read_text() == "[t] 3\n"
+    assert (tmp_path / f"{PIPELINE_LOG_FILE_NAME}.2").read_text() == "[t] 2\n"
+    assert not os.path.exists(f"{log_path}.3")
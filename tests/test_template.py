@@ -0,0 +1,31 @@
+"""Tests of the parameter templates."""
+from pypelines.template import Template, compile_template, render
+
+
+def test_placeholders_are_replaced():
+    template = Template("a ${{parameters.x}} b ${{parameters.y}}${{parameters.x}}")
+
+    assert template.render({"x": 1, "y": "Y"}) == "a 1 b Y1"
+
+
+def test_placeholders_of_missing_parameters_are_kept():
+    assert render("${{parameters.x}} ${{parameters.y}}", {"x": "X"}) == (
+        "X ${{parameters.y}}"
+    )
+
+
+def test_values_are_not_substituted_again():
+    assert render("${{parameters.x}}", {"x": "${{parameters.y}}", "y": "Y"}) == (
+        "${{parameters.y}}"
+    )
+
+
+def test_strings_without_placeholders_are_not_compiled():
+    compile_template.cache_clear()
+
+    assert render("no placeholders", {"x": "X"}) == "no placeholders"
+    assert compile_template.cache_info().currsize == 0
+
+    render("${{parameters.x}}", {"x": "X"})
+    render("${{parameters.x}}", {"x": "Z"})
+    assert compile_template.cache_info().currsize == 1
@@ -0,0 +1,67 @@
+"""Tests of the timing spans and their trace export."""
+import json
+import threading
+
+import pytest
+
+from pypelines.tracing import Tracer
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer(enabled=False, max_events=10)
+
+    with tracer.span("task", "script") as span:
+        span.set("pid", 1)
+
+    assert tracer.get_summary() == {}
+
+
+def test_spans_of_all_the_threads_are_summarized_by_group():
+    tracer = Tracer(enabled=True, max_events=100)
+
+    def run(index: int) -> None:
+        with tracer.span(f"item {index}", "script", "items"):
+            pass
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    tracer.add("other", "spawn", "other", 0, 2000)
+
+    summary = tracer.get_summary()
+    assert summary[("items", "script")][0] == 4
+    assert summary[("other", "spawn")] == [1, 2000, 2000]
+    assert "items" in tracer.format_summary()
+
+
+def test_failed_spans_record_the_error():
+    tracer = Tracer(enabled=True, max_events=100)
+
+    with pytest.raises(ValueError):
+        with tracer.span("task", "script"):
+            raise ValueError()
+
+    assert tracer._events[0][5] == {"error": "ValueError"}
+
+
+def test_chrome_trace_is_limited_to_max_events(tmp_path):
+    tracer = Tracer(enabled=True, max_events=2)
+
+    for index in range(3):
+        with tracer.span(f"task {index}", "script") as span:
+            span.set("index", index)
+
+    trace_path = tmp_path / "trace.json"
+    tracer.write_chrome_trace(str(trace_path))
+
+    events = json.loads(trace_path.read_text())["traceEvents"]
+    spans = [event for event in events if event["ph"] == "X"]
+
+    assert [span["name"] for span in spans] == ["task 0", "task 1"]
+    assert spans[1]["args"] == {"index": 1}
+    assert tracer.dropped_events == 1
+    assert tracer.get_summary()[("task 2", "script")][0] == 1
+    assert "1 spans are not in the trace file" in tracer.format_summary()